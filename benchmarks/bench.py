@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the journal's hot paths at realistic data sizes.
+
+Seeds a SQLite database per size with code-heavy Markdown entries, then
+drives the WSGI app through WebTest and reports p50/p95/p99 latency and
+throughput for each scenario. Results are written as JSON and can be
+compared against a saved baseline; the run exits non-zero when any
+scenario's p95 regresses past the tolerance.
+
+    python benchmarks/bench.py --sizes 1000,10000 --save-baseline
+    python benchmarks/bench.py --sizes 1000,10000 --baseline \
+        benchmarks/baseline.json
+"""
+from __future__ import division, print_function
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+
+from sqlalchemy import create_engine
+import transaction
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from journalapp.migrations import upgrade  # noqa: E402
+from journalapp.models import DBSession, Entry, render_markdown  # noqa
+from journalapp.pagination import encode_cursor  # noqa: E402
+
+clock = getattr(__import__('time'), 'perf_counter', None)
+if clock is None:  # Python 2
+    from time import time as clock
+
+USERNAME = 'admin'
+PASSWORD = 'benchmark'
+RESULTS_DIR = os.path.join(HERE, 'results')
+DEFAULT_BASELINE = os.path.join(HERE, 'baseline.json')
+SEED_BATCH = 5000
+
+CODE_SAMPLES = [
+    ('python', 'def fib(n):\n    a, b = 0, 1\n    for _ in range(n):\n'
+               '        a, b = b, a + b\n    return a\n'),
+    ('javascript', 'const total = items\n  .filter(x => x.ok)\n'
+                   '  .reduce((sum, x) => sum + x.value, 0);\n'),
+    ('sql', 'SELECT id, title FROM entries\nWHERE created < now()\n'
+            'ORDER BY created DESC, id DESC LIMIT 20;\n'),
+    ('bash', 'for f in *.py; do\n  python -m pyflakes "$f" || exit 1\n'
+             'done\n'),
+]
+
+
+def entry_text(number, rng):
+    """Return a Markdown body with prose and several fenced code blocks."""
+    parts = ['# Day {}\n'.format(number),
+             'Today I learned about *keyset pagination* and **indexes**.\n']
+    for _ in range(rng.randint(2, 5)):
+        lang, code = rng.choice(CODE_SAMPLES)
+        parts.append('Some notes on `{}` before the code:\n'.format(lang))
+        parts.append('```{}\n{}```\n'.format(lang, code * rng.randint(1, 4)))
+    parts.append('- point one\n- point two\n- point three\n')
+    return '\n'.join(parts)
+
+
+def seed(engine, size, rng):
+    """Fill the entries table with size entries, oldest first."""
+    start = datetime.datetime(2015, 1, 1)
+    table = Entry.__table__
+    with engine.begin() as connection:
+        for offset in range(0, size, SEED_BATCH):
+            rows = [{'title': 'Entry {}'.format(n),
+                     'text': entry_text(n, rng),
+                     'created': start + datetime.timedelta(hours=n)}
+                    for n in range(offset, min(offset + SEED_BATCH, size))]
+            connection.execute(table.insert(), rows)
+
+
+def make_app(db_url, page_cache):
+    """Return a WebTest app for the journal with production settings."""
+    from cryptacular.bcrypt import BCRYPTPasswordManager
+    from pyramid.paster import get_appsettings
+    from webtest import TestApp
+    from journalapp import main
+
+    os.environ['AUTH_USERNAME'] = USERNAME
+    os.environ['AUTH_PASSWORD'] = BCRYPTPasswordManager().encode(PASSWORD)
+    os.environ.setdefault('JOURNAL_AUTH_SECRET', 'benchmark')
+    settings = get_appsettings(os.path.join(ROOT, 'production.ini'))
+    settings['sqlalchemy.url'] = db_url
+    settings['journal.page_cache.size'] = '256' if page_cache else '0'
+    settings['auth.throttle_attempts'] = '1000000'
+    return TestApp(main({}, **settings))
+
+
+def csrf_token(app, url):
+    """Return the CSRF token from the form at url."""
+    return app.get(url).html.find('input', {'name': 'csrf_token'})['value']
+
+
+def percentile(ordered, fraction):
+    """Return the nearest-rank percentile of an ordered list."""
+    index = max(0, int(round(fraction * len(ordered))) - 1)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summarize(timings, items=1):
+    """Return latency percentiles (ms) and throughput for the timings."""
+    ordered = sorted(timings)
+    total = sum(ordered)
+    return {
+        'runs': len(ordered),
+        'p50_ms': percentile(ordered, 0.50) * 1000,
+        'p95_ms': percentile(ordered, 0.95) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'mean_ms': total / len(ordered) * 1000,
+        'throughput_per_s': len(ordered) * items / total if total else 0.0,
+    }
+
+
+def timed(func, runs, prepare=None):
+    """Call func runs times and return the list of durations.
+
+    If given, prepare(run) is called untimed before each run and its
+    result is passed to func in place of the run number.
+    """
+    timings = []
+    for run in range(runs):
+        arg = prepare(run) if prepare is not None else run
+        started = clock()
+        func(arg)
+        timings.append(clock() - started)
+    return timings
+
+
+def run_scenarios(app, size, runs, rng):
+    """Return a dict of scenario name to summary for one data size."""
+    results = {}
+    deep = datetime.datetime(2015, 1, 1) + datetime.timedelta(hours=size // 10)
+    deep_cursor = encode_cursor(deep, size // 10)
+
+    results['list_first_page'] = summarize(timed(
+        lambda run: app.get('/'), runs))
+    results['list_deep_page'] = summarize(timed(
+        lambda run: app.get('/', params={'after': deep_cursor}), runs))
+    results['detail'] = summarize(timed(
+        lambda run: app.get('/detail/{}'.format(rng.randint(1, size))),
+        runs))
+
+    texts = [entry_text(n, rng) for n in range(runs)]
+    results['render_markdown'] = summarize(timed(
+        lambda run: render_markdown(texts[run]), runs))
+
+    results['login'] = summarize(timed(
+        lambda token: app.post('/login', {
+            'username': USERNAME, 'password': PASSWORD,
+            'csrf_token': token}, status=302),
+        max(1, runs // 10), prepare=lambda run: csrf_token(app, '/login')))
+
+    token = csrf_token(app, '/add')
+    results['add_entry'] = summarize(timed(
+        lambda run: app.post('/add', {
+            'title': 'Benchmark {} {}'.format(size, run),
+            'text': texts[run], 'csrf_token': token}, status=302),
+        runs))
+
+    results['crisewing_import'] = bench_import(size, rng)
+    return results
+
+
+def bench_import(size, rng):
+    """Time the bulk crisewing import of size entries into a fresh DB."""
+    from journalapp.scripts.get_crisewing_api import (
+        add_entries_to_db, iter_entries, iter_json_array)
+    author = {'username': 'WillWeatherford',
+              'display_name': 'Will Weatherford'}
+    export = json.dumps([{
+        'title': 'Imported {}'.format(n), 'text': entry_text(n, rng),
+        'created': '2016-03-01T12:00:00.000000', 'author': author,
+    } for n in range(size)]).encode('utf-8')
+    chunks = [export[i:i + 65536] for i in range(0, len(export), 65536)]
+
+    engine = create_engine('sqlite://')
+    upgrade(engine)
+    DBSession.remove()
+    DBSession.configure(bind=engine)
+    started = clock()
+    with transaction.manager:
+        add_entries_to_db(iter_entries(iter_json_array(chunks)), DBSession)
+    elapsed = clock() - started
+    DBSession.remove()
+    return summarize([elapsed], items=size)
+
+
+def compare(current, baseline, tolerance):
+    """Print p95 changes against baseline and return regressed scenarios."""
+    regressions = []
+    for size, scenarios in sorted(current['results'].items()):
+        base_scenarios = baseline['results'].get(size, {})
+        for name, summary in sorted(scenarios.items()):
+            base = base_scenarios.get(name)
+            if not base or not base['p95_ms']:
+                continue
+            ratio = summary['p95_ms'] / base['p95_ms']
+            flag = ''
+            if ratio > 1 + tolerance:
+                flag = '  REGRESSION'
+                regressions.append((size, name))
+            print('{:>7} {:<18} p95 {:9.2f} ms -> {:9.2f} ms ({:+.0%}){}'
+                  .format(size, name, base['p95_ms'], summary['p95_ms'],
+                          ratio - 1, flag))
+    return regressions
+
+
+def print_results(results):
+    """Print a table of one run's results."""
+    for size, scenarios in sorted(results.items(), key=lambda i: int(i[0])):
+        for name, s in sorted(scenarios.items()):
+            print('{:>7} {:<18} p50 {:8.2f}  p95 {:8.2f}  p99 {:8.2f} ms'
+                  '  {:10.1f}/s'.format(size, name, s['p50_ms'], s['p95_ms'],
+                                        s['p99_ms'], s['throughput_per_s']))
+
+
+def parse_args(argv):
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000',
+                        help='comma-separated entry counts to seed')
+    parser.add_argument('--runs', type=int, default=200,
+                        help='requests per scenario')
+    parser.add_argument('--page-cache', action='store_true',
+                        help='leave the rendered page cache on')
+    parser.add_argument('--output', help='results file (default: '
+                        'benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--baseline', help='compare against this file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='also write results to benchmarks/baseline.json')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed p95 slowdown before failing (0.2=20%%)')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the benchmarks and return the process exit status."""
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='journal-bench-')
+    for size in [int(s) for s in args.sizes.split(',')]:
+        db_path = os.path.join(workdir, 'bench_{}.sqlite'.format(size))
+        engine = create_engine('sqlite:///' + db_path)
+        upgrade(engine)
+        seed(engine, size, rng)
+        engine.dispose()
+        app = make_app('sqlite:///' + db_path, args.page_cache)
+        results[str(size)] = run_scenarios(app, size, args.runs, rng)
+        DBSession.remove()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'runs': args.runs,
+            'page_cache': args.page_cache,
+        },
+        'results': results,
+    }
+    print_results(results)
+
+    output = args.output or os.path.join(RESULTS_DIR, '{}.json'.format(
+        datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')))
+    paths = [output] + ([DEFAULT_BASELINE] if args.save_baseline else [])
+    for path in paths:
+        if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('Results written to {}'.format(path))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,15 +3,23 @@
 import os
 import sys
 from pyramid.config import Configurator
+from pyramid.settings import asbool
 from pyramid.authentication import AuthTktAuthenticationPolicy
 from pyramid.authorization import ACLAuthorizationPolicy
-from sqlalchemy import engine_from_config
 
 from .models import (
     DBSession,
     Base,
 )
 
+from .db import (
+    REPLICA_PREFIX,
+    is_pooled,
+    make_engine,
+    make_replica_engine,
+    server_threads,
+    warm_pool,
+)
 from .security import DefaultRoot, groupfinder
 
 
@@ -21,6 +29,10 @@ def main(global_config, **settings):
         database_url = os.environ.get('DATABASE_URL', None)
         if database_url is not None:
             settings['sqlalchemy.url'] = database_url
+    if not settings.get('sqlalchemy_replica.url', ''):
+        replica_url = os.environ.get('DATABASE_REPLICA_URL', None)
+        if replica_url is not None:
+            settings['sqlalchemy_replica.url'] = replica_url
 
     try:
         settings['auth.username'] = os.environ['AUTH_USERNAME']
@@ -29,9 +41,22 @@ def main(global_config, **settings):
     except KeyError:
         print('Autorization global variables have not been set.')
         sys.exit()
-    engine = engine_from_config(settings, 'sqlalchemy.')
-    DBSession.configure(bind=engine)
+    engine = make_engine(settings)
+    replica = make_replica_engine(settings)
+    if asbool(settings.get('journal.db.warmup', True)):
+        warm_pool(engine,
+                  server_threads(settings) if is_pooled(settings) else 1)
+        if replica is not None:
+            warm_pool(replica, server_threads(settings)
+                      if is_pooled(settings, REPLICA_PREFIX) else 1)
+    DBSession.configure(bind=engine, replica=replica)
     Base.metadata.bind = engine
+    config = make_config(settings, auth_secret, engine, replica)
+    return config.make_wsgi_app()
+
+
+def make_config(settings, auth_secret, engine=None, replica_engine=None):
+    """Return the Configurator with the app's routes and views added."""
     config = Configurator(
         settings=settings,
         authentication_policy=AuthTktAuthenticationPolicy(
@@ -42,18 +67,43 @@ def main(global_config, **settings):
         authorization_policy=ACLAuthorizationPolicy(),
         root_factory=DefaultRoot,
     )
+    config.registry.engine = engine
+    config.registry.replica_engine = replica_engine
+    config.include('.templating')
     config.include('pyramid_jinja2')
+    config.include('.cache')
+    config.include('.highlight')
+    config.include('.security')
+    config.include('.metrics')
+    config.include('.compression')
+    config.include('.slowlog')
+    config.include('.assets')
     config.add_static_view('static', 'static', cache_max_age=3600)
 
     config.add_route('list', '/')
     config.add_route('detail', '/detail/{entry_id}')
     config.add_route('add', '/add')
     config.add_route('edit', '/edit/{entry_id}')
+    config.add_route('revisions', '/detail/{entry_id}/revisions')
+    config.add_route('revision', '/detail/{entry_id}/revisions/{number}')
     config.add_route('login', '/login')
     config.add_route('logout', '/logout')
     config.add_route('logged_out', '/logged_out')
     config.add_route('delete_all', '/delete_all')
     config.add_route('delete_one', '/delete_one/{entry_id}')
+    config.add_route('page_cache_stats', '/page_cache/stats')
+    config.add_route('search', '/search')
+    config.add_route('ready', '/ready')
+    config.add_route('feed', '/feed.atom')
+    config.add_route('api_entries', '/api/entries')
+    config.add_route('api_entry', '/api/entries/{entry_id}')
 
-    config.scan()
-    return config.make_wsgi_app()
+    # Views are registered explicitly rather than with config.scan(), which
+    # imports every module in the package, scripts and tests included.
+    config.include('.views')
+    config.include('.search')
+    config.include('.db')
+    config.include('.feed')
+    config.include('.api')
+    config.include('.revisions')
+    return config
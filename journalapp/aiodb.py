@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Run SQLAlchemy Core selects from asyncio, with or without an async driver.
+
+The ASGI read path builds its statements with SQLAlchemy as usual; a
+Database compiles them for the engine's dialect and runs them through
+aiosqlite or asyncpg when one is installed, or otherwise on a thread
+pool through the engine itself. Rows come back as named tuples with the
+column types' result processing applied, as the ORM would return them.
+
+Requires Python 3.5 or later.
+"""
+import asyncio
+import re
+from collections import namedtuple
+from urllib.parse import quote, urlencode
+
+from sqlalchemy.dialects import postgresql
+
+try:
+    import aiosqlite
+except ImportError:  # optional; the executor is used instead
+    aiosqlite = None
+
+try:
+    import asyncpg
+except ImportError:  # optional; the executor is used instead
+    asyncpg = None
+
+_row_types = {}
+NUMERIC_PARAM = re.compile(r':(\d+)')
+
+
+def row_type(names):
+    """Return a named tuple type for the given column names."""
+    names = tuple(names)
+    if names not in _row_types:
+        _row_types[names] = namedtuple('Row', names)
+    return _row_types[names]
+
+
+def column_names(statement):
+    """Return the names of the columns a select returns."""
+    return [column.name for column in statement.inner_columns]
+
+
+def compile_statement(statement, dialect):
+    """Return (sql, positional params) for statement in dialect."""
+    compiled = statement.compile(dialect=dialect)
+    params = compiled.construct_params()
+    values = []
+    for name in compiled.positiontup:
+        value = params[name]
+        bind_type = compiled.binds[name].type.dialect_impl(dialect)
+        processor = bind_type.bind_processor(dialect)
+        values.append(processor(value) if processor else value)
+    return compiled.string, values
+
+
+def result_processors(statement, dialect):
+    """Return each column's result processor for dialect, or None."""
+    return [column.type.dialect_impl(dialect).result_processor(dialect, None)
+            for column in statement.inner_columns]
+
+
+def process_rows(statement, dialect, raw_rows):
+    """Return raw driver rows as processed named tuples."""
+    make_row = row_type(column_names(statement))
+    processors = result_processors(statement, dialect)
+    return [make_row(*[processor(value) if processor else value
+                       for processor, value in zip(processors, raw)])
+            for raw in raw_rows]
+
+
+def asyncpg_dsn(url):
+    """Return a postgresql:// DSN for asyncpg from a SQLAlchemy URL.
+
+    The URL's query string is passed through.
+    """
+    credentials = ''
+    if url.username:
+        credentials = quote(url.username, safe='')
+        if url.password:
+            credentials += ':' + quote(str(url.password), safe='')
+        credentials += '@'
+    host = url.host or ''
+    if url.port:
+        host += ':{0}'.format(url.port)
+    dsn = 'postgresql://{0}{1}/{2}'.format(credentials, host,
+                                           url.database or '')
+    if url.query:
+        # Options such as sslmode, or host for a Unix socket directory.
+        dsn += '?' + urlencode(sorted(url.query.items()), doseq=True)
+    return dsn
+
+
+class ExecutorDatabase(object):
+    """Run statements through the engine on a thread pool."""
+
+    def __init__(self, engine, executor):
+        """Use engine's pool from executor's threads."""
+        self.engine = engine
+        self.executor = executor
+
+    async def start(self):
+        """Nothing to open; the engine pools its own connections."""
+
+    async def close(self):
+        """Nothing to close."""
+
+    def _fetch(self, statement):
+        with self.engine.connect() as connection:
+            result = connection.execute(statement)
+            make_row = row_type(result.keys())
+            return [make_row(*row) for row in result]
+
+    async def fetch(self, statement):
+        """Return every row statement selects."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self._fetch,
+                                          statement)
+
+
+class AiosqliteDatabase(object):
+    """Run statements on one shared aiosqlite connection."""
+
+    def __init__(self, engine):
+        """Connect to engine's database file when started."""
+        self.path = engine.url.database
+        self.dialect = engine.dialect
+        self.connection = None
+
+    async def start(self):
+        """Open the connection."""
+        self.connection = await aiosqlite.connect(self.path)
+
+    async def close(self):
+        """Close the connection."""
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+    async def fetch(self, statement):
+        """Return every row statement selects."""
+        if self.connection is None:
+            await self.start()
+        sql, params = compile_statement(statement, self.dialect)
+        cursor = await self.connection.execute(sql, params)
+        try:
+            raw_rows = await cursor.fetchall()
+        finally:
+            await cursor.close()
+        return process_rows(statement, self.dialect, raw_rows)
+
+
+class AsyncpgDatabase(object):
+    """Run statements on an asyncpg connection pool."""
+
+    def __init__(self, engine, max_size=10):
+        """Connect to engine's database when started."""
+        self.dsn = asyncpg_dsn(engine.url)
+        self.max_size = max_size
+        # asyncpg takes $1-style parameters; compile with numbered ones.
+        self.dialect = postgresql.dialect(paramstyle='numeric')
+        self.pool = None
+
+    async def start(self):
+        """Open the pool."""
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=1,
+                                              max_size=self.max_size)
+
+    async def close(self):
+        """Close the pool."""
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def fetch(self, statement):
+        """Return every row statement selects."""
+        if self.pool is None:
+            await self.start()
+        sql, params = compile_statement(statement, self.dialect)
+        sql = NUMERIC_PARAM.sub(r'$\1', sql)
+        raw_rows = await self.pool.fetch(sql, *params)
+        return process_rows(statement, self.dialect,
+                            [tuple(row) for row in raw_rows])
+
+
+def database_for(engine, executor, driver='auto', pool_size=10):
+    """Return the best Database for engine.
+
+    driver 'auto' uses aiosqlite or asyncpg when installed and suited to
+    the engine's database; 'executor' always uses the thread pool.
+    """
+    name = engine.dialect.name
+    if driver == 'auto':
+        if name == 'sqlite' and aiosqlite is not None and engine.url.database:
+            return AiosqliteDatabase(engine)
+        if name == 'postgresql' and asyncpg is not None:
+            return AsyncpgDatabase(engine, max_size=pool_size)
+    return ExecutorDatabase(engine, executor)
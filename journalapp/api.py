@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""Read-only JSON API over entries, for tools syncing the journal.
+
+GET /api/entries lists entries newest first, ``limit`` at a time (at most
+journal.api.max_limit), continuing from the ``next`` cursor passed back
+as ``after``. GET /api/entries/{id} returns one entry. Both take
+``fields``, a comma-separated subset of FIELDS (default DEFAULT_FIELDS);
+``html`` is the pre-rendered body. Lists are streamed from their own
+connection as rows arrive rather than built in memory, and both answer
+a matching If-None-Match or If-Modified-Since with a 304.
+"""
+import hashlib
+import json
+
+from pyramid.httpexceptions import (
+    HTTPBadRequest,
+    HTTPNotFound,
+    HTTPNotModified,
+)
+from pyramid.response import Response
+
+from .db import replica_reads
+from .feed import entries_state, feed_headers, last_modified, not_modified
+from .models import DBSession, Entry, RENDERER_VERSION, render_markdown
+from .pagination import encode_cursor, keyset_query
+
+FIELDS = ('id', 'title', 'created', 'updated', 'text', 'html')
+DEFAULT_FIELDS = ('id', 'title', 'created', 'updated')
+DEFAULT_LIMIT = 100
+DEFAULT_MAX_LIMIT = 1000
+# Rows encoded per chunk written to the client.
+CHUNK_ROWS = 50
+
+
+def requested_fields(request):
+    """Return the fields the request selects, in FIELDS order."""
+    value = request.params.get('fields')
+    if not value:
+        return DEFAULT_FIELDS
+    names = set(name.strip() for name in value.split(',') if name.strip())
+    unknown = names.difference(FIELDS)
+    if unknown:
+        raise HTTPBadRequest('Unknown fields: {0}.'.format(
+            ', '.join(sorted(unknown))))
+    return tuple(name for name in FIELDS if name in names)
+
+
+def requested_limit(request):
+    """Return the number of entries the request asks for."""
+    settings = request.registry.settings
+    max_limit = int(settings.get('journal.api.max_limit', DEFAULT_MAX_LIMIT))
+    try:
+        limit = int(request.params.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise HTTPBadRequest('Invalid limit.')
+    if limit < 1:
+        raise HTTPBadRequest('Invalid limit.')
+    return min(limit, max_limit)
+
+
+def entry_columns(fields):
+    """Return the columns to select for fields.
+
+    created and id are always selected, as the cursor is built from them;
+    html also needs the text and version to re-render stale HTML.
+    """
+    names = set(fields) | set(['id', 'created'])
+    if 'html' in names:
+        names.update(['text', 'html_version'])
+    return [getattr(Entry, name) for name in FIELDS + ('html_version',)
+            if name in names]
+
+
+def entry_json(row, fields):
+    """Return the JSON-serializable dict of fields from an entry row."""
+    data = {}
+    for name in fields:
+        value = getattr(row, name)
+        if name == 'html' and (value is None or
+                               row.html_version != RENDERER_VERSION):
+            # Not stored: this is a read, possibly from a replica.
+            value = render_markdown(row.text)
+        elif name in ('created', 'updated') and value is not None:
+            value = value.isoformat()
+        data[name] = value
+    return data
+
+
+def api_etag(*parts):
+    """Return an ETag for a response built from parts."""
+    key = '|'.join(str(part) for part in parts + (RENDERER_VERSION,))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def stream_entries(bind, statement, fields, limit):
+    """Yield the JSON list document for statement's rows in chunks.
+
+    The statement fetches one row more than limit, which only tells
+    whether there is a next page. The connection is checked out when the
+    first chunk is asked for and returned when the last is sent, or when
+    the server closes the iterator early.
+    """
+    connection = bind.connect()
+    try:
+        result = connection.execution_options(
+            stream_results=True).execute(statement)
+        chunk = []
+        count = 0
+        next_cursor = last = None
+        separator = b''
+        yield b'{"entries": ['
+        for row in result:
+            if count == limit:
+                next_cursor = encode_cursor(last.created, last.id)
+                break
+            chunk.append(json.dumps(entry_json(row, fields), sort_keys=True))
+            count += 1
+            last = row
+            if len(chunk) == CHUNK_ROWS:
+                yield separator + ', '.join(chunk).encode('utf-8')
+                chunk = []
+                separator = b', '
+        if chunk:
+            yield separator + ', '.join(chunk).encode('utf-8')
+        result.close()
+        yield '], "next": {0}}}'.format(json.dumps(next_cursor)).encode(
+            'utf-8')
+    finally:
+        connection.close()
+
+
+def entries_api_view(request):
+    """Return a page of entries as a streamed JSON document."""
+    fields = requested_fields(request)
+    limit = requested_limit(request)
+    after = request.params.get('after')
+    query = DBSession.query(*entry_columns(fields))
+    try:
+        query = keyset_query(query, after=after, page_size=limit)
+    except ValueError:
+        raise HTTPBadRequest('Invalid page cursor.')
+
+    count, updated = entries_state(DBSession)
+    etag = api_etag(count, updated, ','.join(fields), after, limit)
+    headers = feed_headers(etag, updated)
+    if not_modified(request, etag,
+                    last_modified(updated) if updated else None):
+        return HTTPNotModified(headers=headers)
+    # The session is closed by the time the body is sent, so the rows are
+    # read through a connection of their own from the same engine.
+    bind = DBSession().get_bind(Entry.__mapper__)
+    response = Response(content_type='application/json', charset='utf-8',
+                        app_iter=stream_entries(bind, query.statement,
+                                                fields, limit))
+    response.headers.update(headers)
+    return response
+
+
+def entry_api_view(request):
+    """Return one entry as JSON."""
+    fields = requested_fields(request)
+    try:
+        entry_id = int(request.matchdict['entry_id'])
+    except ValueError:
+        raise HTTPNotFound('Entry {0} does not exist.'.format(
+            request.matchdict['entry_id']))
+    row = (DBSession.query(*entry_columns(fields + ('updated',)))
+           .filter(Entry.id == entry_id).first())
+    if row is None:
+        raise HTTPNotFound('Entry {0} does not exist.'.format(entry_id))
+
+    etag = api_etag(row.id, row.updated, ','.join(fields))
+    headers = feed_headers(etag, row.updated)
+    if not_modified(request, etag,
+                    last_modified(row.updated) if row.updated else None):
+        return HTTPNotModified(headers=headers)
+    response = Response(content_type='application/json', charset='utf-8',
+                        json_body=entry_json(row, fields))
+    response.headers.update(headers)
+    return response
+
+
+def includeme(config):
+    """Register the API views."""
+    config.add_view(entries_api_view, route_name='api_entries',
+                    request_method=('GET', 'HEAD'), permission='view',
+                    decorator=replica_reads)
+    config.add_view(entry_api_view, route_name='api_entry',
+                    request_method=('GET', 'HEAD'), permission='view',
+                    decorator=replica_reads)
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""ASGI entry point serving the read-only pages without blocking a thread.
+
+Anonymous GET and HEAD requests for the entry list, entry detail and feed
+are answered on the event loop: their selects run through aiodb (an async
+driver when one is installed) and their templates render with Jinja2's
+async mode. Everything else -- writes, logged-in pages, entries whose HTML
+needs re-rendering, errors -- is handed to the regular WSGI app on a
+thread pool, so behaviour matches the WSGI deployment exactly.
+
+Serve it with any ASGI server, e.g.::
+
+    JOURNAL_CONFIG=production.ini uvicorn --factory journalapp.asgi:create_app
+
+Settings: journal.asgi.driver is 'auto' (aiosqlite or asyncpg if present)
+or 'executor' (always the thread pool). Requires Python 3.5 or later.
+"""
+import asyncio
+import io
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import jinja2
+from pyramid.interfaces import IRootFactory, IRoutesMapper
+from pyramid.request import Request, apply_request_extensions
+from pyramid.traversal import DefaultRootFactory
+from sqlalchemy import func, select
+from sqlalchemy.orm import Query
+
+from .aiodb import database_for
+from .cache import get_page_cache, page_key, replica_may_lag
+from .compression import DEFAULT_LEVEL, compression_tween_factory
+from .db import STICKY_COOKIE, server_threads
+from .feed import (
+    FEED_TYPE,
+    feed_etag,
+    feed_headers,
+    feed_size_from_settings,
+    last_modified,
+    not_modified,
+)
+from .models import Entry, RENDERER_VERSION
+from .pagination import keyset_query, keyset_result, page_size_from_settings
+from .views import list_values
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+# Jinja2 2.9 added async rendering; older versions render synchronously.
+ASYNC_TEMPLATES = hasattr(jinja2.Template, 'render_async')
+
+LIST_COLUMNS = [Entry.id, Entry.title, Entry.created]
+BODY_COLUMNS = [Entry.id, Entry.title, Entry.created, Entry.updated,
+                Entry.html, Entry.html_version]
+
+# What the templates read from an entry, with its stored HTML as markdown.
+RenderedEntry = namedtuple('RenderedEntry',
+                           ['id', 'title', 'created', 'updated', 'markdown'])
+
+
+def rendered_entry(row):
+    """Return a body row as the templates expect, or None if it is stale."""
+    if row.html is None or row.html_version != RENDERER_VERSION:
+        return None
+    return RenderedEntry(row.id, row.title, row.created, row.updated,
+                         row.html)
+
+
+def scope_environ(scope, body):
+    """Return a WSGI environ for an ASGI HTTP scope and its request body."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client')
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{0}'.format(scope.get('http_version',
+                                                       '1.1')),
+        'REMOTE_ADDR': client[0] if client else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+    return environ
+
+
+def call_wsgi(app, environ):
+    """Return (status, headers, body) from calling a WSGI app."""
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+
+    app_iter = app(environ, start_response)
+    try:
+        body = b''.join(app_iter)
+    finally:
+        close = getattr(app_iter, 'close', None)
+        if close is not None:
+            close()
+    return started[0], started[1], body
+
+
+class ASGIApp(object):
+    """ASGI app serving reads itself and the rest through a WSGI app."""
+
+    def __init__(self, wsgi_app):
+        """Wrap the Pyramid router returned by journalapp.main."""
+        self.wsgi_app = wsgi_app
+        self.registry = registry = wsgi_app.registry
+        settings = registry.settings
+        self.executor = ThreadPoolExecutor(
+            max_workers=server_threads(settings))
+        self.database = database_for(
+            registry.engine, self.executor,
+            driver=settings.get('journal.asgi.driver', 'auto'),
+            pool_size=server_threads(settings))
+        # Reads go to the replica when there is one, as in replica_reads.
+        self.replica = None
+        if getattr(registry, 'replica_engine', None) is not None:
+            self.replica = database_for(
+                registry.replica_engine, self.executor,
+                driver=settings.get('journal.asgi.driver', 'auto'),
+                pool_size=server_threads(settings))
+        # Its template names ('list.jinja2') differ from pyramid_jinja2's
+        # ('journalapp:templates/list.jinja2'), so the async bytecode
+        # never collides with the sync bytecode in the shared cache.
+        self.templates = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(TEMPLATE_DIR),
+            autoescape=True,
+            bytecode_cache=getattr(registry, 'bytecode_cache', None),
+            **({'enable_async': True} if ASYNC_TEMPLATES else {}))
+        self.handlers = {
+            'list': self.list_page,
+            'detail': self.detail_page,
+            'feed': self.feed,
+        }
+        self.finish = None
+        if int(settings.get('journal.compression.level', DEFAULT_LEVEL)):
+            # The handlers fill in request.response; the tween compresses it.
+            self.finish = compression_tween_factory(
+                lambda request: request.response, registry)
+
+    async def __call__(self, scope, receive, send):
+        """Handle one ASGI connection scope."""
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError('Unsupported scope type {0}'.format(
+                scope['type']))
+
+    async def lifespan(self, receive, send):
+        """Open the database on startup and close it on shutdown."""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.database.start()
+                if self.replica is not None:
+                    await self.replica.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.database.close()
+                if self.replica is not None:
+                    await self.replica.close()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        """Answer one HTTP request."""
+        body = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            body.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        environ = scope_environ(scope, b''.join(body))
+
+        request = self.make_request(dict(environ))
+        handler = self.handlers.get(self.route_name(request))
+        if (handler is not None and request.method in ('GET', 'HEAD') and
+                request.authenticated_userid is None):
+            if await handler(request):
+                response = request.response
+                if self.finish is not None:
+                    response = self.finish(request)
+                await self.send_response(send, request, response.status,
+                                         response.headerlist,
+                                         b''.join(response.app_iter))
+                return
+
+        loop = asyncio.get_event_loop()
+        status, headers, content = await loop.run_in_executor(
+            self.executor, call_wsgi, self.wsgi_app, environ)
+        await self.send_response(send, request, status, headers, content)
+
+    def make_request(self, environ):
+        """Return a Pyramid request with its route matched."""
+        registry = self.registry
+        request = Request(environ)
+        request.registry = registry
+        apply_request_extensions(request)
+        info = registry.getUtility(IRoutesMapper)(request)
+        if info['route'] is not None:
+            request.matchdict = info['match']
+            request.matched_route = info['route']
+        root_factory = registry.queryUtility(IRootFactory,
+                                             default=DefaultRootFactory)
+        request.context = root_factory(request)
+        return request
+
+    def reader(self, request):
+        """Return the database to read from for request.
+
+        That is the replica, unless there is none or the client carries
+        the sticky cookie from a recent write, as in db.use_replica.
+        """
+        if self.replica is None or request.cookies.get(STICKY_COOKIE):
+            return self.database
+        request.reads_replica = True
+        return self.replica
+
+    def route_name(self, request):
+        """Return the name of the route the request matched, or None."""
+        route = getattr(request, 'matched_route', None)
+        return route.name if route is not None else None
+
+    async def send_response(self, send, request, status, headers, body):
+        """Send a complete response, without a body for HEAD."""
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.encode('latin-1'), value.encode('latin-1'))
+                        for name, value in headers],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b'' if request.method == 'HEAD' else body,
+        })
+
+    async def render(self, name, values):
+        """Return the rendered template."""
+        template = self.templates.get_template(name)
+        if ASYNC_TEMPLATES:
+            return await template.render_async(**values)
+        return template.render(**values)
+
+    async def render_page(self, request, name, values):
+        """Render an HTML page into request.response, through the page cache.
+
+        values is a coroutine function returning the template's values, or
+        None to defer to the WSGI view; it is not called on a cache hit.
+        Shares its keys with cached_page, so the WSGI views and this path
+        fill and serve the same cache.
+        """
+        response = request.response
+        cache = get_page_cache(request)
+        if cache is not None:
+            key = page_key(request)
+            generation = cache.generation()
+            cached = cache.get(key)
+            if cached is not None:
+                response.content_type, response.charset, response.body = cached
+                return True
+        values = await values()
+        if values is None:
+            return False
+        response.text = await self.render(name, dict(values, request=request))
+        if cache is not None and not replica_may_lag(request, cache):
+            cache.set(key, (response.content_type, response.charset,
+                            response.body), generation)
+        return True
+
+    async def list_page(self, request):
+        """Render the entry list; return False to defer to the WSGI view."""
+        settings = self.registry.settings
+        after = request.params.get('after')
+        before = request.params.get('before')
+        page_size = page_size_from_settings(settings)
+        try:
+            query = keyset_query(Query(LIST_COLUMNS), after=after,
+                                 before=before, page_size=page_size)
+        except ValueError:
+            return False
+
+        async def values():
+            rows = await self.reader(request).fetch(query.statement)
+            return list_values(request, keyset_result(
+                rows, after=after, before=before, page_size=page_size))
+        return await self.render_page(request, 'list.jinja2', values)
+
+    async def detail_page(self, request):
+        """Render one entry; return False to defer to the WSGI view."""
+        try:
+            entry_id = int(request.matchdict['entry_id'])
+        except ValueError:
+            return False
+
+        async def values():
+            rows = await self.reader(request).fetch(
+                select(BODY_COLUMNS).where(Entry.id == entry_id))
+            entry = rendered_entry(rows[0]) if rows else None
+            return {'entry': entry} if entry is not None else None
+        return await self.render_page(request, 'detail.jinja2', values)
+
+    async def feed(self, request):
+        """Render the Atom feed; return False to defer to the WSGI view."""
+        registry = self.registry
+        feed_size = feed_size_from_settings(registry.settings)
+        database = self.reader(request)
+        rows = await database.fetch(select([
+            func.count(Entry.id).label('count'),
+            func.max(Entry.updated).label('updated'),
+        ]))
+        count, updated = rows[0]
+        etag = feed_etag(count, updated, feed_size)
+        response = request.response
+        response.headers.update(feed_headers(etag, updated))
+        if not_modified(request, etag,
+                        last_modified(updated) if updated else None):
+            response.status_int = 304
+            return True
+
+        cached = getattr(registry, 'feed_document', None)
+        if cached is not None and cached[0] == etag:
+            body = cached[1]
+        else:
+            rows = await database.fetch(
+                select(BODY_COLUMNS)
+                .order_by(Entry.created.desc(), Entry.id.desc())
+                .limit(feed_size))
+            entries = [rendered_entry(row) for row in rows]
+            if None in entries:
+                # Re-rendering stale HTML writes; leave it to the WSGI view.
+                return False
+            body = await self.render('feed.atom.jinja2', {
+                'entries': entries, 'updated': updated, 'request': request})
+            registry.feed_document = (etag, body)
+        response.content_type = FEED_TYPE
+        response.charset = 'utf-8'
+        response.text = body
+        return True
+
+
+def main(global_config, **settings):
+    """Return the ASGI app for the given settings, as journalapp.main."""
+    from . import main as wsgi_main
+    return ASGIApp(wsgi_main(global_config, **settings))
+
+
+def create_app():
+    """Return the ASGI app for the config file named by JOURNAL_CONFIG."""
+    from pyramid.paster import get_app
+    return ASGIApp(get_app(os.environ.get('JOURNAL_CONFIG',
+                                          'production.ini')))
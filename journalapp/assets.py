@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Build and serve fingerprinted, precompressed static assets.
+
+build_assets copies every file in static/ to static/dist/ under a name
+carrying a hash of its content, writes .gz (and, when the brotli package
+is installed, .br) siblings for text assets, and records the mapping in
+static/dist/manifest.json. When that manifest exists, request.static_url
+resolves assets through it and asset_view serves them with a year-long
+immutable Cache-Control, picking the best encoding the client accepts.
+"""
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.response import FileResponse
+from pyramid.settings import asbool
+from pyramid.static import ManifestCacheBuster
+
+from .compression import preferred_encodings
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip alone still helps
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), 'static')
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+COMPRESSIBLE = ('.css', '.js', '.svg', '.txt', '.ico')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def fingerprint(name, data):
+    """Return name with a hash of data inserted before its extension."""
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    base, ext = os.path.splitext(name)
+    return '{0}.{1}{2}'.format(base, digest, ext)
+
+
+def rewrite_css_urls(css, manifest):
+    """Point relative url() references in css at their fingerprinted names."""
+    def replace(match):
+        quote, target = match.groups()
+        hashed = manifest.get(target)
+        if hashed is None:
+            return match.group(0)
+        return 'url({0}{1}{0})'.format(quote, os.path.basename(hashed))
+    return CSS_URL.sub(replace, css)
+
+
+def compress(data):
+    """Return {suffix: compressed bytes} for each available encoding."""
+    buf = io.BytesIO()
+    # mtime=0 keeps the output byte-for-byte reproducible between builds.
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9,
+                       mtime=0) as gz:
+        gz.write(data)
+    compressed = {'.gz': buf.getvalue()}
+    if brotli is not None:
+        compressed['.br'] = brotli.compress(data)
+    return compressed
+
+
+def source_assets(static_dir):
+    """Return static asset paths relative to static_dir, CSS last."""
+    names = []
+    for root, dirs, files in os.walk(static_dir):
+        if root == static_dir and DIST in dirs:
+            dirs.remove(DIST)
+        for filename in files:
+            path = os.path.join(root, filename)
+            names.append(os.path.relpath(path, static_dir).replace(os.sep,
+                                                                   '/'))
+    # Stylesheets are hashed after the images they reference are.
+    return sorted(names, key=lambda name: (name.endswith('.css'), name))
+
+
+def write_file(path, data):
+    """Write data to path atomically."""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(data)
+    getattr(os, 'replace', os.rename)(tmp, path)
+
+
+def build_assets(static_dir=STATIC_DIR):
+    """Fingerprint and precompress static_dir into its dist/ directory.
+
+    Returns the manifest, which maps each source path (as passed to
+    request.static_url) to its dist/ path.
+    """
+    dist_dir = os.path.join(static_dir, DIST)
+    manifest = {}
+    for name in source_assets(static_dir):
+        with open(os.path.join(static_dir, *name.split('/')), 'rb') as fh:
+            data = fh.read()
+        if name.endswith('.css'):
+            prefix = os.path.dirname(name)
+            local = dict((os.path.relpath(source, prefix or '.'), hashed)
+                         for source, hashed in manifest.items())
+            data = rewrite_css_urls(data.decode('utf-8'),
+                                    local).encode('utf-8')
+        hashed = '/'.join([DIST, fingerprint(name, data)])
+        manifest[name] = hashed
+        target = os.path.join(static_dir, *hashed.split('/'))
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        if not os.path.exists(target):
+            write_file(target, data)
+        if name.endswith(COMPRESSIBLE):
+            for suffix, compressed in compress(data).items():
+                if (len(compressed) < len(data) and
+                        not os.path.exists(target + suffix)):
+                    write_file(target + suffix, compressed)
+    write_file(os.path.join(dist_dir, MANIFEST),
+               json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def accepted_encodings(request):
+    """Return the precompressed codings the request accepts, br first."""
+    return preferred_encodings(request, [coding for coding, _ in ENCODINGS])
+
+
+def asset_view(request):
+    """Serve a fingerprinted asset, precompressed when the client allows."""
+    segments = request.matchdict['subpath']
+    if not segments or any(not part or part.startswith('.')
+                           for part in segments):
+        raise HTTPNotFound()
+    path = os.path.join(STATIC_DIR, DIST, *segments)
+    if not os.path.isfile(path):
+        raise HTTPNotFound()
+    content_type, _ = mimetypes.guess_type(path)
+    content_encoding = None
+    accepted = accepted_encodings(request)
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.exists(path + suffix):
+            path, content_encoding = path + suffix, encoding
+            break
+    response = FileResponse(path, request=request,
+                            content_type=content_type or
+                            'application/octet-stream',
+                            content_encoding=content_encoding)
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.vary = ('Accept-Encoding',)
+    return response
+
+
+def includeme(config):
+    """Serve built assets through their manifest when it exists.
+
+    Must be included before the plain static view is added, so the
+    /static/dist/ route is matched first.
+    """
+    settings = config.get_settings()
+    manifest_path = os.path.join(STATIC_DIR, DIST, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return
+    reload_assets = asbool(settings.get('pyramid.reload_assets', False))
+    buster = ManifestCacheBuster(manifest_path, reload=reload_assets)
+    config.add_route('assets', '/static/{0}/*subpath'.format(DIST))
+    config.add_view(asset_view, route_name='assets', permission='view')
+    config.add_cache_buster('journalapp:static/', buster)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""In-process cache of rendered pages, evicted when entries change."""
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+
+from pyramid.response import Response
+
+from .db import replica_lag
+
+DEFAULT_PAGE_CACHE_SIZE = 256
+
+# Set by share_page_cache_generation() in a pre-fork master, so every
+# worker's page cache sees invalidations made by the others.
+_shared_generation = None
+
+
+class LRUCache(object):
+    """Thread-safe bounded mapping that discards least recently used keys.
+
+    If given a shared generation counter (a multiprocessing.Value), every
+    invalidation also bumps it, and a cache that finds the counter moved
+    by another process drops everything it holds.
+    """
+
+    def __init__(self, maxsize, generation=None):
+        """Initialize an empty cache holding at most maxsize items."""
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = generation
+        self._seen = generation.value if generation is not None else None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # When this process last saw an invalidation, local or shared.
+        self.invalidated_at = 0.0
+
+    def __len__(self):
+        """Return the number of cached items."""
+        return len(self._data)
+
+    def generation(self):
+        """Return the shared generation, or None if the cache is local."""
+        if self._generation is None:
+            return None
+        return self._generation.value
+
+    def _sync(self):
+        """Drop everything if another process has invalidated since."""
+        if self._generation is not None:
+            current = self._generation.value
+            if current != self._seen:
+                self.invalidations += len(self._data)
+                self._data.clear()
+                self._seen = current
+                self.invalidated_at = time.time()
+
+    def _bump(self):
+        """Tell other processes this cache has invalidated something."""
+        self.invalidated_at = time.time()
+        if self._generation is not None:
+            with self._generation.get_lock():
+                self._generation.value += 1
+                current = self._generation.value
+            if current == self._seen + 1:
+                self._seen = current
+
+    def get(self, key, default=None):
+        """Return the cached value for key, marking it recently used."""
+        with self._lock:
+            self._sync()
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value, generation=None):
+        """Store value under key, evicting the oldest item if full.
+
+        If generation (from generation()) is given and an invalidation has
+        happened since, the value may be stale and is not stored.
+        """
+        with self._lock:
+            self._sync()
+            if generation is not None and generation != self._seen:
+                return
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard_if(self, predicate):
+        """Remove every key for which predicate(key) is true."""
+        with self._lock:
+            stale = [key for key in self._data if predicate(key)]
+            for key in stale:
+                del self._data[key]
+            self.invalidations += len(stale)
+            self._bump()
+        return len(stale)
+
+    def clear(self):
+        """Remove every item."""
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+            self._bump()
+
+    def stats(self):
+        """Return a dict of the cache counters."""
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+def get_page_cache(request):
+    """Return the page cache for the request's app, or None if disabled."""
+    return getattr(request.registry, 'page_cache', None)
+
+
+def match_value(name, value):
+    """Return a route match value as it appears in page keys.
+
+    Entry ids are compared as integers, so /detail/01 and /detail/1 share
+    the key invalidate_pages evicts.
+    """
+    if name == 'entry_id':
+        try:
+            return str(int(value))
+        except ValueError:
+            pass
+    return str(value)
+
+
+def page_key(request):
+    """Return the cache key for a page as rendered for this request.
+
+    The key covers everything the templates vary on: the route and its
+    match values, the query string (pagination cursors), the scheme, host
+    and script name absolute links are built from, and the
+    authentication-dependent links.
+    """
+    matchdict = request.matchdict or {}
+    return (
+        request.matched_route.name,
+        tuple(sorted((k, match_value(k, v)) for k, v in matchdict.items())),
+        request.query_string,
+        request.application_url,
+        request.authenticated_userid,
+        bool(request.has_permission('create')),
+        bool(request.has_permission('edit')),
+    )
+
+
+def cached_page(view):
+    """View decorator that serves GETs of a rendered page from the cache."""
+    def wrapper(context, request):
+        cache = get_page_cache(request)
+        if cache is None or request.method not in ('GET', 'HEAD'):
+            return view(context, request)
+        key = page_key(request)
+        generation = cache.generation()
+        cached = cache.get(key)
+        if cached is not None:
+            content_type, charset, body = cached
+            return Response(body=body, content_type=content_type,
+                            charset=charset)
+        response = view(context, request)
+        if (response.status_int == 200 and
+                'Set-Cookie' not in response.headers and
+                not replica_may_lag(request, cache)):
+            cache.set(key, (response.content_type, response.charset,
+                            response.body), generation)
+        return response
+    return wrapper
+
+
+def replica_may_lag(request, cache):
+    """Return True if a page read from the replica may predate a write.
+
+    Such a page is served but not cached, or it could outlive the write
+    it missed.
+    """
+    if not getattr(request, 'reads_replica', False):
+        return False
+    lag = replica_lag(request.registry.settings)
+    return time.time() - cache.invalidated_at < lag
+
+
+def invalidate_pages(request, entry_id=None, everything=False):
+    """Evict pages made stale by a write.
+
+    Every list page is evicted, plus the detail page of entry_id, or every
+    page if everything is true. Eviction runs immediately and again once
+    the request has finished, so a page re-cached from a concurrent read
+    before the write committed does not survive.
+    """
+    cache = get_page_cache(request)
+    if cache is None:
+        return
+
+    detail_match = (('entry_id', match_value('entry_id', entry_id)),)
+
+    def is_stale(key):
+        route_name, matchdict = key[0], key[1]
+        return (route_name == 'list' or
+                (route_name == 'detail' and matchdict == detail_match))
+
+    def evict(request=None):
+        if everything:
+            cache.clear()
+        else:
+            cache.discard_if(is_stale)
+
+    evict()
+    request.add_finished_callback(evict)
+
+
+def includeme(config):
+    """Attach a page cache sized by journal.page_cache.size to the registry.
+
+    A size of 0 disables caching.
+    """
+    settings = config.get_settings()
+    size = int(settings.get('journal.page_cache.size',
+                            DEFAULT_PAGE_CACHE_SIZE))
+    config.registry.page_cache = (LRUCache(size, _shared_generation)
+                                  if size > 0 else None)
+
+
+def share_page_cache_generation():
+    """Share one invalidation counter with page caches in forked workers.
+
+    Call in the parent before forking; apps loaded in the children then
+    evict pages when any worker handles a write.
+    """
+    global _shared_generation
+    if _shared_generation is None:
+        _shared_generation = multiprocessing.Value('L', 0)
+    return _shared_generation
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Gzip or deflate dynamic responses the client accepts compressed.
+
+Configured by journal.compression.level (zlib level 1-9, 0 disables the
+tween) and journal.compression.min_size (bytes; smaller bodies are sent
+as they are). Buffered bodies are compressed once in place; streamed
+app_iters are compressed chunk by chunk as the server sends them.
+"""
+import zlib
+
+from pyramid.tweens import INGRESS
+
+DEFAULT_LEVEL = 6
+DEFAULT_MIN_SIZE = 1024
+COMPRESSIBLE_TYPES = frozenset([
+    'application/atom+xml',
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+])
+# zlib window bits selecting each coding's container format.
+WBITS = (('gzip', 16 + zlib.MAX_WBITS), ('deflate', zlib.MAX_WBITS))
+
+
+def encoding_qualities(request):
+    """Return {coding: q} parsed from the request's Accept-Encoding."""
+    qualities = {}
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        name, _, value = params.strip().partition('=')
+        if name.strip().lower() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    return qualities
+
+
+def preferred_encodings(request, candidates):
+    """Return the candidates the request accepts, keeping their order.
+
+    A missing Accept-Encoding header accepts none of them.
+    """
+    qualities = encoding_qualities(request)
+    default = qualities.get('*', 0.0)
+    return [coding for coding in candidates
+            if qualities.get(coding, default) > 0]
+
+
+def is_compressible(response):
+    """Return True if the response's content type is worth compressing."""
+    content_type = response.content_type or ''
+    return (content_type.startswith('text/') or
+            content_type in COMPRESSIBLE_TYPES)
+
+
+def should_compress(request, response, min_size):
+    """Return True if the response should be compressed for this request."""
+    if request.method == 'HEAD' or 'Range' in request.headers:
+        return False
+    if response.status_int < 200:
+        return False
+    if response.status_int in (204, 206, 304):
+        return False
+    if response.content_encoding or 'no-transform' in (
+            response.headers.get('Cache-Control', '')):
+        return False
+    length = response.content_length
+    return length is None or length >= min_size
+
+
+def weaken_etag(response):
+    """Mark a strong ETag weak, since the bytes sent no longer match it."""
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        response.headers['ETag'] = 'W/' + etag
+
+
+def compress_body(body, wbits, level):
+    """Return body compressed in one pass."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    return compressor.compress(body) + compressor.flush()
+
+
+def compress_iter(app_iter, wbits, level, finished):
+    """Yield app_iter compressed, then call finished(bytes_in, bytes_out)."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    bytes_in = bytes_out = 0
+    try:
+        for chunk in app_iter:
+            bytes_in += len(chunk)
+            data = compressor.compress(chunk)
+            if data:
+                bytes_out += len(data)
+                yield data
+        data = compressor.flush()
+        bytes_out += len(data)
+        yield data
+        finished(bytes_in, bytes_out)
+    finally:
+        close = getattr(app_iter, 'close', None)
+        if close is not None:
+            close()
+
+
+def compression_tween_factory(handler, registry):
+    """Return a tween compressing responses for clients that accept it."""
+    settings = registry.settings
+    level = int(settings.get('journal.compression.level', DEFAULT_LEVEL))
+    min_size = int(settings.get('journal.compression.min_size',
+                                DEFAULT_MIN_SIZE))
+    metrics = getattr(registry, 'metrics', None)
+    codings = [coding for coding, _ in WBITS]
+
+    def record(request, bytes_in, bytes_out):
+        if metrics is not None:
+            route = getattr(request, 'matched_route', None)
+            metrics.response_compressed(
+                route.name if route is not None else None,
+                bytes_in, bytes_out)
+
+    def compression_tween(request):
+        response = handler(request)
+        if not is_compressible(response):
+            return response
+        vary = tuple(response.vary or ())
+        if 'Accept-Encoding' not in vary:
+            response.vary = vary + ('Accept-Encoding',)
+        if not should_compress(request, response, min_size):
+            return response
+        accepted = preferred_encodings(request, codings)
+        if not accepted:
+            return response
+        coding = accepted[0]
+        wbits = dict(WBITS)[coding]
+        if isinstance(response.app_iter, (list, tuple)):
+            body = response.body
+            compressed = compress_body(body, wbits, level)
+            if len(compressed) >= len(body):
+                return response
+            response.body = compressed
+            record(request, len(body), len(compressed))
+        else:
+            response.app_iter = compress_iter(
+                response.app_iter, wbits, level,
+                lambda bytes_in, bytes_out: record(request, bytes_in,
+                                                   bytes_out))
+            response.content_length = None
+        response.content_encoding = coding
+        weaken_etag(response)
+        return response
+    return compression_tween
+
+
+def includeme(config):
+    """Register the compression tween unless its level is 0."""
+    settings = config.get_settings()
+    if not int(settings.get('journal.compression.level', DEFAULT_LEVEL)):
+        return
+    # Inside the metrics tween, when there is one, so its latency
+    # includes compressing.
+    config.add_tween('journalapp.compression.compression_tween_factory',
+                     under=('journalapp.metrics.metrics_tween_factory',
+                            INGRESS))
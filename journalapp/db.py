@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""Create the SQLAlchemy engines, and route read-only views to a replica."""
+import math
+import threading
+
+from pyramid.events import NewResponse
+from pyramid.settings import asbool
+from sqlalchemy import __version__ as sqlalchemy_version
+from sqlalchemy import engine_from_config, event, exc, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+from .models import DBSession
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # Python 2
+    from time import time as clock
+
+DEFAULT_THREADS = 4
+REPLICA_PREFIX = 'sqlalchemy_replica.'
+# Seconds a replica may trail the primary: clients stay on the primary
+# this long after writing, and pages read from the replica this soon after
+# an invalidation are not cached.
+DEFAULT_REPLICA_LAG = 5
+STICKY_COOKIE = 'journal_primary'
+NATIVE_PRE_PING = tuple(int(part) for part in
+                        sqlalchemy_version.split('.')[:2]) >= (1, 2)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the pool and its wait counters."""
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        """Check out a connection, timing the wait."""
+        started = clock()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = clock() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+                if waited > 0.001:
+                    self.waits += 1
+
+
+def server_threads(settings):
+    """Return the number of request threads the web server runs.
+
+    That is journal.threads, which the ini files and runapp.py also give
+    waitress, so the two cannot drift apart.
+    """
+    return int(settings.get('journal.threads', DEFAULT_THREADS))
+
+
+def is_pooled(settings, prefix='sqlalchemy.'):
+    """Return True if the database gets a real connection pool."""
+    url = make_url(settings[prefix + 'url'])
+    return url.drivername.split('+')[0] != 'sqlite'
+
+
+def engine_settings(settings, prefix='sqlalchemy.'):
+    """Return settings with pool options derived from the thread count.
+
+    Every request thread can hold one connection, plus a little overflow
+    for scripts and the readiness check. Explicit sqlalchemy.pool_* settings
+    win. SQLite keeps SQLAlchemy's default pool.
+    """
+    settings = dict(settings)
+    if is_pooled(settings, prefix):
+        threads = server_threads(settings)
+        settings.setdefault(prefix + 'pool_size', str(threads))
+        settings.setdefault(prefix + 'max_overflow',
+                            str(max(2, threads // 2)))
+        settings.setdefault(prefix + 'pool_timeout', '10')
+        settings.setdefault(prefix + 'pool_recycle', '1800')
+    return settings
+
+
+def ping_connection(connection, branch):
+    """Check a connection is alive before use, reconnecting once if not.
+
+    Stands in for pool_pre_ping on SQLAlchemy versions before 1.2.
+    """
+    if branch:
+        return
+    should_close = connection.should_close_with_result
+    connection.should_close_with_result = False
+    try:
+        connection.scalar(select([1]))
+    except exc.DBAPIError as error:
+        if not error.connection_invalidated:
+            raise
+        connection.scalar(select([1]))
+    finally:
+        connection.should_close_with_result = should_close
+
+
+def make_engine(settings, prefix='sqlalchemy.'):
+    """Return an engine configured from sqlalchemy.* and journal.* settings.
+
+    prefix selects another engine's settings, e.g. the replica's.
+    """
+    settings = engine_settings(settings, prefix)
+    kwargs = {}
+    pre_ping = asbool(settings.get('journal.db.pre_ping', True))
+    pooled = is_pooled(settings, prefix)
+    if pooled:
+        kwargs['poolclass'] = TimedQueuePool
+        if pre_ping and NATIVE_PRE_PING:
+            kwargs['pool_pre_ping'] = True
+    engine = engine_from_config(settings, prefix, **kwargs)
+    if pre_ping and pooled and not NATIVE_PRE_PING:
+        event.listen(engine, 'engine_connect', ping_connection)
+    return engine
+
+
+def make_replica_engine(settings):
+    """Return the read replica's engine, or None if none is configured.
+
+    The replica is configured like the primary, with sqlalchemy_replica.*
+    settings (sqlalchemy_replica.url at least).
+    """
+    if not settings.get(REPLICA_PREFIX + 'url'):
+        return None
+    return make_engine(settings, REPLICA_PREFIX)
+
+
+def registry_engines(registry):
+    """Return the app's engines: the primary, then the replica if any."""
+    return [engine for engine in (getattr(registry, 'engine', None),
+                                  getattr(registry, 'replica_engine', None))
+            if engine is not None]
+
+
+def replica_lag(settings):
+    """Return how many seconds the replica may trail the primary."""
+    return float(settings.get('journal.db.replica_lag', DEFAULT_REPLICA_LAG))
+
+
+def use_replica(request):
+    """Send this request's ORM reads to the replica, if there is one.
+
+    A client that wrote within the last replica_lag seconds carries the
+    sticky cookie and stays on the primary, so it reads its own writes.
+    Return True if reads will use the replica.
+    """
+    if getattr(request.registry, 'replica_engine', None) is None:
+        return False
+    if request.cookies.get(STICKY_COOKIE):
+        return False
+    info = DBSession().info
+    info['replica'] = True
+    request.reads_replica = True
+    request.add_finished_callback(lambda request: info.pop('replica', None))
+    return True
+
+
+def use_primary():
+    """Send the rest of this request's reads to the primary."""
+    DBSession().info.pop('replica', None)
+
+
+def replica_reads(view):
+    """View decorator reading from the replica for GET and HEAD requests."""
+    def wrapper(context, request):
+        if request.method in ('GET', 'HEAD'):
+            use_replica(request)
+        return view(context, request)
+    return wrapper
+
+
+def stick_to_primary(event):
+    """Set the sticky cookie on the response to a request that wrote.
+
+    Only requests that change something count: a GET may flush too, when
+    it stores an entry's re-rendered HTML, but its reader has no write of
+    their own to see.
+    """
+    request = event.request
+    info = DBSession().info
+    info.pop('replica', None)
+    wrote = info.pop('wrote', False)
+    if wrote and request.method not in ('GET', 'HEAD'):
+        lag = replica_lag(request.registry.settings)
+        event.response.set_cookie(STICKY_COOKIE, '1',
+                                  max_age=int(math.ceil(lag)),
+                                  path='/', httponly=True)
+
+
+def warm_pool(engine, count):
+    """Open count connections at once so the pool starts full."""
+    connections = []
+    try:
+        for _ in range(count):
+            connection = engine.connect()
+            connection.scalar(select([1]))
+            connections.append(connection)
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+
+def pool_status(engine):
+    """Return a dict describing the engine's connection pool."""
+    pool = engine.pool
+    status = {'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+            'max_overflow': pool._max_overflow,
+        })
+    if isinstance(pool, TimedQueuePool):
+        status.update({
+            'checkouts': pool.checkouts,
+            'waits': pool.waits,
+            'wait_seconds': round(pool.wait_seconds, 6),
+            'max_wait_seconds': round(pool.max_wait_seconds, 6),
+            'timeouts': pool.timeouts,
+        })
+    return status
+
+
+def check_database(engine):
+    """Return 'ok' if engine's database answers, else the error."""
+    try:
+        with engine.connect() as connection:
+            connection.scalar(select([1]))
+    except exc.SQLAlchemyError as error:
+        return str(error)
+    return 'ok'
+
+
+def ready_view(request):
+    """Report whether the databases answer, with connection pool stats."""
+    engine = request.registry.engine
+    replica = getattr(request.registry, 'replica_engine', None)
+    result = {
+        'database': check_database(engine),
+        'threads': server_threads(request.registry.settings),
+        'pool': pool_status(engine),
+    }
+    if replica is not None:
+        result['replica'] = check_database(replica)
+        result['replica_pool'] = pool_status(replica)
+    ok = (result['database'] == 'ok' and
+          result.get('replica', 'ok') == 'ok')
+    result['status'] = 'ok' if ok else 'unavailable'
+    if not ok:
+        request.response.status_int = 503
+    return result
+
+
+def includeme(config):
+    """Register this module's views, and read-your-writes for a replica."""
+    if getattr(config.registry, 'replica_engine', None) is not None:
+        config.add_subscriber(stick_to_primary, NewResponse)
+    config.add_view(ready_view,
+                    route_name='ready',
+                    renderer='json',
+                    permission='view',
+                    http_cache=0)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Atom feed of the most recent entries, with conditional GET.
+
+The feed's validators come from one aggregate query over entries (count
+and newest updated), so a reader polling an unchanged feed gets a 304
+without any entry being loaded or rendered. The rendered document is
+kept per process and reused until that state changes.
+"""
+import hashlib
+
+from pyramid.httpexceptions import HTTPNotModified
+from pyramid.renderers import render
+from pyramid.response import Response
+from sqlalchemy import func
+from sqlalchemy.orm import undefer_group
+from webob.datetime_utils import UTC, serialize_date
+
+from .db import replica_reads
+from .models import DBSession, Entry, RENDERER_VERSION
+
+DEFAULT_FEED_SIZE = 20
+FEED_TYPE = 'application/atom+xml'
+
+
+def feed_size_from_settings(settings):
+    """Return the number of entries the feed carries."""
+    return int(settings.get('journal.feed.size', DEFAULT_FEED_SIZE))
+
+
+def entries_state(session):
+    """Return (count, newest updated) for the entries table."""
+    return session.query(func.count(Entry.id), func.max(Entry.updated)).one()
+
+
+def feed_etag(count, updated, feed_size):
+    """Return an ETag that changes whenever the feed's content could."""
+    key = '{0}|{1}|{2}|{3}'.format(count, updated.isoformat() if updated
+                                   else '', feed_size, RENDERER_VERSION)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def not_modified(request, etag, last_modified):
+    """Return True if the request's validators match the current feed."""
+    if request.if_none_match:
+        return etag in request.if_none_match
+    since = request.if_modified_since
+    return (since is not None and last_modified is not None and
+            last_modified <= since)
+
+
+def recent_entries(session, feed_size):
+    """Return the newest entries with their bodies loaded."""
+    return (session.query(Entry)
+            .options(undefer_group('body'))
+            .order_by(Entry.created.desc(), Entry.id.desc())
+            .limit(feed_size)
+            .all())
+
+
+def feed_headers(etag, updated):
+    """Return the ETag, Last-Modified and Cache-Control headers."""
+    headers = {'ETag': '"{0}"'.format(etag),
+               'Cache-Control': 'max-age=0, must-revalidate'}
+    if updated is not None:
+        headers['Last-Modified'] = serialize_date(last_modified(updated))
+    return headers
+
+
+def last_modified(updated):
+    """Return updated as an aware datetime with HTTP-date precision."""
+    return updated.replace(microsecond=0, tzinfo=UTC)
+
+
+def feed_view(request):
+    """Return the Atom feed, or 304 if the reader's copy is current."""
+    feed_size = feed_size_from_settings(request.registry.settings)
+    count, updated = entries_state(DBSession)
+    etag = feed_etag(count, updated, feed_size)
+    if not_modified(request, etag,
+                    last_modified(updated) if updated else None):
+        return HTTPNotModified(headers=feed_headers(etag, updated))
+
+    cached = getattr(request.registry, 'feed_document', None)
+    if cached is not None and cached[0] == etag:
+        body = cached[1]
+    else:
+        entries = recent_entries(DBSession, feed_size)
+        stale = [entry for entry in entries if not entry.is_rendered]
+        if stale:
+            for entry in stale:
+                entry.render()
+            DBSession.flush()
+        body = render('templates/feed.atom.jinja2',
+                      {'entries': entries, 'updated': updated},
+                      request=request)
+        request.registry.feed_document = (etag, body)
+    response = Response(text=body, content_type=FEED_TYPE, charset='utf-8')
+    response.headers.update(feed_headers(etag, updated))
+    return response
+
+
+def includeme(config):
+    """Register the feed view."""
+    config.add_view(feed_view, route_name='feed', permission='view',
+                    decorator=replica_reads)
@@ -2,6 +2,9 @@
 
 """Define WTForm classes for adding and editing Entries into database."""
 
+from hashlib import md5
+
+from wtforms.ext.csrf.form import SecureForm
 from wtforms.validators import Length, InputRequired
 from wtforms import (
     StringField,
@@ -11,7 +14,22 @@ from wtforms import (
 )
 
 from .models import DBSession, Entry
-from .security import TotesSecureForm
+from .security import SECRET_KEY
+
+
+class TotesSecureForm(SecureForm):
+    """Secure form subclass with CSRF protection."""
+
+    def generate_csrf_token(self, csrf_context):
+        """Generate a CSRF Token."""
+        text = SECRET_KEY + csrf_context
+        token = md5(text.encode('utf-8')).hexdigest()
+        return token
+
+    def validate_csrf_token(self, field):
+        """Validate a given CSRF token."""
+        if field.data != field.current_token:
+            raise ValueError('Invalid CSRF')
 
 
 def unique_title(form, field):
@@ -46,6 +64,10 @@ class AddEntryForm(EditEntryForm):
         'Title', ADD_VALIDATORS)
 
 
+class RestoreRevisionForm(TotesSecureForm):
+    """Form confirming an entry's revision should be restored."""
+
+
 class LoginForm(TotesSecureForm):
     """Form for logging in user."""
 
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Content-addressed cache of highlighted code blocks.
+
+journalapp.hilite, the Markdown extension render_markdown loads, looks
+each code block's HTML up here first by a hash of its source and the
+highlighting options: in a bounded in-memory LRU and, when
+journal.highlight.cache_dir is set, in a directory shared by every
+worker, so re-rendering an entry only pays Pygments for the blocks that
+changed. This module imports neither Markdown nor Pygments, so sizing the
+cache at boot stays cheap.
+
+Settings: journal.highlight.cache_size (blocks held in memory, default
+512) and journal.highlight.cache_dir (off by default).
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from .cache import LRUCache
+
+DEFAULT_CACHE_SIZE = 512
+
+
+class HighlightCache(object):
+    """Highlighted HTML by key, in a bounded LRU and optionally on disk."""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, directory=None):
+        """Keep maxsize blocks in memory, and every block in directory."""
+        self.memory = LRUCache(maxsize)
+        self.directory = directory
+        self.disk_hits = 0
+
+    def path(self, key):
+        """Return the file holding key's HTML on disk."""
+        return os.path.join(self.directory, key[:2], key + '.html')
+
+    def get(self, key):
+        """Return the HTML stored under key, or None."""
+        html = self.memory.get(key)
+        if html is not None or self.directory is None:
+            return html
+        try:
+            with open(self.path(key), 'rb') as fh:
+                html = fh.read().decode('utf-8')
+        except (IOError, OSError):
+            return None
+        self.disk_hits += 1
+        self.memory.set(key, html)
+        return html
+
+    def set(self, key, html):
+        """Store html under key."""
+        self.memory.set(key, html)
+        if self.directory is not None:
+            self._write(self.path(key), html.encode('utf-8'))
+
+    def _write(self, path, data):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # another worker created it first
+                pass
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        getattr(os, 'replace', os.rename)(tmp, path)
+
+    def stats(self):
+        """Return a dict of the cache counters."""
+        stats = self.memory.stats()
+        stats['disk_hits'] = self.disk_hits
+        return stats
+
+
+_cache = HighlightCache()
+
+
+def get_highlight_cache():
+    """Return the process's highlight cache."""
+    return _cache
+
+
+def highlight_key(kind, source, options):
+    """Return the cache key for a kind of block with these options."""
+    import markdown
+    import pygments
+    data = json.dumps([kind, source, options, pygments.__version__,
+                       markdown.__version__], sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def includeme(config):
+    """Size the highlight cache, and give it a disk tier if configured."""
+    global _cache
+    settings = config.get_settings()
+    _cache = HighlightCache(
+        int(settings.get('journal.highlight.cache_size',
+                         DEFAULT_CACHE_SIZE)),
+        settings.get('journal.highlight.cache_dir') or None)
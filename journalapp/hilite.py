@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""codehilite and fenced_code, with each block's HTML cached by content.
+
+Fenced and indented code blocks go through Markdown's own fenced_code and
+codehilite processors one block at a time, so the HTML is exactly theirs;
+raw HTML an author writes is stashed before either runs and left alone.
+Blocks already in journalapp.highlight's cache skip Pygments. Only
+render_markdown loads this module, so Markdown and Pygments are not
+imported at boot.
+"""
+from markdown.extensions.codehilite import (
+    CodeHiliteExtension,
+    HiliteTreeprocessor,
+)
+from markdown.extensions.fenced_code import (
+    FencedBlockPreprocessor,
+    FencedCodeExtension,
+)
+from markdown.preprocessors import Preprocessor
+
+from .highlight import get_highlight_cache, highlight_key
+
+
+def last_stashed(md):
+    """Return the HTML most recently stored in md's stash."""
+    html = md.htmlStash.rawHtmlBlocks[-1]
+    return html[0] if isinstance(html, tuple) else html  # Markdown 2
+
+
+class CachedFencedPreprocessor(Preprocessor):
+    """Highlight fenced code blocks, one block at a time, through the cache.
+
+    A block missing from the cache is handed to fenced_code's own
+    preprocessor, which highlights it with codehilite and stashes it.
+    """
+
+    def __init__(self, md, config):
+        """Highlight with codehilite's config."""
+        super(CachedFencedPreprocessor, self).__init__(md)
+        self.md = md
+        self.config = config
+        try:
+            self.fenced = FencedBlockPreprocessor(
+                md, FencedCodeExtension().getConfigs())
+        except TypeError:  # Markdown 2
+            self.fenced = FencedBlockPreprocessor(md)
+
+    def run(self, lines):
+        """Return lines with each fenced block replaced by a placeholder."""
+        cache = get_highlight_cache()
+        text = '\n'.join(lines)
+        index = 0
+        while True:
+            match = self.fenced.FENCED_BLOCK_RE.search(text, index)
+            if match is None:
+                break
+            source = match.group()
+            key = highlight_key('fenced', source, self.config)
+            html = cache.get(key)
+            if html is not None:
+                block = '\n{0}\n'.format(self.md.htmlStash.store(html))
+            else:
+                block = '\n'.join(self.fenced.run(source.split('\n')))
+                if block == source:  # not a block fenced_code accepts
+                    index = match.start() + 1
+                    continue
+                cache.set(key, last_stashed(self.md))
+            text = text[:match.start()] + block + text[match.end():]
+            index = match.start() + len(block)
+        return text.split('\n')
+
+
+class CachedHiliteTreeprocessor(HiliteTreeprocessor):
+    """Highlight indented code blocks, one block at a time, via the cache."""
+
+    def run(self, root):
+        """Replace each <pre><code> block with a stashed placeholder."""
+        cache = get_highlight_cache()
+        for block in list(root.iter('pre')):
+            if len(block) != 1 or block[0].tag != 'code':
+                continue
+            if block[0].text is None:
+                continue
+            key = highlight_key('indented', block[0].text, self.config)
+            html = cache.get(key)
+            if html is None:
+                # block.iter('pre') yields only block, so codehilite
+                # highlights just this one.
+                super(CachedHiliteTreeprocessor, self).run(block)
+                cache.set(key, last_stashed(self.md))
+            else:
+                placeholder = self.md.htmlStash.store(html)
+                block.clear()
+                block.tag = 'p'
+                block.text = placeholder
+
+
+class HighlightExtension(CodeHiliteExtension):
+    """codehilite and fenced_code, through the shared highlight cache.
+
+    Takes codehilite's options. Registered as a codehilite extension, so
+    fenced_code highlights the blocks it is handed.
+    """
+
+    def extendMarkdown(self, md, md_globals=None):
+        """Replace the fenced code and highlighting processors."""
+        config = self.getConfigs()
+        fenced = CachedFencedPreprocessor(md, config)
+        hiliter = CachedHiliteTreeprocessor(md)
+        hiliter.md = md
+        hiliter.config = config
+        if hasattr(md.preprocessors, 'register'):
+            md.preprocessors.register(fenced, 'fenced_code_block', 25)
+            md.treeprocessors.register(hiliter, 'hilite', 30)
+        else:  # Markdown 2
+            md.preprocessors.add('fenced_code_block', fenced,
+                                 '>normalize_whitespace')
+            md.treeprocessors.add('hilite', hiliter, '<inline')
+        md.registerExtension(self)
+
+
+def makeExtension(*args, **kwargs):
+    """Return the extension, for loading by name."""
+    return HighlightExtension(*args, **kwargs)
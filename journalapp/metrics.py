@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""Per-route latency, status and SQL metrics in Prometheus text format.
+
+Enabled with journal.metrics = true. A tween times every request and an
+engine event pair counts the queries each request issues; both only touch
+a thread-local and take one short lock per request.
+"""
+import threading
+
+from pyramid.response import Response
+from pyramid.settings import asbool
+from pyramid.tweens import INGRESS
+from sqlalchemy import event
+
+from .cache import get_page_cache
+from .db import registry_engines
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # Python 2
+    from time import time as clock
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+NOT_FOUND_ROUTE = '__not_found__'
+
+_request_sql = threading.local()
+
+
+class Histogram(object):
+    """Cumulative bucket counts with a running sum and count."""
+
+    def __init__(self, buckets):
+        """Initialize empty buckets with the given upper bounds."""
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Record one observation."""
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        """Yield (name, labels, value) exposition samples."""
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield (name + '_bucket',
+                   labels + (('le', format_value(bound)),), cumulative)
+        yield name + '_bucket', labels + (('le', '+Inf'),), self.count
+        yield name + '_sum', labels, self.sum
+        yield name + '_count', labels, self.count
+
+
+class Metrics(object):
+    """Thread-safe store of request and query metrics."""
+
+    def __init__(self):
+        """Initialize with nothing recorded."""
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.latency = {}
+        self.responses = {}
+        self.queries = {}
+        self.query_seconds = {}
+        self.queries_per_request = {}
+        self.compressed = {}
+        self.bytes_saved = {}
+
+    def request_started(self):
+        """Count a request as in flight."""
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, route, status, seconds, queries,
+                         query_seconds):
+        """Record a finished request."""
+        with self._lock:
+            self.in_flight -= 1
+            if route not in self.latency:
+                self.latency[route] = Histogram(LATENCY_BUCKETS)
+                self.queries_per_request[route] = Histogram(
+                    QUERY_COUNT_BUCKETS)
+                self.queries[route] = 0
+                self.query_seconds[route] = 0.0
+            self.latency[route].observe(seconds)
+            self.queries_per_request[route].observe(queries)
+            self.queries[route] += queries
+            self.query_seconds[route] += query_seconds
+            key = (route, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def response_compressed(self, route, bytes_in, bytes_out):
+        """Record a compressed response and the bytes it saved."""
+        route = route or NOT_FOUND_ROUTE
+        with self._lock:
+            self.compressed[route] = self.compressed.get(route, 0) + 1
+            self.bytes_saved[route] = (self.bytes_saved.get(route, 0) +
+                                       bytes_in - bytes_out)
+
+    def families(self):
+        """Return (name, type, help, samples) for each metric family."""
+        with self._lock:
+            latency = sorted(self.latency.items())
+            per_request = sorted(self.queries_per_request.items())
+            families = [
+                ('journal_http_requests_in_flight', 'gauge',
+                 'Requests currently being handled.',
+                 [('journal_http_requests_in_flight', (), self.in_flight)]),
+                ('journal_http_request_duration_seconds', 'histogram',
+                 'Request latency by route.',
+                 [sample for route, hist in latency for sample in
+                  hist.samples('journal_http_request_duration_seconds',
+                               (('route', route),))]),
+                ('journal_http_responses_total', 'counter',
+                 'Responses by route and status code.',
+                 [('journal_http_responses_total',
+                   (('route', route), ('status', str(status))), count)
+                  for (route, status), count
+                  in sorted(self.responses.items())]),
+                ('journal_db_queries_total', 'counter',
+                 'SQL statements executed by route.',
+                 [('journal_db_queries_total', (('route', route),), count)
+                  for route, count in sorted(self.queries.items())]),
+                ('journal_db_query_seconds_total', 'counter',
+                 'Time spent executing SQL by route.',
+                 [('journal_db_query_seconds_total', (('route', route),),
+                   seconds)
+                  for route, seconds in sorted(self.query_seconds.items())]),
+                ('journal_db_queries_per_request', 'histogram',
+                 'SQL statements per request by route.',
+                 [sample for route, hist in per_request for sample in
+                  hist.samples('journal_db_queries_per_request',
+                               (('route', route),))]),
+                ('journal_http_compressed_responses_total', 'counter',
+                 'Responses sent compressed by route.',
+                 [('journal_http_compressed_responses_total',
+                   (('route', route),), count)
+                  for route, count in sorted(self.compressed.items())]),
+                ('journal_http_compression_saved_bytes_total', 'counter',
+                 'Bytes compression kept off the wire by route.',
+                 [('journal_http_compression_saved_bytes_total',
+                   (('route', route),), saved)
+                  for route, saved in sorted(self.bytes_saved.items())]),
+            ]
+        return families
+
+
+def format_value(value):
+    """Return a number formatted for the exposition format."""
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def escape_label(value):
+    """Escape a label value for the exposition format."""
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def exposition(families):
+    """Return families rendered in Prometheus text exposition format."""
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for sample_name, labels, value in samples:
+            if labels:
+                sample_name += '{' + ','.join(
+                    '{}="{}"'.format(key, escape_label(val))
+                    for key, val in labels) + '}'
+            lines.append('{} {}'.format(sample_name, format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def cache_families(request):
+    """Return metric families for the page cache and login protection."""
+    families = []
+    cache = get_page_cache(request)
+    if cache is not None:
+        stats = cache.stats()
+        for key in ('hits', 'misses', 'evictions', 'invalidations'):
+            name = 'journal_page_cache_{}_total'.format(key)
+            families.append((name, 'counter', 'Page cache {}.'.format(key),
+                             [(name, (), stats[key])]))
+        families.append(('journal_page_cache_size', 'gauge',
+                         'Pages currently cached.',
+                         [('journal_page_cache_size', (), stats['size'])]))
+    checker = getattr(request.registry, 'password_checker', None)
+    if checker is not None:
+        name = 'journal_password_checks_rejected_total'
+        families.append((name, 'counter',
+                         'Password checks refused because the pool was full.',
+                         [(name, (), checker.rejected)]))
+    throttle = getattr(request.registry, 'login_throttle', None)
+    if throttle is not None:
+        name = 'journal_logins_throttled_total'
+        families.append((name, 'counter', 'Login attempts throttled.',
+                         [(name, (), throttle.throttled)]))
+    return families
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    """Note when a statement started."""
+    conn.info.setdefault('journal_query_start', []).append(clock())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    """Add a finished statement to the current request's totals."""
+    elapsed = clock() - conn.info['journal_query_start'].pop()
+    totals = getattr(_request_sql, 'totals', None)
+    if totals is not None:
+        totals[0] += 1
+        totals[1] += elapsed
+
+
+def handle_error(context):
+    """Forget the start of a statement that raised.
+
+    after_cursor_execute never runs for it, and conn.info lives as long as
+    the pooled connection.
+    """
+    conn = context.connection
+    starts = conn.info.get('journal_query_start') if conn is not None else None
+    if context.statement is not None and starts:
+        starts.pop()
+
+
+def install_sql_hooks(engine):
+    """Count statements and their time on engine for the metrics tween."""
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', handle_error)
+
+
+def metrics_tween_factory(handler, registry):
+    """Return a tween recording latency, status and SQL use per route."""
+    metrics = registry.metrics
+
+    def metrics_tween(request):
+        metrics.request_started()
+        _request_sql.totals = totals = [0, 0.0]
+        status = 500
+        started = clock()
+        try:
+            response = handler(request)
+            status = response.status_int
+            return response
+        finally:
+            elapsed = clock() - started
+            _request_sql.totals = None
+            route = getattr(request, 'matched_route', None)
+            route_name = route.name if route is not None else NOT_FOUND_ROUTE
+            metrics.request_finished(route_name, status, elapsed,
+                                     totals[0], totals[1])
+    return metrics_tween
+
+
+def metrics_view(request):
+    """Return all metrics in Prometheus text format."""
+    families = request.registry.metrics.families() + cache_families(request)
+    response = Response(text=exposition(families),
+                        content_type='text/plain', charset='utf-8')
+    response.content_type_params = {'version': '0.0.4', 'charset': 'utf-8'}
+    response.cache_control.no_store = True
+    return response
+
+
+def includeme(config):
+    """Register the metrics tween and the /metrics route if enabled."""
+    settings = config.get_settings()
+    if not asbool(settings.get('journal.metrics', False)):
+        config.registry.metrics = None
+        return
+    config.registry.metrics = Metrics()
+    config.add_tween('journalapp.metrics.metrics_tween_factory',
+                     under=INGRESS)
+    config.add_route('metrics', '/metrics')
+    config.add_view(metrics_view, route_name='metrics', permission='metrics')
+    for engine in registry_engines(config.registry):
+        install_sql_hooks(engine)
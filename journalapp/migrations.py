@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Versioned schema migrations for the journal database.
+
+Each migration runs once and records its version in schema_versions.
+Migrations are written to be idempotent, so a database created by an
+older create_all (with no recorded versions) upgrades cleanly. Index
+builds on PostgreSQL use CREATE INDEX CONCURRENTLY outside a transaction
+so they never hold a long write lock on entries.
+"""
+import datetime
+from collections import namedtuple
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    inspect,
+    text,
+)
+
+from .models import Entry, EntryRevision, PG_SEARCH_VECTOR
+from .search import create_search_index, rebuild_search_index
+
+Migration = namedtuple('Migration',
+                       ['version', 'description', 'upgrade', 'transactional'])
+
+version_metadata = MetaData()
+schema_versions = Table(
+    'schema_versions', version_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(255)),
+    Column('applied', DateTime, default=datetime.datetime.utcnow),
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description, transactional=True):
+    """Register the decorated function as the given schema version."""
+    def register(upgrade):
+        MIGRATIONS.append(Migration(version, description, upgrade,
+                                    transactional))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return upgrade
+    return register
+
+
+def column_names(connection, table_name):
+    """Return the set of column names of a table."""
+    return set(col['name'] for col in
+               inspect(connection).get_columns(table_name))
+
+
+def create_index(connection, name, definition):
+    """Create an index if it does not exist, without locking on PostgreSQL.
+
+    An interrupted concurrent build leaves an invalid index behind, which
+    is dropped and rebuilt.
+    """
+    if connection.dialect.name == 'postgresql':
+        valid = connection.execute(text(
+            "SELECT i.indisvalid FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+        ), {'name': name}).scalar()
+        if valid is False:
+            connection.execute(text(
+                'DROP INDEX CONCURRENTLY IF EXISTS {}'.format(name)))
+        connection.execute(text(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS {} {}'.format(
+                name, definition)))
+    else:
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS {} {}'.format(name, definition)))
+
+
+@migration(1, 'create entries table')
+def create_entries(connection):
+    """Create the entries table on an empty database."""
+    Entry.__table__.create(connection, checkfirst=True)
+
+
+@migration(2, 'add rendered html columns to entries')
+def add_html_columns(connection):
+    """Add the html and html_version columns if they are missing."""
+    existing = column_names(connection, 'entries')
+    if 'html' not in existing:
+        connection.execute(text('ALTER TABLE entries ADD COLUMN html TEXT'))
+    if 'html_version' not in existing:
+        connection.execute(text(
+            'ALTER TABLE entries ADD COLUMN html_version INTEGER'))
+
+
+@migration(3, 'index entries by created, id', transactional=False)
+def index_created(connection):
+    """Index the list_view sort key."""
+    create_index(connection, 'ix_entries_created_id',
+                 'ON entries (created DESC, id DESC)')
+
+
+@migration(4, 'full-text search index', transactional=False)
+def search_index(connection):
+    """Create the full-text search index and fill it from entries."""
+    if connection.dialect.name == 'postgresql':
+        create_index(connection, 'ix_entries_search',
+                     'ON entries USING gin ((' + PG_SEARCH_VECTOR + '))')
+    else:
+        create_search_index(connection)
+        rebuild_search_index(connection)
+
+
+@migration(5, 'add updated timestamp to entries')
+def add_updated_column(connection):
+    """Add the updated column, starting existing rows at their created."""
+    if 'updated' not in column_names(connection, 'entries'):
+        connection.execute(text(
+            'ALTER TABLE entries ADD COLUMN updated TIMESTAMP'))
+    connection.execute(text(
+        'UPDATE entries SET updated = created WHERE updated IS NULL'))
+
+
+@migration(6, 'index entries by updated', transactional=False)
+def index_updated(connection):
+    """Index the feed's last-modified lookup."""
+    create_index(connection, 'ix_entries_updated', 'ON entries (updated)')
+
+
+@migration(7, 'create entry revisions table')
+def create_entry_revisions(connection):
+    """Create the table of entry revisions."""
+    EntryRevision.__table__.create(connection, checkfirst=True)
+
+
+def applied_versions(engine):
+    """Return the set of schema versions already applied."""
+    version_metadata.create_all(engine)
+    with engine.connect() as connection:
+        rows = connection.execute(schema_versions.select())
+        return set(row.version for row in rows)
+
+
+def record_version(connection, migration):
+    """Record a migration as applied."""
+    connection.execute(schema_versions.insert(),
+                       version=migration.version,
+                       description=migration.description)
+
+
+def pending_migrations(engine):
+    """Return the migrations not yet applied, oldest first."""
+    applied = applied_versions(engine)
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def upgrade(engine, report=None):
+    """Apply every pending migration in version order.
+
+    Migrations normally run in the same transaction that records their
+    version. On PostgreSQL, non-transactional ones (concurrent index
+    builds) run on an autocommit connection and are recorded once they
+    finish, which is why every migration must be safe to re-run.
+    """
+    applied = []
+    concurrent = engine.dialect.name == 'postgresql'
+    for pending in pending_migrations(engine):
+        if report is not None:
+            report('Applying {0.version}: {0.description}'.format(pending))
+        if pending.transactional or not concurrent:
+            with engine.begin() as connection:
+                pending.upgrade(connection)
+                record_version(connection, pending)
+        else:
+            with engine.connect() as connection:
+                autocommit = connection.execution_options(
+                    isolation_level='AUTOCOMMIT')
+                pending.upgrade(autocommit)
+            with engine.begin() as connection:
+                record_version(connection, pending)
+        applied.append(pending.version)
+    return applied
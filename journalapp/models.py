@@ -6,17 +6,78 @@ from sqlalchemy import (
     Text,
     DateTime,
     String,
+    DDL,
+    ForeignKey,
+    Index,
+    UniqueConstraint,
+    event,
+    inspect,
 )
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.orm import Session, deferred, scoped_session, sessionmaker
 from zope.sqlalchemy import ZopeTransactionExtension
 import datetime
-import markdown
 
-DBSession = scoped_session(sessionmaker(extension=ZopeTransactionExtension()))
+
+class RoutingSession(Session):
+    """Session that can send its reads to a replica engine.
+
+    Reads go to the replica only while info['replica'] is set, which
+    db.use_replica does for read-only views; flushes, and every read in a
+    session not so marked, use the primary bind. Any write marks
+    info['wrote'], so the request can be kept on the primary afterwards.
+    """
+
+    def __init__(self, replica=None, **kwargs):
+        """Create the session, reading from replica when asked to."""
+        super(RoutingSession, self).__init__(**kwargs)
+        self.replica = replica
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        """Return the replica for marked reads, else the primary bind."""
+        if (self.replica is not None and self.info.get('replica') and
+                not self._flushing):
+            return self.replica
+        return super(RoutingSession, self).get_bind(mapper, clause, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _note_flush(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_bulk_delete')
+@event.listens_for(RoutingSession, 'after_bulk_update')
+def _note_bulk_write(context):
+    context.session.info['wrote'] = True
+
+
+DBSession = scoped_session(sessionmaker(class_=RoutingSession,
+                                        extension=ZopeTransactionExtension()))
 Base = declarative_base()
 
+# Bump whenever render_markdown output changes; stale rows re-render on read.
+RENDERER_VERSION = 2
+
+# journalapp.hilite is codehilite and fenced_code with a cache of blocks.
+MARKDOWN_EXTENSIONS = ['journalapp.hilite']
+MARKDOWN_EXTENSION_CONFIGS = {
+    'journalapp.hilite': {'linenums': False, 'pygments_style': 'colorful'},
+}
+
+
+def render_markdown(text):
+    """Return the HTML for the given Markdown text."""
+    # Imported here: markdown and Pygments are slow to import and only
+    # needed when an entry is rendered, not on every worker boot.
+    import markdown
+    return markdown.markdown(
+        text or '',
+        extensions=MARKDOWN_EXTENSIONS,
+        extension_configs=MARKDOWN_EXTENSION_CONFIGS,
+    )
+
 
 class Entry(Base):
     """Model Entry."""
@@ -24,13 +85,120 @@ class Entry(Base):
     __tablename__ = "entries"
     id = Column(Integer, primary_key=True)
     title = Column(String(255), unique=True)
-    text = Column(Text)
+    # The body columns can be large, so they load only when asked for;
+    # use undefer_group('body') for queries that need them.
+    text = deferred(Column(Text), group='body')
     created = Column(DateTime, default=datetime.datetime.utcnow)
+    html = deferred(Column(Text), group='body')
+    html_version = Column(Integer)
+    # Bumped when the title or text changes (see _touch_updated), so the
+    # feed can tell when anything changed; re-rendering leaves it alone.
+    updated = Column(DateTime, default=datetime.datetime.utcnow)
+
+    # Matches the list_view sort order so each page is an index range scan.
+    __table_args__ = (
+        Index('ix_entries_created_id', created.desc(), id.desc()),
+        Index('ix_entries_updated', updated),
+    )
+
+    @property
+    def is_rendered(self):
+        """Return True if the stored HTML matches the current renderer."""
+        return self.html is not None and self.html_version == RENDERER_VERSION
+
+    def render(self):
+        """Render the Markdown text and store the HTML on this entry."""
+        self.html = render_markdown(self.text)
+        self.html_version = RENDERER_VERSION
+        return self.html
 
     @property
     def markdown(self):
-        ext = "codehilite(linenums=False, pygments_style=colorful)"
-        rendered = markdown.markdown(
-            self.text, extensions=[ext, 'fenced_code']
-        )
-        return rendered
+        """Return stored HTML, re-rendering it first if it is stale."""
+        if not self.is_rendered:
+            return self.render()
+        return self.html
+
+
+@event.listens_for(Entry, 'before_update')
+def _touch_updated(mapper, connection, entry):
+    state = inspect(entry)
+    if (state.attrs.title.history.has_changes() or
+            state.attrs.text.history.has_changes()):
+        entry.updated = datetime.datetime.utcnow()
+
+
+class EntryRevision(Base):
+    """One saved version of an entry's title and text.
+
+    A snapshot revision stores the whole text; the others store only a
+    line delta from the revision before. See journalapp.revisions.
+    """
+
+    __tablename__ = "entry_revisions"
+    id = Column(Integer, primary_key=True)
+    entry_id = Column(Integer, ForeignKey('entries.id', ondelete='CASCADE'),
+                      nullable=False)
+    number = Column(Integer, nullable=False)
+    title = Column(String(255))
+    text = Column(Text)
+    delta = Column(Text)
+    created = Column(DateTime, default=datetime.datetime.utcnow)
+
+    # Also the index every lookup of an entry's revisions uses.
+    __table_args__ = (
+        UniqueConstraint('entry_id', 'number',
+                         name='uq_entry_revisions_number'),
+    )
+
+    @property
+    def is_snapshot(self):
+        """Return True if this revision stores its full text."""
+        return self.delta is None
+
+
+# Full-text search index over entry titles and text. SQLite keeps an FTS5
+# external-content table in sync with triggers; PostgreSQL uses a GIN
+# expression index, which the database maintains itself.
+PG_SEARCH_VECTOR = (
+    "to_tsvector('english', coalesce(title, '') || ' ' || coalesce(text, ''))"
+)
+
+SEARCH_INDEX_DDL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5("
+        "title, text, content='entries', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS entries_fts_insert "
+        "AFTER INSERT ON entries BEGIN "
+        "INSERT INTO entries_fts(rowid, title, text) "
+        "VALUES (new.id, new.title, new.text); END",
+        "CREATE TRIGGER IF NOT EXISTS entries_fts_delete "
+        "AFTER DELETE ON entries BEGIN "
+        "INSERT INTO entries_fts(entries_fts, rowid, title, text) "
+        "VALUES ('delete', old.id, old.title, old.text); END",
+        "CREATE TRIGGER IF NOT EXISTS entries_fts_update "
+        "AFTER UPDATE OF title, text ON entries BEGIN "
+        "INSERT INTO entries_fts(entries_fts, rowid, title, text) "
+        "VALUES ('delete', old.id, old.title, old.text); "
+        "INSERT INTO entries_fts(rowid, title, text) "
+        "VALUES (new.id, new.title, new.text); END",
+    ],
+    'postgresql': [
+        "CREATE INDEX IF NOT EXISTS ix_entries_search ON entries "
+        "USING gin ((" + PG_SEARCH_VECTOR + "))",
+    ],
+}
+
+SEARCH_INDEX_DROP = {
+    'sqlite': ["DROP TABLE IF EXISTS entries_fts"],
+    'postgresql': [],
+}
+
+for _dialect, _statements in SEARCH_INDEX_DDL.items():
+    for _statement in _statements:
+        event.listen(Entry.__table__, 'after_create',
+                     DDL(_statement).execute_if(dialect=_dialect))
+for _dialect, _statements in SEARCH_INDEX_DROP.items():
+    for _statement in _statements:
+        event.listen(Entry.__table__, 'before_drop',
+                     DDL(_statement).execute_if(dialect=_dialect))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Keyset (cursor) pagination over entries ordered newest first."""
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+from .models import Entry
+
+CURSOR_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+DEFAULT_PAGE_SIZE = 20
+
+Page = namedtuple('Page', ['items', 'next_cursor', 'prev_cursor'])
+
+
+def encode_cursor(created, entry_id):
+    """Return a cursor string for the given sort key."""
+    return '{}_{}'.format(created.strftime(CURSOR_FORMAT), entry_id)
+
+
+def decode_cursor(cursor):
+    """Return the (created, id) sort key from a cursor string.
+
+    Raise ValueError if the cursor is malformed.
+    """
+    created, _, entry_id = cursor.rpartition('_')
+    return datetime.strptime(created, CURSOR_FORMAT), int(entry_id)
+
+
+def page_size_from_settings(settings, default=DEFAULT_PAGE_SIZE):
+    """Return the configured page size, falling back to the default."""
+    try:
+        page_size = int((settings or {}).get('journal.page_size', default))
+    except ValueError:
+        return default
+    return page_size if page_size > 0 else default
+
+
+def keyset_page(query, after=None, before=None,
+                page_size=DEFAULT_PAGE_SIZE,
+                created_col=Entry.created, id_col=Entry.id):
+    """Return a Page of rows from query, newest first.
+
+    With no cursor the first page is returned. ``after`` selects the page of
+    older rows following that cursor, ``before`` the page of newer rows
+    preceding it. Each page costs one indexed range scan of page_size + 1
+    rows regardless of how deep it is.
+    """
+    query = keyset_query(query, after, before, page_size, created_col,
+                         id_col)
+    return keyset_result(query.all(), after, before, page_size)
+
+
+def keyset_query(query, after=None, before=None,
+                 page_size=DEFAULT_PAGE_SIZE,
+                 created_col=Entry.created, id_col=Entry.id):
+    """Return query narrowed and ordered to fetch one page plus one row."""
+    if before is not None:
+        created, entry_id = decode_cursor(before)
+        query = query.filter(or_(
+            created_col > created,
+            and_(created_col == created, id_col > entry_id),
+        )).order_by(created_col.asc(), id_col.asc())
+    else:
+        if after is not None:
+            created, entry_id = decode_cursor(after)
+            query = query.filter(or_(
+                created_col < created,
+                and_(created_col == created, id_col < entry_id),
+            ))
+        query = query.order_by(created_col.desc(), id_col.desc())
+    return query.limit(page_size + 1)
+
+
+def keyset_result(rows, after=None, before=None,
+                  page_size=DEFAULT_PAGE_SIZE):
+    """Return the Page for rows fetched with keyset_query."""
+    rows = list(rows)
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if before is not None:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, after is not None
+
+    next_cursor = prev_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor(rows[-1].created, rows[-1].id)
+    if rows and has_prev:
+        prev_cursor = encode_cursor(rows[0].created, rows[0].id)
+    return Page(rows, next_cursor, prev_cursor)
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""Pre-fork serving: one listening socket shared by several waitress workers.
+
+The master binds the socket and forks workers. Each worker loads the app
+itself and serves the inherited socket with waitress, so the CPU-bound
+work (Markdown, Pygments, bcrypt, Jinja2) runs on every core instead of
+behind one GIL. The master replaces workers that exit.
+
+Signals to the master:
+
+- SIGHUP starts a fresh set of workers, then retires the old ones
+  gracefully, so the app's .ini settings (other than the thread count,
+  which the master reads) are reloaded without dropping requests. It
+  does not load new code: the master has already imported journalapp,
+  and forked workers inherit those modules, so deploying code needs a
+  full restart of the master.
+- SIGTERM and SIGINT stop every worker gracefully, then exit.
+
+A worker stops gracefully by closing its copy of the listening socket and
+finishing the requests it has, for at most graceful_timeout seconds.
+With max_requests set, a worker does this after that many requests (plus
+up to max_requests_jitter more, so workers do not all recycle at once).
+"""
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import time
+
+from waitress import create_server
+
+from .cache import share_page_cache_generation
+
+log = logging.getLogger(__name__)
+
+GRACEFUL_TIMEOUT = 30
+# A worker dying sooner than this after starting is assumed to be failing
+# at startup, and is respawned no faster than once a second.
+MIN_WORKER_LIFETIME = 1.0
+QUIET_PERIOD = 0.5
+
+
+def cpu_count():
+    """Return the number of CPUs, or 1 if it cannot be determined."""
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def worker_count(environ=os.environ):
+    """Return WEB_CONCURRENCY, defaulting to the number of CPUs."""
+    return int(environ.get('WEB_CONCURRENCY') or cpu_count())
+
+
+def bind_socket(host, port, backlog=1024):
+    """Return a listening TCP socket for the workers to share."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+class RequestLimit(object):
+    """WSGI middleware calling stop() once max_requests have started."""
+
+    def __init__(self, app, max_requests, stop):
+        """Wrap app."""
+        self.app = app
+        self.remaining = max_requests
+        self.stop = stop
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        """Serve the request, stopping the worker after the last one."""
+        with self._lock:
+            self.remaining -= 1
+            last = self.remaining == 0
+        if last:
+            self.stop()
+        return self.app(environ, start_response)
+
+
+class InFlight(object):
+    """WSGI middleware counting the requests being served.
+
+    A request counts until the server closes its response iterable, so a
+    streamed body is still in flight while it is being sent.
+    """
+
+    def __init__(self, app):
+        """Wrap app."""
+        self.app = app
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        """Serve the request, counting it until its response is closed."""
+        with self._lock:
+            self.count += 1
+        try:
+            return ClosingIterator(self.app(environ, start_response),
+                                   self._done)
+        except Exception:
+            self._done()
+            raise
+
+    def _done(self):
+        with self._lock:
+            self.count -= 1
+
+
+class ClosingIterator(object):
+    """Response iterable calling callback once, when it is closed."""
+
+    def __init__(self, iterable, callback):
+        """Wrap iterable."""
+        self.iterable = iterable
+        self.callback = callback
+
+    def __iter__(self):
+        """Iterate the wrapped response."""
+        return iter(self.iterable)
+
+    def close(self):
+        """Close the wrapped response, then call the callback."""
+        callback, self.callback = self.callback, None
+        try:
+            close = getattr(self.iterable, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            if callback is not None:
+                callback()
+
+
+class Worker(object):
+    """One forked process serving the shared socket with waitress."""
+
+    def __init__(self, app, sock, threads, max_requests=0,
+                 graceful_timeout=GRACEFUL_TIMEOUT):
+        """Create the waitress server for app on sock."""
+        if max_requests:
+            app = RequestLimit(app, max_requests, self.stop)
+        self.in_flight = InFlight(app)
+        # sockets= needs waitress 1.2.
+        self.server = create_server(self.in_flight, sockets=[sock],
+                                    threads=threads)
+        self.graceful_timeout = graceful_timeout
+        self._stopping = False
+
+    def run(self):
+        """Serve until stopped."""
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR1, self._exit)
+        self.server.run()
+
+    def stop(self):
+        """Stop accepting connections and exit once the work is done."""
+        if self._stopping:
+            return
+        self._stopping = True
+        drain = threading.Thread(target=self._drain)
+        drain.daemon = True
+        drain.start()
+
+    def _drain(self):
+        # Runs in its own thread: the listening socket is closed from the
+        # waitress loop via its trigger, and the exit is signalled back to
+        # the main thread, where waitress turns SystemExit into a shutdown.
+        self.server.trigger.pull_trigger(self._stop_accepting)
+        deadline = time.time() + self.graceful_timeout
+        quiet_since = None
+        while time.time() < deadline:
+            if self._idle():
+                quiet_since = quiet_since or time.time()
+                if time.time() - quiet_since >= QUIET_PERIOD:
+                    break
+            else:
+                quiet_since = None
+            time.sleep(0.1)
+        os.kill(os.getpid(), signal.SIGUSR1)
+
+    def _stop_accepting(self):
+        self.server.accepting = False
+        self.server.del_channel()
+        self.server.socket.close()
+
+    def _idle(self):
+        # Requests still queued for a thread are not counted; QUIET_PERIOD
+        # gives a thread that just finished time to pick the next one up.
+        return self.in_flight.count == 0
+
+    def _exit(self, signum, frame):
+        raise SystemExit(0)
+
+
+class Master(object):
+    """Fork, watch and replace workers serving one socket."""
+
+    def __init__(self, load_app, sock, workers, threads, max_requests=0,
+                 max_requests_jitter=0, graceful_timeout=GRACEFUL_TIMEOUT):
+        """Prepare to run workers; load_app() is called in each worker."""
+        self.load_app = load_app
+        self.sock = sock
+        self.num_workers = workers
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.workers = {}
+        self.retiring = {}
+        self._stopping = False
+        self._reload = False
+        self._last_failure = 0
+
+    def run(self):
+        """Run workers until SIGTERM or SIGINT."""
+        share_page_cache_generation()
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        log.info('Master %s serving %s with %d workers', os.getpid(),
+                 self.sock.getsockname(), self.num_workers)
+        while not self._stopping:
+            self.reap()
+            if self._reload:
+                self._reload = False
+                self.reload()
+            self.maintain()
+            time.sleep(0.2)
+        self.stop()
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _handle_reload(self, signum, frame):
+        self._reload = True
+
+    def spawn(self):
+        """Fork a worker and return its pid."""
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.time()
+            return pid
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        status = 0
+        try:
+            Worker(self.load_app(), self.sock, self.threads, max_requests,
+                   self.graceful_timeout).run()
+        except Exception:
+            log.exception('Worker %s failed', os.getpid())
+            status = 1
+        finally:
+            logging.shutdown()
+            os._exit(status)
+
+    def reap(self):
+        """Collect exited workers."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                return
+            if not pid:
+                return
+            started = self.workers.pop(pid, None)
+            self.retiring.pop(pid, None)
+            if started is not None:
+                log.info('Worker %s exited with status %s', pid, status)
+                if time.time() - started < MIN_WORKER_LIFETIME:
+                    self._last_failure = time.time()
+
+    def maintain(self):
+        """Start workers until there are num_workers, killing stragglers."""
+        now = time.time()
+        for pid, deadline in list(self.retiring.items()):
+            if now > deadline:
+                self.kill(pid, signal.SIGKILL)
+        while len(self.workers) < self.num_workers and not self._stopping:
+            if now - self._last_failure < MIN_WORKER_LIFETIME:
+                return
+            self.spawn()
+
+    def reload(self):
+        """Replace every worker without dropping the socket."""
+        old = list(self.workers)
+        self.workers.clear()
+        self.maintain()
+        for pid in old:
+            self.retire(pid)
+
+    def retire(self, pid):
+        """Ask a worker to stop gracefully, killing it after the timeout."""
+        self.workers.pop(pid, None)
+        self.retiring[pid] = time.time() + self.graceful_timeout
+        self.kill(pid, signal.SIGTERM)
+
+    def kill(self, pid, sig):
+        """Send sig to pid if it is still running."""
+        try:
+            os.kill(pid, sig)
+        except OSError:
+            self.retiring.pop(pid, None)
+
+    def stop(self):
+        """Stop every worker gracefully and wait for them to exit."""
+        for pid in list(self.workers):
+            self.retire(pid)
+        while self.retiring:
+            self.reap()
+            self.maintain()
+            time.sleep(0.1)
+        log.info('Master %s stopped', os.getpid())
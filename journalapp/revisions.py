@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Revision history of entries, stored as line deltas between snapshots.
+
+Each edit stores the entry's new title and text as its next revision. The
+text is stored as a delta from the previous revision's: a JSON list of
+[start, end] ranges of the previous lines to keep and strings of new lines
+to insert. Every journal.revisions.snapshot_every revisions (default 20),
+or whenever the delta would be no smaller, the full text is stored
+instead, so any revision is rebuilt from one snapshot and fewer than
+snapshot_every deltas read in a single query.
+
+An entry's history starts at its first edit, which also stores the text
+it had before as revision 1.
+"""
+import json
+from difflib import SequenceMatcher
+
+from pyramid.httpexceptions import HTTPFound, HTTPNotFound
+from sqlalchemy import func
+from sqlalchemy.orm import undefer_group
+
+from .cache import invalidate_pages
+from .models import DBSession, Entry, EntryRevision, render_markdown
+
+DEFAULT_SNAPSHOT_EVERY = 20
+
+
+def snapshot_every_from_settings(settings):
+    """Return the most revisions a delta chain may span."""
+    return max(1, int(settings.get('journal.revisions.snapshot_every',
+                                   DEFAULT_SNAPSHOT_EVERY)))
+
+
+def line_delta(old, new):
+    """Return the delta that turns text old into text new, as JSON."""
+    old_lines = (old or '').splitlines(True)
+    new_lines = (new or '').splitlines(True)
+    ops = []
+    matcher = SequenceMatcher(None, old_lines, new_lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(new_lines[j1:j2]))
+    return json.dumps(ops, separators=(',', ':'))
+
+
+def apply_delta(old, delta):
+    """Return the text a delta from line_delta makes of text old."""
+    old_lines = (old or '').splitlines(True)
+    parts = []
+    for op in json.loads(delta):
+        if isinstance(op, list):
+            parts.extend(old_lines[op[0]:op[1]])
+        else:
+            parts.append(op)
+    return ''.join(parts)
+
+
+def revision_chain(session, entry_id, number=None):
+    """Return the revisions needed to rebuild one, oldest first.
+
+    That is the latest snapshot at or before revision number (the newest
+    revision if None) and every revision after it up to number.
+    """
+    query = session.query(EntryRevision).filter(
+        EntryRevision.entry_id == entry_id)
+    if number is not None:
+        query = query.filter(EntryRevision.number <= number)
+    snapshot = (query.filter(EntryRevision.delta.is_(None))
+                .with_entities(func.max(EntryRevision.number))
+                .as_scalar())
+    return (query.filter(EntryRevision.number >= snapshot)
+            .order_by(EntryRevision.number)
+            .all())
+
+
+def chain_text(chain):
+    """Return the text of the last revision in a chain."""
+    text = chain[0].text
+    for revision in chain[1:]:
+        text = apply_delta(text, revision.delta)
+    return text
+
+
+def get_revision(session, entry_id, number):
+    """Return (revision, its text), or (None, None) if there is none."""
+    chain = revision_chain(session, entry_id, number)
+    if not chain or chain[-1].number != number:
+        return None, None
+    return chain[-1], chain_text(chain)
+
+
+def record_revision(session, entry, previous, snapshot_every):
+    """Store entry's title and text as its next revision, and return it.
+
+    previous is the (title, text) the entry had before this change; if
+    the entry has no history yet, that is stored first as revision 1.
+    Return None if neither title nor text changed.
+    """
+    chain = revision_chain(session, entry.id)
+    if chain:
+        last_title, last_text = chain[-1].title, chain_text(chain)
+    else:
+        last_title, last_text = previous
+    if (entry.title, entry.text) == (last_title, last_text):
+        return None
+    if not chain:
+        chain = [EntryRevision(entry_id=entry.id, number=1, title=last_title,
+                               text=last_text,
+                               created=entry.updated or entry.created)]
+        session.add(chain[0])
+
+    revision = EntryRevision(entry_id=entry.id, number=chain[-1].number + 1,
+                             title=entry.title)
+    delta = line_delta(last_text, entry.text)
+    if len(chain) >= snapshot_every or len(delta) >= len(entry.text or ''):
+        revision.text = entry.text
+    else:
+        revision.delta = delta
+    session.add(revision)
+    return revision
+
+
+def restore_revision(request, entry, number):
+    """Make revision number the entry's current title and text.
+
+    Return the new revision, or None if number is not a revision of entry.
+    """
+    revision, text = get_revision(DBSession, entry.id, number)
+    if revision is None:
+        return None
+    previous = (entry.title, entry.text)
+    entry.title, entry.text = revision.title, text
+    restored = record_revision(
+        DBSession, entry, previous,
+        snapshot_every_from_settings(request.registry.settings))
+    entry.render()
+    DBSession.flush()
+    invalidate_pages(request, entry.id)
+    return restored
+
+
+def get_entry_or_404(request):
+    """Return the matched entry, with its body loaded."""
+    entry = (DBSession.query(Entry).options(undefer_group('body'))
+             .get(request.matchdict['entry_id']))
+    if entry is None:
+        raise HTTPNotFound('Post {} does not exist.'.format(
+            request.matchdict['entry_id']))
+    return entry
+
+
+def revisions_view(request):
+    """List an entry's revisions, newest first."""
+    entry = get_entry_or_404(request)
+    revisions = (DBSession.query(EntryRevision.number, EntryRevision.title,
+                                 EntryRevision.created)
+                 .filter(EntryRevision.entry_id == entry.id)
+                 .order_by(EntryRevision.number.desc())
+                 .all())
+    return {'entry': entry, 'revisions': revisions}
+
+
+def revision_view(request):
+    """Show one revision of an entry; a POST restores it."""
+    from .forms import RestoreRevisionForm
+    from .views import get_auth_tkt_from_request
+    entry = get_entry_or_404(request)
+    try:
+        number = int(request.matchdict['number'])
+    except ValueError:
+        raise HTTPNotFound()
+    revision, text = get_revision(DBSession, entry.id, number)
+    if revision is None:
+        raise HTTPNotFound('Revision {} does not exist.'.format(number))
+
+    context = get_auth_tkt_from_request(request)
+    form = RestoreRevisionForm(request.POST, csrf_context=context)
+    error = None
+    if request.method == 'POST' and form.validate():
+        taken = (DBSession.query(Entry.id)
+                 .filter(Entry.title == revision.title, Entry.id != entry.id)
+                 .first())
+        if taken:
+            error = 'Another entry now has this title.'
+        else:
+            restore_revision(request, entry, number)
+            return HTTPFound(location=request.route_url('detail',
+                                                        entry_id=entry.id))
+    return {'entry': entry, 'revision': revision,
+            'html': render_markdown(text), 'form': form, 'error': error}
+
+
+def includeme(config):
+    """Register the revision views.
+
+    History can hold text an author has since removed, so reading it
+    needs the edit permission too.
+    """
+    config.add_view(revisions_view,
+                    route_name='revisions',
+                    renderer='templates/revisions.jinja2',
+                    permission='edit')
+    config.add_view(revision_view,
+                    route_name='revision',
+                    renderer='templates/revision.jinja2',
+                    permission='edit')
@@ -1 +1,38 @@
 # package
+"""Shared helpers for the journalapp console scripts."""
+import os
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+
+from pyramid.scripts.common import parse_vars
+
+
+def usage(argv):
+    """Print usage to command line."""
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [var=value]\n'
+          '(example: "%s development.ini")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def settings_from_argv(argv):
+    """Return app settings from a config_uri and var=value arguments.
+
+    DATABASE_URL in the environment overrides sqlalchemy.url.
+    """
+    if len(argv) < 2:
+        usage(argv)
+
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, options=options)
+
+    database_url = os.environ.get('DATABASE_URL', None)
+    if database_url is not None:
+        settings['sqlalchemy.url'] = database_url
+    return settings
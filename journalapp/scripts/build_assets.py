@@ -0,0 +1,12 @@
+"""Fingerprint and precompress the static assets into static/dist."""
+import sys
+
+from ..assets import brotli, build_assets
+
+
+def main(argv=sys.argv):
+    """Build static/dist and its manifest."""
+    manifest = build_assets()
+    print('Built {0} assets{1}.'.format(
+        len(manifest), '' if brotli is not None else
+        ' (install brotli for .br files)'))
@@ -0,0 +1,130 @@
+"""Dump the entries table as newline-delimited JSON.
+
+usage: dump_entries <config_uri> <output>
+
+Writes one JSON object per entry, in id order, to output ('-' for
+stdout), gzip-compressed when output ends in .gz. Rows are streamed, so
+memory stays flat however large the journal. On PostgreSQL the server
+builds the JSON and sends it with COPY. Read the dump back with
+restore_entries.
+"""
+import gzip
+import json
+import os
+import sys
+
+from sqlalchemy import engine_from_config, select
+
+from . import settings_from_argv
+from ..models import Entry
+
+COLUMNS = ('id', 'title', 'text', 'html', 'html_version', 'created',
+           'updated')
+DATETIME_COLUMNS = ('created', 'updated')
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# zlib's default; gzip's own 9 costs far more time than it saves space.
+GZIP_LEVEL = 6
+# The same format, for PostgreSQL's to_char.
+PG_DATETIME_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS.US'
+# COPY's csv format with quote and delimiter characters JSON text never
+# contains raw, so each line passes through unescaped.
+PG_COPY_OPTIONS = "(FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+PG_DUMP_SQL = (
+    "COPY (SELECT json_build_object({0}) FROM entries ORDER BY id) "
+    "TO STDOUT WITH " + PG_COPY_OPTIONS
+).format(', '.join(
+    "'{0}', to_char({0}, '{1}')".format(name, PG_DATETIME_FORMAT)
+    if name in DATETIME_COLUMNS else "'{0}', {0}".format(name)
+    for name in COLUMNS))
+
+
+def usage(argv):
+    """Print usage to command line."""
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> <output>\n'
+          '(example: "%s production.ini entries.ndjson.gz")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def open_stream(path, mode):
+    """Open path as a binary stream, '-' meaning stdin or stdout.
+
+    A path ending in .gz is read or written through gzip.
+    """
+    if path == '-':
+        stream = sys.stdin if mode == 'rb' else sys.stdout
+        stream = getattr(stream, 'buffer', stream)
+        return _Unclosed(stream)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, compresslevel=GZIP_LEVEL)
+    return open(path, mode)
+
+
+class _Unclosed(object):
+    """Wrap a standard stream so closing it only flushes it."""
+
+    def __init__(self, stream):
+        """Wrap stream, which is not ours to close."""
+        self._stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._stream.flush()
+
+
+def entry_line(row):
+    """Return the NDJSON line for an entry row, as bytes."""
+    data = {}
+    for name in COLUMNS:
+        value = row[name]
+        if name in DATETIME_COLUMNS and value is not None:
+            value = value.strftime(DATETIME_FORMAT)
+        data[name] = value
+    return json.dumps(data, sort_keys=True).encode('utf-8') + b'\n'
+
+
+def dump_entries(engine, stream):
+    """Write every entry to stream as NDJSON; return the number written."""
+    with engine.connect() as connection:
+        if connection.dialect.name == 'postgresql':
+            return copy_entries_out(connection, stream)
+        count = 0
+        result = connection.execution_options(stream_results=True).execute(
+            select([Entry.__table__.c[name] for name in COLUMNS])
+            .order_by(Entry.id))
+        for row in result:
+            stream.write(entry_line(row))
+            count += 1
+        return count
+
+
+def copy_entries_out(connection, stream):
+    """Write every entry to stream with COPY; return the number written."""
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(PG_DUMP_SQL, stream)
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def main(argv=sys.argv):
+    """Dump the entries to a file or stdout."""
+    if len(argv) < 3:
+        usage(argv)
+    settings = settings_from_argv(argv[:2])
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    with open_stream(argv[2], 'wb') as stream:
+        count = dump_entries(engine, stream)
+    sys.stderr.write('{0} entries dumped.\n'.format(count))
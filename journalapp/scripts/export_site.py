@@ -0,0 +1,249 @@
+"""Export the journal as static HTML files, for serving from a CDN.
+
+usage: export_site <config_uri> <output_dir> [base_url]
+
+Writes index.html and page/<n>/index.html for the entry list,
+detail/<id>/index.html for every entry, feed.atom, and a copy of static/,
+with links under base_url (default http://localhost). The inputs of every
+file written are hashed into <output_dir>/export-manifest.json; the next
+export re-renders only the files whose hash changed and removes the files
+of deleted entries. Any template, static file or base_url change
+re-renders everything.
+"""
+import binascii
+import hashlib
+import json
+import os
+import sys
+
+import transaction
+from pyramid.renderers import render
+from pyramid.request import Request
+from pyramid.scripting import prepare
+from sqlalchemy import engine_from_config
+from sqlalchemy.orm import undefer_group
+
+from . import settings_from_argv
+from .. import make_config
+from ..assets import STATIC_DIR, write_file
+from ..feed import (
+    entries_state,
+    feed_etag,
+    feed_size_from_settings,
+    recent_entries,
+)
+from ..models import DBSession, Entry, RENDERER_VERSION
+from ..pagination import page_size_from_settings
+
+MANIFEST = 'export-manifest.json'
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                            'templates')
+DEFAULT_BASE_URL = 'http://localhost'
+BATCH_SIZE = 100
+
+
+def usage(argv):
+    """Print usage to command line."""
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> <output_dir> [base_url]\n'
+          '(example: "%s production.ini site https://journal.example.com")'
+          % (cmd, cmd))
+    sys.exit(1)
+
+
+def content_hash(*parts):
+    """Return a hash of JSON-serializable parts."""
+    data = json.dumps(parts, default=str, sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def file_hashes(directory, names):
+    """Return {name: sha256 of its content} for files under directory."""
+    hashes = {}
+    for name in names:
+        with open(os.path.join(directory, *name.split('/')), 'rb') as fh:
+            hashes[name] = hashlib.sha256(fh.read()).hexdigest()
+    return hashes
+
+
+def static_files(directory):
+    """Return the paths of every file under directory, built assets too."""
+    names = []
+    for root, dirs, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.relpath(os.path.join(root, filename), directory)
+            names.append(path.replace(os.sep, '/'))
+    return sorted(names)
+
+
+def site_key(base_url, static, page_size, feed_size):
+    """Return a hash of every input shared by all exported pages."""
+    templates = file_hashes(TEMPLATE_DIR, sorted(os.listdir(TEMPLATE_DIR)))
+    return content_hash(base_url, RENDERER_VERSION, page_size, feed_size,
+                        templates, static)
+
+
+def entry_rows(session):
+    """Return (id, title, created, updated, html_version) newest first."""
+    return (session.query(Entry.id, Entry.title, Entry.created,
+                          Entry.updated, Entry.html_version)
+            .order_by(Entry.created.desc(), Entry.id.desc())
+            .all())
+
+
+def entry_key(row):
+    """Return a hash of the entry fields an exported page depends on."""
+    # Called for every entry on every export, so kept cheaper than JSON.
+    key = u'{0}|{1}|{2}|{3}|{4}'.format(row.id, row.title, row.created,
+                                        row.updated, row.html_version)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def page_url(request, number):
+    """Return the URL of the given list page."""
+    if number == 1:
+        return request.route_url('list')
+    return '{0}/page/{1}/'.format(request.application_url, number)
+
+
+def page_path(number):
+    """Return the output path of the given list page."""
+    if number == 1:
+        return 'index.html'
+    return 'page/{0}/index.html'.format(number)
+
+
+def detail_path(entry_id):
+    """Return the output path of an entry, matching its detail route."""
+    return 'detail/{0}/index.html'.format(entry_id)
+
+
+def load_manifest(output_dir):
+    """Return the previous export's manifest, or an empty one."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST)) as fh:
+            return json.load(fh)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_output(output_dir, path, data):
+    """Write data to path under output_dir atomically."""
+    target = os.path.join(output_dir, *path.split('/'))
+    if not os.path.isdir(os.path.dirname(target)):
+        os.makedirs(os.path.dirname(target))
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    write_file(target, data)
+
+
+def remove_output(output_dir, path):
+    """Remove path under output_dir and any directories it leaves empty."""
+    target = os.path.join(output_dir, *path.split('/'))
+    if os.path.exists(target):
+        os.remove(target)
+    directory = os.path.dirname(target)
+    while os.path.abspath(directory) != os.path.abspath(output_dir):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+        directory = os.path.dirname(directory)
+
+
+def export_site(request, output_dir, session=DBSession):
+    """Export the site into output_dir; return (written, removed) counts."""
+    settings = request.registry.settings
+    page_size = page_size_from_settings(settings)
+    feed_size = feed_size_from_settings(settings)
+    static = file_hashes(STATIC_DIR, static_files(STATIC_DIR))
+    site = site_key(request.application_url, static, page_size, feed_size)
+    manifest = load_manifest(output_dir)
+    previous = (manifest.get('files', {}) if manifest.get('site') == site
+                else {})
+    files = {}
+    written = []
+
+    def changed(path, key):
+        files[path] = key
+        return previous.get(path) != key
+
+    for name, digest in static.items():
+        path = 'static/' + name
+        if changed(path, digest):
+            with open(os.path.join(STATIC_DIR, *name.split('/')), 'rb') as fh:
+                write_output(output_dir, path, fh.read())
+            written.append(path)
+
+    rows = entry_rows(session)
+    keys = dict((row.id, entry_key(row)) for row in rows)
+    stale_ids = [row.id for row in rows
+                 if changed(detail_path(row.id), keys[row.id])]
+    for start in range(0, len(stale_ids), BATCH_SIZE):
+        batch = stale_ids[start:start + BATCH_SIZE]
+        query = session.query(Entry).options(undefer_group('body'))
+        for entry in query.filter(Entry.id.in_(batch)):
+            # Detached, so HTML rendered for a stale entry is never stored.
+            session.expunge(entry)
+            write_output(output_dir, detail_path(entry.id),
+                         render('templates/detail.jinja2', {'entry': entry},
+                                request=request))
+            written.append(detail_path(entry.id))
+
+    pages = [rows[start:start + page_size]
+             for start in range(0, len(rows), page_size)] or [[]]
+    for number, items in enumerate(pages, 1):
+        next_url = (page_url(request, number + 1) if number < len(pages)
+                    else None)
+        prev_url = page_url(request, number - 1) if number > 1 else None
+        key = content_hash([keys[row.id] for row in items], next_url,
+                           prev_url)
+        if changed(page_path(number), key):
+            write_output(output_dir, page_path(number), render(
+                'templates/list.jinja2',
+                {'entries': items, 'next_url': next_url,
+                 'prev_url': prev_url},
+                request=request))
+            written.append(page_path(number))
+
+    count, updated = entries_state(session)
+    if changed('feed.atom', feed_etag(count, updated, feed_size)):
+        entries = recent_entries(session, feed_size)
+        for entry in entries:
+            session.expunge(entry)
+        write_output(output_dir, 'feed.atom', render(
+            'templates/feed.atom.jinja2',
+            {'entries': entries, 'updated': updated},
+            request=request))
+        written.append('feed.atom')
+
+    removed = [path for path in manifest.get('files', {})
+               if path not in files]
+    for path in removed:
+        remove_output(output_dir, path)
+    write_output(output_dir, MANIFEST, json.dumps(
+        {'site': site, 'files': files}, sort_keys=True))
+    return len(written), len(removed)
+
+
+def main(argv=sys.argv):
+    """Export the site, re-rendering only what changed."""
+    if len(argv) < 3:
+        usage(argv)
+    output_dir = argv[2]
+    base_url = argv[3] if len(argv) > 3 else DEFAULT_BASE_URL
+    settings = settings_from_argv(argv[:2])
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    DBSession.configure(bind=engine)
+    # Only anonymous pages are exported, so no ticket is ever signed.
+    config = make_config(settings,
+                         binascii.hexlify(os.urandom(16)).decode('ascii'))
+    config.commit()
+    env = prepare(request=Request.blank('/', base_url=base_url),
+                  registry=config.registry)
+    try:
+        written, removed = export_site(env['request'], output_dir)
+    finally:
+        transaction.abort()
+        env['closer']()
+    print('{0} files written, {1} removed.'.format(written, removed))
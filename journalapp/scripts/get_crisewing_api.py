@@ -1,14 +1,23 @@
 """Script to retrieve existing journal entries in Cris Ewing's database."""
+from __future__ import print_function
 
+import codecs
+import json
 import os
 import sys
+import time
 import requests
 from journalapp.scripts import initializedb
 from datetime import datetime
 from journalapp.models import Entry, DBSession
+from sqlalchemy.orm import scoped_session
+from zope.sqlalchemy import mark_changed
 import transaction
 
 DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+EXPORT_URL = 'https://sea401d2.crisewing.com/api/export'
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 500
 
 
 def get_api_key():
@@ -20,10 +29,52 @@ def get_api_key():
     return key
 
 
-def get_api_response(key):
-    """Return a Response object from the requests module."""
-    url = 'https://sea401d2.crisewing.com/api/export?apikey={}'.format(key)
-    return requests.get(url)
+def get_api_response(key, url=None):
+    """Return a streaming Response object from the requests module.
+
+    The export URL can be pointed at a stand-in server with the
+    CRISEWING_API_URL environment variable.
+    """
+    url = url or os.environ.get('CRISEWING_API_URL', EXPORT_URL)
+    return requests.get(url, params={'apikey': key}, stream=True)
+
+
+def iter_json_array(chunks):
+    """Yield each element of a JSON array as its text arrives in chunks.
+
+    Only one element is held in memory at a time, so the export never has
+    to be loaded whole. Raise ValueError if the input is not an array or
+    ends early.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf = u''
+    started = False
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = utf8.decode(chunk)
+        buf += chunk
+        while True:
+            buf = buf.lstrip()
+            if not buf:
+                break
+            if not started:
+                if buf[0] != u'[':
+                    raise ValueError('Expected a JSON array.')
+                buf = buf[1:]
+                started = True
+            elif buf[0] == u',':
+                buf = buf[1:]
+            elif buf[0] == u']':
+                return
+            else:
+                try:
+                    element, end = decoder.raw_decode(buf)
+                except ValueError:
+                    break  # Element continues in the next chunk.
+                yield element
+                buf = buf[end:]
+    raise ValueError('JSON array ended early.')
 
 
 def format_datetime(string):
@@ -31,18 +82,20 @@ def format_datetime(string):
     return datetime.strptime(string, DATETIME_FORMAT)
 
 
-def entries_from_list(entry_list):
-    """Return a list of new Entry objects from list of dicts."""
-    new_entries = []
-    for entry_dict in entry_list:
+def iter_entries(entry_dicts):
+    """Yield a new Entry object for each of my entries in entry_dicts."""
+    for entry_dict in entry_dicts:
         if not is_mine(entry_dict):
             continue
         created = format_datetime(entry_dict['created'])
-        new_entry = Entry(created=created,
-                          title=entry_dict['title'],
-                          text=entry_dict['text'])
-        new_entries.append(new_entry)
-    return new_entries
+        yield Entry(created=created,
+                    title=entry_dict['title'],
+                    text=entry_dict['text'])
+
+
+def entries_from_list(entry_list):
+    """Return a list of new Entry objects from list of dicts."""
+    return list(iter_entries(entry_list))
 
 
 def is_mine(entry_dict):
@@ -52,19 +105,63 @@ def is_mine(entry_dict):
                 author.get('display_name', '') == 'Will Weatherford'])
 
 
-def add_entries_to_db(entries, session):
-    """Add the given list of Entry models to the given db session."""
-    success_count = 0
-    for entry in entries:
-        if session.query(Entry).filter_by(title=entry.title).count():
-            print('{} is already in the database.'.format(entry.title))
-            continue
-        session.add(entry)
-        session.flush()
-        success_count += 1
+def iter_batches(items, batch_size):
+    """Yield lists of up to batch_size items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def add_entries_to_db(entries, session, batch_size=BATCH_SIZE,
+                      progress=None):
+    """Insert the given Entry models into the database, skipping dupes.
+
+    Entries are handled in batches: one query finds the titles already
+    present, and the rest go in as a single multi-row insert. The Entry
+    objects themselves are never added to the session. progress, if
+    given, is called after each batch with the running counts of entries
+    seen and inserted and the seconds elapsed.
+    """
+    if isinstance(session, scoped_session):
+        session = session()
+    table = Entry.__table__
+    started = time.time()
+    seen_count = success_count = 0
+    for batch in iter_batches(entries, batch_size):
+        titles = [entry.title for entry in batch]
+        existing = set(title for title, in session.query(Entry.title)
+                       .filter(Entry.title.in_(titles)))
+        rows = []
+        for entry in batch:
+            if entry.title in existing:
+                print('{} is already in the database.'.format(entry.title))
+                continue
+            existing.add(entry.title)
+            rows.append({'title': entry.title,
+                         'text': entry.text,
+                         'created': entry.created})
+        if rows:
+            session.execute(table.insert(), rows)
+            mark_changed(session)
+        seen_count += len(batch)
+        success_count += len(rows)
+        if progress is not None:
+            progress(seen_count, success_count, time.time() - started)
     return success_count
 
 
+def print_progress(seen_count, success_count, elapsed):
+    """Print import progress and throughput."""
+    rate = seen_count / elapsed if elapsed else 0.0
+    print('{} entries read, {} added ({:.0f} entries/s).'.format(
+        seen_count, success_count, rate))
+
+
 def main():
     """Run the whole script and put new items into database."""
     if len(sys.argv) < 2:
@@ -73,9 +170,11 @@ def main():
     initializedb.main()
     key = get_api_key()
     response = get_api_response(key)
-    entries_list = response.json()
-    entries = entries_from_list(entries_list)
-    success_count = add_entries_to_db(entries, DBSession)
+    response.raise_for_status()
+    entry_dicts = iter_json_array(response.iter_content(CHUNK_SIZE))
+    entries = iter_entries(entry_dicts)
+    success_count = add_entries_to_db(entries, DBSession,
+                                      progress=print_progress)
     if success_count:
         transaction.commit()
     print('{} entries successfully migrated.'.format(success_count))
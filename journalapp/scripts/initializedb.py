@@ -1,46 +1,20 @@
 """Initialize DB."""
-import os
 import sys
 
 from sqlalchemy import engine_from_config
 
-from pyramid.paster import (
-    get_appsettings,
-    setup_logging,
-)
-
-from pyramid.scripts.common import parse_vars
-
+from . import settings_from_argv
+from ..migrations import upgrade
 from ..models import (
     DBSession,
-    Base,
     Entry
 )
 
 
-def usage(argv):
-    """Print usage to command line."""
-    cmd = os.path.basename(argv[0])
-    print('usage: %s <config_uri> [var=value]\n'
-          '(example: "%s development.ini")' % (cmd, cmd))
-    sys.exit(1)
-
-
 def main(argv=sys.argv):
-    """Set up engine and session."""
-    if len(argv) < 2:
-        usage(argv)
-
-    config_uri = argv[1]
-    options = parse_vars(argv[2:])
-    setup_logging(config_uri)
-    settings = get_appsettings(config_uri, options=options)
-
-    database_url = os.environ.get('DATABASE_URL', None)
-    if database_url is not None:
-        settings['sqlalchemy.url'] = database_url
-
+    """Set up engine and session, then bring the schema up to date."""
+    settings = settings_from_argv(argv)
     engine = engine_from_config(settings, 'sqlalchemy.')
     DBSession.configure(bind=engine)
-    Base.metadata.create_all(engine)
+    upgrade(engine)
     DBSession.query(Entry)
@@ -0,0 +1,23 @@
+"""Compile the Jinja2 templates into the bytecode cache before serving."""
+import binascii
+import os
+import sys
+
+from . import settings_from_argv
+from .. import make_config
+from ..templating import precompile, template_names
+
+
+def main(argv=sys.argv):
+    """Fill the bytecode cache configured by jinja2.bytecode_caching."""
+    settings = settings_from_argv(argv)
+    # No request is served, so no ticket is ever signed.
+    config = make_config(settings,
+                         binascii.hexlify(os.urandom(16)).decode('ascii'))
+    config.commit()
+    cache = config.registry.bytecode_cache
+    if cache is None:
+        print('jinja2.bytecode_caching is off; nothing to precompile.')
+        sys.exit(1)
+    count = precompile(config.get_jinja2_environment(), template_names())
+    print('{0} templates compiled into {1}.'.format(count, cache.directory))
@@ -0,0 +1,17 @@
+"""Create the full-text search index if missing and rebuild it."""
+import sys
+
+from sqlalchemy import engine_from_config
+
+from . import settings_from_argv
+from ..search import create_search_index, rebuild_search_index
+
+
+def main(argv=sys.argv):
+    """Rebuild the search index from the entries table."""
+    settings = settings_from_argv(argv)
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    with engine.begin() as connection:
+        create_search_index(connection)
+        rebuild_search_index(connection)
+    print('Search index rebuilt.')
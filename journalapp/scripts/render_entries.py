@@ -0,0 +1,48 @@
+"""Render stored HTML for entries that are missing it or are out of date."""
+import sys
+
+import transaction
+from sqlalchemy import engine_from_config, or_
+from sqlalchemy.orm import undefer_group
+
+from . import settings_from_argv
+from ..models import (
+    DBSession,
+    Entry,
+    RENDERER_VERSION,
+)
+
+BATCH_SIZE = 100
+
+
+def stale_entry_ids(session):
+    """Return ids of entries whose stored HTML needs rendering."""
+    query = session.query(Entry.id).filter(or_(
+        Entry.html.is_(None),
+        Entry.html_version.is_(None),
+        Entry.html_version != RENDERER_VERSION,
+    )).order_by(Entry.id)
+    return [entry_id for entry_id, in query]
+
+
+def render_entries(session, entry_ids, batch_size=BATCH_SIZE):
+    """Render the given entries, committing once per batch."""
+    rendered = 0
+    for start in range(0, len(entry_ids), batch_size):
+        batch = entry_ids[start:start + batch_size]
+        with transaction.manager:
+            query = session.query(Entry).options(undefer_group('body'))
+            for entry in query.filter(Entry.id.in_(batch)):
+                entry.render()
+                rendered += 1
+    return rendered
+
+
+def main(argv=sys.argv):
+    """Backfill rendered HTML for every stale entry."""
+    settings = settings_from_argv(argv)
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    DBSession.configure(bind=engine)
+    entry_ids = stale_entry_ids(DBSession)
+    rendered = render_entries(DBSession, entry_ids)
+    print('{} entries rendered.'.format(rendered))
@@ -0,0 +1,211 @@
+"""Restore entries from a dump_entries NDJSON file.
+
+usage: restore_entries <config_uri> <input> [--on-conflict=skip|replace|error]
+                       [--keep-ids]
+
+Reads input ('-' for stdin, gunzipped when it ends in .gz) in one
+transaction. An entry whose title is already present is skipped (the
+default), replaces the stored entry's text and dates (replace), or aborts
+the whole restore (error). Entries get new ids unless --keep-ids is given,
+in which case an id already taken by another title aborts the restore.
+On PostgreSQL the file is sent with COPY and inserted in one statement;
+elsewhere rows are inserted with executemany, BATCH_SIZE at a time.
+
+The restore writes to the database directly, so running app processes
+are not told of it and keep serving the pages they have cached: restart
+the app after restoring into a live database.
+"""
+import datetime
+import json
+import os
+import re
+import sys
+
+from sqlalchemy import bindparam, engine_from_config, exc, text
+
+from . import settings_from_argv
+from .dump_entries import (
+    COLUMNS,
+    DATETIME_COLUMNS,
+    PG_COPY_OPTIONS,
+    open_stream,
+)
+from ..models import Entry
+
+ON_CONFLICT = ('skip', 'replace', 'error')
+BATCH_SIZE = 5000
+# Columns a replaced entry takes from the dump; updated is set to the time
+# of the restore instead, so feed and API validators see the change.
+REPLACED_COLUMNS = ('text', 'html', 'html_version', 'created')
+# DATETIME_FORMAT, matched directly: strptime would dominate restore time.
+DATETIME_PATTERN = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)\.(\d{6})$')
+PG_CASTS = {'id': 'integer', 'html_version': 'integer',
+            'created': 'timestamp', 'updated': 'timestamp'}
+
+
+def usage(argv):
+    """Print usage to command line."""
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> <input> '
+          '[--on-conflict=skip|replace|error] [--keep-ids]\n'
+          '(example: "%s development.ini entries.ndjson.gz")\n'
+          'Restart the app afterwards; its page cache does not see the '
+          'restore.' % (cmd, cmd))
+    sys.exit(1)
+
+
+def parse_options(args, argv):
+    """Return (on_conflict, keep_ids) from the command-line options."""
+    on_conflict, keep_ids = 'skip', False
+    for arg in args:
+        name, _, value = arg.partition('=')
+        if name == '--on-conflict' and value in ON_CONFLICT:
+            on_conflict = value
+        elif arg == '--keep-ids':
+            keep_ids = True
+        else:
+            usage(argv)
+    return on_conflict, keep_ids
+
+
+def insert_columns(keep_ids):
+    """Return the columns restored into each new entry."""
+    return COLUMNS if keep_ids else COLUMNS[1:]
+
+
+def conflict_clause(on_conflict, restored_at):
+    """Return the ON CONFLICT clause for on_conflict, or ''.
+
+    SQLite and PostgreSQL share the syntax. restored_at is the SQL giving
+    the time of the restore.
+    """
+    if on_conflict == 'skip':
+        return ' ON CONFLICT (title) DO NOTHING'
+    if on_conflict == 'replace':
+        return ' ON CONFLICT (title) DO UPDATE SET {0}, updated = {1}'.format(
+            ', '.join('{0} = excluded.{0}'.format(name)
+                      for name in REPLACED_COLUMNS), restored_at)
+    return ''
+
+
+def restore_entries(engine, stream, on_conflict='skip', keep_ids=False):
+    """Insert the entries dumped to stream; return (read, written) counts.
+
+    Rows skipped as conflicts are read but not written. Raise
+    sqlalchemy.exc.IntegrityError, having restored nothing, on a conflict
+    the options do not allow.
+    """
+    with engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            return copy_entries_in(connection, stream, on_conflict, keep_ids)
+        return insert_entries(connection, stream, on_conflict, keep_ids)
+
+
+def parse_datetime(value):
+    """Return the datetime for a dumped timestamp; raise ValueError if bad."""
+    match = DATETIME_PATTERN.match(value)
+    if match is None:
+        raise ValueError('Invalid timestamp: {0!r}'.format(value))
+    return datetime.datetime(*[int(part) for part in match.groups()])
+
+
+def entry_row(line, columns):
+    """Return the insert parameters for one NDJSON line."""
+    data = json.loads(line.decode('utf-8'))
+    row = {}
+    for name in columns:
+        value = data.get(name)
+        if name in DATETIME_COLUMNS and value is not None:
+            value = parse_datetime(value)
+        row[name] = value
+    return row
+
+
+def insert_entries(connection, stream, on_conflict, keep_ids):
+    """Insert entries with executemany, BATCH_SIZE rows at a time."""
+    columns = insert_columns(keep_ids)
+    table = Entry.__table__
+    statement = text(
+        'INSERT INTO entries ({0}) VALUES ({1})'.format(
+            ', '.join(columns), ', '.join(':' + name for name in columns)) +
+        conflict_clause(on_conflict, ':restored_at')
+    )
+    params = [bindparam(name, type_=table.c[name].type) for name in columns]
+    if on_conflict == 'replace':
+        params.append(bindparam('restored_at', type_=table.c.updated.type))
+    statement = statement.bindparams(*params)
+    restored_at = datetime.datetime.utcnow()
+    read = written = 0
+    batch = []
+
+    def flush(batch):
+        if not batch:
+            return 0
+        return connection.execute(statement, batch).rowcount
+
+    for line in stream:
+        if not line.strip():
+            continue
+        row = entry_row(line, columns)
+        if on_conflict == 'replace':
+            row['restored_at'] = restored_at
+        batch.append(row)
+        read += 1
+        if len(batch) == BATCH_SIZE:
+            written += flush(batch)
+            batch = []
+    written += flush(batch)
+    return read, written
+
+
+def copy_entries_in(connection, stream, on_conflict, keep_ids):
+    """COPY the dump into a staging table and insert from it in SQL."""
+    columns = insert_columns(keep_ids)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute('CREATE TEMPORARY TABLE entries_restore (doc json) '
+                       'ON COMMIT DROP')
+        cursor.copy_expert('COPY entries_restore (doc) FROM STDIN WITH ' +
+                           PG_COPY_OPTIONS, stream)
+        cursor.execute('SELECT count(*) FROM entries_restore '
+                       'WHERE doc IS NOT NULL')
+        read = cursor.fetchone()[0]
+        values = ', '.join(
+            "(doc->>'{0}')::{1}".format(name, PG_CASTS[name])
+            if name in PG_CASTS else "doc->>'{0}'".format(name)
+            for name in columns)
+        cursor.execute(
+            'INSERT INTO entries ({0}) SELECT {1} FROM entries_restore '
+            "WHERE doc IS NOT NULL ORDER BY (doc->>'id')::integer".format(
+                ', '.join(columns), values) +
+            conflict_clause(on_conflict, "(now() AT TIME ZONE 'utc')"))
+        written = cursor.rowcount
+        if keep_ids:
+            # Later inserts must not reuse the ids just restored.
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence('entries', 'id'), "
+                "coalesce(max(id), 0) + 1, false) FROM entries")
+        return read, written
+    finally:
+        cursor.close()
+
+
+def main(argv=sys.argv):
+    """Restore entries from a file or stdin."""
+    if len(argv) < 3:
+        usage(argv)
+    on_conflict, keep_ids = parse_options(argv[3:], argv)
+    settings = settings_from_argv(argv[:2])
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    try:
+        with open_stream(argv[2], 'rb') as stream:
+            read, written = restore_entries(engine, stream, on_conflict,
+                                            keep_ids)
+    except (exc.IntegrityError, engine.dialect.dbapi.IntegrityError) as error:
+        # COPY runs on the raw connection, so its errors are not wrapped.
+        print('Nothing restored: {0}'.format(getattr(error, 'orig', error)))
+        sys.exit(1)
+    print('{0} entries read, {1} restored.'.format(read, written))
+    if written:
+        print('Restart the app to drop pages cached before the restore.')
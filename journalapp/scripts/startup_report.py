@@ -0,0 +1,75 @@
+"""Report how long the app takes to start and which imports dominate."""
+from __future__ import print_function
+import subprocess
+import sys
+from collections import defaultdict
+
+from . import usage
+
+# Run in a fresh interpreter so nothing is already imported.
+BOOT = '''
+import sys
+import time
+started = time.perf_counter()
+from pyramid.paster import get_app
+from pyramid.scripts.common import parse_vars
+get_app(sys.argv[1], options=parse_vars(sys.argv[2:]))
+print('%.1f' % ((time.perf_counter() - started) * 1000))
+'''
+
+TOP = 15
+
+
+def parse_importtime(output):
+    """Return (module, self_us, cumulative_us) rows from -X importtime."""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        rows.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return rows
+
+
+def by_package(rows):
+    """Return (package, self_us) totals by top-level package, largest first."""
+    totals = defaultdict(int)
+    for module, self_us, _ in rows:
+        totals[module.split('.')[0]] += self_us
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def print_report(boot_ms, rows, top=TOP):
+    """Print the startup time and the slowest imports."""
+    total_ms = sum(self_us for _, self_us, _ in rows) / 1000.0
+    print('App created in {0} ms; {1:.1f} ms of it importing '
+          '{2} modules.'.format(boot_ms, total_ms, len(rows)))
+    print('\nSlowest packages (self time):')
+    for package, self_us in by_package(rows)[:top]:
+        print('  {0:>9.1f} ms  {1}'.format(self_us / 1000.0, package))
+    print('\nSlowest imports (cumulative):')
+    slowest = sorted(rows, key=lambda row: row[2], reverse=True)[:top]
+    for module, _, cumulative_us in slowest:
+        print('  {0:>9.1f} ms  {1}'.format(cumulative_us / 1000.0, module))
+
+
+def main(argv=sys.argv):
+    """Start the app in a child interpreter and report its import times."""
+    if len(argv) < 2:
+        usage(argv)
+    if sys.version_info < (3, 7):
+        print('startup_report needs Python 3.7 or later for -X importtime.')
+        sys.exit(1)
+    child = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', BOOT] + argv[1:],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    stdout, stderr = child.communicate()
+    if child.returncode:
+        errors = [line for line in stderr.splitlines()
+                  if not line.startswith('import time:')]
+        print('\n'.join(errors), file=sys.stderr)
+        sys.exit(child.returncode)
+    print_report(stdout.strip().splitlines()[-1], parse_importtime(stderr))
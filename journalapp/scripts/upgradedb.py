@@ -0,0 +1,19 @@
+"""Apply pending schema migrations and report what was applied."""
+from __future__ import print_function
+
+import sys
+
+from sqlalchemy import engine_from_config
+
+from . import settings_from_argv
+from ..migrations import MIGRATIONS, upgrade
+
+
+def main(argv=sys.argv):
+    """Upgrade the database schema to the latest version."""
+    settings = settings_from_argv(argv)
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    applied = upgrade(engine, report=print)
+    if applied:
+        print('{} migrations applied.'.format(len(applied)))
+    print('Schema is at version {}.'.format(MIGRATIONS[-1].version))
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Ranked full-text search over journal entries."""
+import re
+from collections import namedtuple
+
+from markupsafe import Markup, escape
+from sqlalchemy import DateTime, or_, text
+
+from .db import replica_reads
+from .models import (
+    DBSession,
+    Entry,
+    PG_SEARCH_VECTOR,
+    SEARCH_INDEX_DDL,
+)
+from .pagination import page_size_from_settings
+
+SearchResult = namedtuple('SearchResult',
+                          ['id', 'title', 'created', 'snippet'])
+
+# Snippets come back from the database wrapped in these control characters,
+# which cannot appear in entry text, and are swapped for <mark> tags only
+# after the rest of the snippet has been HTML-escaped.
+MARK_START = u'\x02'
+MARK_END = u'\x03'
+
+SQLITE_SEARCH = text(
+    "SELECT entries.id, entries.title, entries.created, "
+    "snippet(entries_fts, 1, char(2), char(3), '...', 24) AS snippet "
+    "FROM entries_fts JOIN entries ON entries.id = entries_fts.rowid "
+    "WHERE entries_fts MATCH :query "
+    "ORDER BY bm25(entries_fts, 10.0, 1.0) LIMIT :limit"
+).columns(created=DateTime)
+
+POSTGRESQL_SEARCH = text(
+    "SELECT id, title, created, "
+    "ts_headline('english', coalesce(text, ''), query, :headline) AS snippet "
+    "FROM entries, plainto_tsquery('english', :query) AS query "
+    "WHERE " + PG_SEARCH_VECTOR + " @@ query "
+    "ORDER BY ts_rank(" + PG_SEARCH_VECTOR + ", query) DESC LIMIT :limit"
+).columns(created=DateTime)
+
+PG_HEADLINE_OPTIONS = (u'StartSel={}, StopSel={}, MaxWords=35, MinWords=15'
+                       .format(MARK_START, MARK_END))
+
+
+def fts5_query(terms):
+    """Return an FTS5 MATCH expression requiring every word in terms.
+
+    Each word is quoted so user input can never be parsed as FTS5 query
+    syntax.
+    """
+    words = re.findall(r'\w+', terms, re.UNICODE)
+    return u' '.join(u'"{}"'.format(word) for word in words)
+
+
+def markup_snippet(snippet):
+    """Return an escaped snippet with matched words wrapped in <mark>."""
+    escaped = escape(snippet or u'')
+    return Markup(escaped.replace(MARK_START, Markup(u'<mark>'))
+                  .replace(MARK_END, Markup(u'</mark>')))
+
+
+def search_entries(session, terms, limit=20):
+    """Return SearchResults for entries matching terms, best match first."""
+    if not terms or not terms.strip():
+        return []
+    dialect = session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        query = fts5_query(terms)
+        if not query:
+            return []
+        rows = session.execute(SQLITE_SEARCH,
+                               {'query': query, 'limit': limit})
+    elif dialect == 'postgresql':
+        rows = session.execute(POSTGRESQL_SEARCH,
+                               {'query': terms, 'limit': limit,
+                                'headline': PG_HEADLINE_OPTIONS})
+    else:
+        return unindexed_search(session, terms, limit)
+    return [SearchResult(row.id, row.title, row.created,
+                         markup_snippet(row.snippet))
+            for row in rows]
+
+
+def unindexed_search(session, terms, limit):
+    """Return unranked LIKE matches for databases without a search index."""
+    pattern = u'%{}%'.format(terms.strip())
+    query = session.query(Entry.id, Entry.title, Entry.created).filter(
+        or_(Entry.title.like(pattern), Entry.text.like(pattern))
+    ).order_by(Entry.created.desc()).limit(limit)
+    return [SearchResult(row.id, row.title, row.created, Markup(u''))
+            for row in query]
+
+
+def create_search_index(connection):
+    """Create the search index for the connection's database if missing."""
+    for statement in SEARCH_INDEX_DDL.get(connection.dialect.name, []):
+        connection.execute(text(statement))
+
+
+def rebuild_search_index(connection):
+    """Rebuild the search index from the current contents of entries."""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        connection.execute(text(
+            "INSERT INTO entries_fts(entries_fts) VALUES ('rebuild')"))
+    elif dialect == 'postgresql':
+        connection.execute(text("REINDEX INDEX ix_entries_search"))
+
+
+def search_view(request):
+    """Return ranked entries matching the q parameter."""
+    terms = request.params.get('q', '')
+    limit = page_size_from_settings(request.registry.settings)
+    results = search_entries(DBSession, terms, limit=limit)
+    return {'q': terms, 'results': results}
+
+
+def includeme(config):
+    """Register this module's views."""
+    config.add_view(search_view,
+                    route_name='search',
+                    renderer='templates/search.jinja2',
+                    permission='view',
+                    decorator=replica_reads)
@@ -1,18 +1,154 @@
 """Set up security standards for the journal app."""
 # from .models import Entry
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from pyramid.exceptions import ConfigurationError
 from pyramid.security import Allow, Everyone, ALL_PERMISSIONS
-from cryptacular.bcrypt import BCRYPTPasswordManager
-from wtforms.ext.csrf.form import SecureForm
-from hashlib import md5
+from .db import server_threads
 
 
 SECRET_KEY = 'supersecret'
 
+_password_manager = None
+
+
+def password_manager():
+    """Return the bcrypt manager, importing cryptacular on first use."""
+    global _password_manager
+    if _password_manager is None:
+        from cryptacular.bcrypt import BCRYPTPasswordManager
+        _password_manager = BCRYPTPasswordManager()
+    return _password_manager
+
 
 def check_pw(hashed_pw, password):
     """Return True if provided hash matches against the provided password."""
-    manager = BCRYPTPasswordManager()
-    return manager.check(hashed_pw, password)
+    return password_manager().check(hashed_pw, password)
+
+
+class PasswordCheckBusy(Exception):
+    """Raised when a password check cannot get a slot or time to finish."""
+
+
+class PasswordChecker(object):
+    """Run bcrypt checks on a small dedicated pool with a bounded queue.
+
+    At most workers checks run at once and at most queue_size more wait;
+    beyond that check() fails fast with PasswordCheckBusy instead of
+    letting a burst of logins tie up every request thread. Each waiting
+    check holds a request thread, so given the server's thread count the
+    checks in flight are also kept below it.
+    """
+
+    def __init__(self, workers=2, queue_size=8, timeout=30, threads=None):
+        """Start the pool."""
+        self.timeout = timeout
+        self.rejected = 0
+        self.timed_out = 0
+        self.slots = workers + queue_size
+        if threads is not None:
+            self.slots = min(self.slots, threads - 1)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(self.slots)
+
+    def check(self, hashed_pw, password):
+        """Return check_pw(hashed_pw, password) as computed by the pool."""
+        if not self._slots.acquire(False):
+            self.rejected += 1
+            raise PasswordCheckBusy()
+        try:
+            future = self._executor.submit(check_pw, hashed_pw, password)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # A check still queued is dropped, which frees its slot; one
+            # already running keeps its slot until bcrypt returns.
+            future.cancel()
+            self.timed_out += 1
+            raise PasswordCheckBusy()
+
+
+class LoginThrottle(object):
+    """Allow at most max_attempts logins per key in a sliding window."""
+
+    def __init__(self, max_attempts=5, window=300, max_keys=10000):
+        """Initialize with no recorded attempts."""
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_keys = max_keys
+        self.throttled = 0
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """Record an attempt for key and return False if over the limit."""
+        now = time.time()
+        with self._lock:
+            if len(self._attempts) >= self.max_keys:
+                self._sweep(now)
+            attempts = self._attempts.setdefault(key, deque())
+            while attempts and attempts[0] <= now - self.window:
+                attempts.popleft()
+            if len(attempts) >= self.max_attempts:
+                self.throttled += 1
+                return False
+            attempts.append(now)
+            return True
+
+    def reset(self, key):
+        """Forget the attempts for key, e.g. after a successful login."""
+        with self._lock:
+            self._attempts.pop(key, None)
+
+    def _sweep(self, now):
+        """Drop keys with no attempts inside the window."""
+        cutoff = now - self.window
+        for key in [key for key, attempts in self._attempts.items()
+                    if not attempts or attempts[-1] <= cutoff]:
+            del self._attempts[key]
+
+
+def verify_password(request, hashed_pw, password):
+    """Check a password on the app's password pool, if it has one."""
+    checker = getattr(request.registry, 'password_checker', None)
+    if checker is None:
+        return check_pw(hashed_pw, password)
+    return checker.check(hashed_pw, password)
+
+
+def login_throttle_key(request, username):
+    """Return the throttling key for a login attempt."""
+    return (username.lower(), request.client_addr)
+
+
+def includeme(config):
+    """Attach the password pool and login throttle to the registry."""
+    settings = config.get_settings()
+    workers = int(settings.get('auth.check_workers', 2))
+    threads = server_threads(settings)
+    if workers < 1 or threads < 2:
+        raise ConfigurationError(
+            'auth.check_workers must be at least 1 and the server must run '
+            'at least 2 threads, so password checks cannot take them all '
+            '(auth.check_workers = {0}, threads = {1}).'.format(
+                workers, threads))
+    config.registry.password_checker = PasswordChecker(
+        workers=workers,
+        queue_size=int(settings.get('auth.check_queue', 8)),
+        timeout=float(settings.get('auth.check_timeout', 30)),
+        threads=threads,
+    )
+    config.registry.login_throttle = LoginThrottle(
+        max_attempts=int(settings.get('auth.throttle_attempts', 5)),
+        window=float(settings.get('auth.throttle_window', 300)),
+    )
 
 
 USERS = {'editor': 'editor',
@@ -43,18 +179,3 @@ class DefaultRoot(object):
     def __init__(self, request):
         """Initialize class."""
         self.request = request
-
-
-class TotesSecureForm(SecureForm):
-    """Secure form subclass with CSRF protection."""
-
-    def generate_csrf_token(self, csrf_context):
-        """Generate a CSRF Token."""
-        text = SECRET_KEY + csrf_context
-        token = md5(text.encode('utf-8')).hexdigest()
-        return token
-
-    def validate_csrf_token(self, field):
-        """Validate a given CSRF token."""
-        if field.data != field.current_token:
-            raise ValueError('Invalid CSRF')
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Log slow SQL statements with their parameters, route and query plan.
+
+Enabled by setting journal.slow_query_ms. Each statement slower than the
+threshold is written to the journalapp.slowquery logger as one JSON
+object per line; the .ini files send that logger to a rotating file.
+SELECTs also get their plan captured with EXPLAIN (EXPLAIN ANALYZE on
+PostgreSQL when journal.slow_query_analyze is on, which runs the query a
+second time).
+"""
+import datetime
+import json
+import logging
+
+from pyramid.settings import asbool
+from pyramid.threadlocal import get_current_request
+from sqlalchemy import event
+
+from .db import registry_engines
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # Python 2
+    from time import time as clock
+
+log = logging.getLogger('journalapp.slowquery')
+
+
+def explain_prefix(dialect_name, analyze):
+    """Return the EXPLAIN prefix for a dialect, or None if unsupported."""
+    if dialect_name == 'sqlite':
+        return 'EXPLAIN QUERY PLAN '
+    if dialect_name == 'postgresql':
+        if analyze:
+            return 'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) '
+        return 'EXPLAIN (FORMAT JSON) '
+    return None
+
+
+def is_explainable(statement):
+    """Return True for plain SELECTs, which are safe to EXPLAIN ANALYZE.
+
+    WITH is refused: its CTEs may INSERT, UPDATE or DELETE, and ANALYZE
+    would make those changes a second time.
+    """
+    first_word = statement.lstrip().split(None, 1)[0].upper()
+    return first_word == 'SELECT'
+
+
+def capture_plan(conn, statement, parameters, analyze):
+    """Return the plan for statement, run on the same DBAPI connection."""
+    dialect_name = conn.dialect.name
+    prefix = explain_prefix(dialect_name, analyze)
+    if prefix is None:
+        return None
+    cursor = conn.connection.cursor()
+    savepoint = dialect_name == 'postgresql'
+    try:
+        if savepoint:
+            # A failed EXPLAIN must not abort the caller's transaction.
+            cursor.execute('SAVEPOINT journal_explain')
+        try:
+            cursor.execute(prefix + statement, parameters)
+            rows = cursor.fetchall()
+        except Exception:
+            if savepoint:
+                cursor.execute('ROLLBACK TO SAVEPOINT journal_explain')
+            raise
+        if savepoint:
+            cursor.execute('RELEASE SAVEPOINT journal_explain')
+    finally:
+        cursor.close()
+    if dialect_name == 'postgresql':
+        plan = rows[0][0]
+        return json.loads(plan) if isinstance(plan, str) else plan
+    return [row[-1] for row in rows]
+
+
+def request_info():
+    """Return route, method and path of the request issuing a query."""
+    request = get_current_request()
+    if request is None:
+        return {}
+    route = getattr(request, 'matched_route', None)
+    return {
+        'route': route.name if route is not None else None,
+        'method': request.method,
+        'path': request.path,
+    }
+
+
+class SlowQueryLogger(object):
+    """Engine event handlers that log statements over a threshold."""
+
+    def __init__(self, threshold_ms, explain=True, analyze=False):
+        """Set the threshold in milliseconds and EXPLAIN options."""
+        self.threshold = threshold_ms / 1000.0
+        self.explain = explain
+        self.analyze = analyze
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        """Note when a statement started."""
+        conn.info.setdefault('journal_slow_start', []).append(clock())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters,
+                             context, executemany):
+        """Log the statement if it took longer than the threshold."""
+        elapsed = clock() - conn.info['journal_slow_start'].pop()
+        if elapsed < self.threshold:
+            return
+        record = {
+            'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+            'duration_ms': round(elapsed * 1000, 3),
+            'statement': statement,
+            'parameters': parameters,
+            'executemany': executemany,
+        }
+        record.update(request_info())
+        if self.explain and not executemany and is_explainable(statement):
+            try:
+                record['plan'] = capture_plan(conn, statement, parameters,
+                                              self.analyze)
+            except Exception as error:
+                record['plan_error'] = str(error)
+        log.warning(json.dumps(record, default=str, sort_keys=True))
+
+    def handle_error(self, context):
+        """Forget the start of a statement that raised."""
+        conn = context.connection
+        starts = (conn.info.get('journal_slow_start')
+                  if conn is not None else None)
+        if context.statement is not None and starts:
+            starts.pop()
+
+    def install(self, engine):
+        """Listen for statements on engine."""
+        event.listen(engine, 'before_cursor_execute',
+                     self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute',
+                     self.after_cursor_execute)
+        event.listen(engine, 'handle_error', self.handle_error)
+
+
+def includeme(config):
+    """Install the slow query logger if journal.slow_query_ms is set."""
+    settings = config.get_settings()
+    threshold = float(settings.get('journal.slow_query_ms', 0) or 0)
+    if threshold <= 0:
+        return
+    logger = SlowQueryLogger(
+        threshold,
+        explain=asbool(settings.get('journal.slow_query_explain', True)),
+        analyze=asbool(settings.get('journal.slow_query_analyze', False)),
+    )
+    for engine in registry_engines(config.registry):
+        logger.install(engine)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Share compiled Jinja2 templates between workers through a disk cache.
+
+Enabled by pyramid_jinja2's own settings, jinja2.bytecode_caching = true
+and jinja2.bytecode_caching_directory (created if missing; defaults to a
+per-user directory under the system temp dir). Jinja2 stores a hash of
+each template's source with its bytecode and recompiles when the source
+no longer matches, so an edited template is never served from stale
+bytecode. Run precompile_templates at deploy to fill the cache before
+the first request.
+"""
+import os
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache, meta
+from pyramid.settings import asbool
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+TEMPLATE_EXTENSION = '.jinja2'
+
+
+class AtomicBytecodeCache(FileSystemBytecodeCache):
+    """FileSystemBytecodeCache that never lets a worker read a partial file.
+
+    Newer Jinja2 versions write atomically themselves; older ones write in
+    place, which a concurrently starting worker could read half-written.
+    """
+
+    def dump_bytecode(self, bucket):
+        """Write bucket's bytecode to a temporary file, then rename it."""
+        name = self._get_cache_filename(bucket)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                bucket.write_bytecode(fh)
+            getattr(os, 'replace', os.rename)(tmp, name)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+def bytecode_cache_from_settings(settings):
+    """Return the bytecode cache the settings ask for, or None."""
+    if not asbool(settings.get('jinja2.bytecode_caching', False)):
+        return None
+    directory = settings.get('jinja2.bytecode_caching_directory') or None
+    if directory is not None and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:  # another worker created it first
+            if not os.path.isdir(directory):
+                raise
+    return AtomicBytecodeCache(directory)
+
+
+def template_names(template_dir=TEMPLATE_DIR):
+    """Return the app's Jinja2 template names, as its views render them."""
+    return sorted('journalapp:templates/' + name
+                  for name in os.listdir(template_dir)
+                  if name.endswith(TEMPLATE_EXTENSION))
+
+
+def precompile(environment, names):
+    """Compile each template and those it extends or includes.
+
+    A referenced template is cached under a name joined to the template
+    referencing it, so it is compiled once per parent, exactly as
+    rendering would. Return the number of templates compiled.
+    """
+    compiled = set()
+
+    def compile_template(name, parent=None):
+        template = environment.get_template(name, parent=parent)
+        if template.name in compiled:
+            return
+        compiled.add(template.name)
+        source = environment.loader.get_source(environment, template.name)[0]
+        for reference in meta.find_referenced_templates(
+                environment.parse(source)):
+            if reference is not None:
+                compile_template(reference, parent=template.name)
+
+    for name in names:
+        compile_template(name)
+    return len(compiled)
+
+
+def includeme(config):
+    """Give pyramid_jinja2 and the ASGI path one shared bytecode cache."""
+    settings = config.get_settings()
+    cache = bytecode_cache_from_settings(settings)
+    config.registry.bytecode_cache = cache
+    if cache is not None:
+        # pyramid_jinja2 reads this when its environment is created.
+        settings['jinja2.bytecode_caching'] = cache
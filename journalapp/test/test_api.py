@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Test the JSON API over entries."""
+import datetime
+import os
+import pytest
+from journalapp.models import Entry
+
+
+@pytest.fixture()
+def api(auth_env, sqlengine, config_uri, test_database_url):
+    """Return a TestApp over the test database, with three entries."""
+    from journalapp import main
+    from pyramid.paster import get_appsettings
+    from webtest import TestApp
+    settings = get_appsettings(config_uri)
+    settings['sqlalchemy.url'] = test_database_url
+    os.environ.setdefault('JOURNAL_AUTH_SECRET', 'secret')
+    start = datetime.datetime(2016, 1, 1)
+    sqlengine.execute(Entry.__table__.insert(), [
+        {'title': 'entry{0}'.format(number), 'text': '*{0}*'.format(number),
+         'created': start + datetime.timedelta(days=number),
+         'updated': start + datetime.timedelta(days=number)}
+        for number in range(3)
+    ])
+    yield TestApp(main({}, **settings))
+    sqlengine.execute(Entry.__table__.delete())
+
+
+def test_api_entries_pages(api):
+    """Test that following the next cursor walks every entry once."""
+    response = api.get('/api/entries', {'limit': 2})
+    assert response.content_type == 'application/json'
+    assert [entry['title'] for entry in response.json['entries']] == [
+        'entry2', 'entry1']
+    assert set(response.json['entries'][0]) == set(
+        ['id', 'title', 'created', 'updated'])
+    response = api.get('/api/entries', {'limit': 2,
+                                        'after': response.json['next']})
+    assert [entry['title'] for entry in response.json['entries']] == [
+        'entry0']
+    assert response.json['next'] is None
+
+
+def test_api_entries_fields(api):
+    """Test that fields selects the keys, html rendered from the text."""
+    response = api.get('/api/entries', {'fields': 'title,html'})
+    entry = response.json['entries'][0]
+    assert entry == {'title': 'entry2', 'html': '<p><em>2</em></p>'}
+
+
+def test_api_entries_bad_request(api):
+    """Test that unknown fields, limits and cursors are rejected."""
+    api.get('/api/entries', {'fields': 'title,secret'}, status=400)
+    api.get('/api/entries', {'limit': 'all'}, status=400)
+    api.get('/api/entries', {'after': 'nonsense'}, status=400)
+
+
+def test_api_entries_not_modified(api):
+    """Test that a matching If-None-Match gets a 304."""
+    etag = api.get('/api/entries').headers['ETag']
+    api.get('/api/entries', headers={'If-None-Match': etag}, status=304)
+    api.get('/api/entries', {'fields': 'id'},
+            headers={'If-None-Match': etag}, status=200)
+
+
+def test_api_entry(api):
+    """Test that one entry is returned, then a 304 for its ETag."""
+    entry_id = api.get('/api/entries').json['entries'][0]['id']
+    response = api.get('/api/entries/{0}'.format(entry_id),
+                       {'fields': 'id,text'})
+    assert response.json == {'id': entry_id, 'text': '*2*'}
+    api.get('/api/entries/{0}'.format(entry_id), {'fields': 'id,text'},
+            headers={'If-None-Match': response.headers['ETag']}, status=304)
+
+
+def test_api_entry_missing(api):
+    """Test that a missing entry is a 404."""
+    api.get('/api/entries/999999', status=404)
+    api.get('/api/entries/abc', status=404)
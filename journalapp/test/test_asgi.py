@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Test the ASGI entry point's async read path and WSGI fallback."""
+import asyncio
+import os
+import pytest
+from sqlalchemy import select
+from sqlalchemy.engine.url import make_url
+from journalapp.aiodb import (
+    ExecutorDatabase,
+    asyncpg_dsn,
+    compile_statement,
+)
+from journalapp.asgi import ASGIApp, scope_environ
+from journalapp.models import Entry, RENDERER_VERSION
+
+
+def run(asgi, method='GET', path='/', query_string=b'', headers=()):
+    """Return (status, headers dict, body) for one request to asgi."""
+    scope = {'type': 'http', 'method': method, 'path': path,
+             'query_string': query_string,
+             'headers': [(b'host', b'localhost')] + list(headers)}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(asgi(scope, receive, send))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    start, body = messages
+    headers = dict((name.decode('latin-1').lower(), value.decode('latin-1'))
+                   for name, value in start['headers'])
+    return start['status'], headers, body['body']
+
+
+@pytest.fixture()
+def asgi(auth_env, sqlengine, config_uri, test_database_url):
+    """Return the ASGI app over the test database, with two entries."""
+    from journalapp import main
+    from pyramid.paster import get_appsettings
+    settings = get_appsettings(config_uri)
+    settings['sqlalchemy.url'] = test_database_url
+    settings['journal.asgi.driver'] = 'executor'
+    os.environ.setdefault('JOURNAL_AUTH_SECRET', 'secret')
+    sqlengine.execute(Entry.__table__.insert(), [
+        {'title': 'first', 'text': 'one', 'html': '<p>one</p>',
+         'html_version': RENDERER_VERSION},
+        {'title': 'second', 'text': 'two', 'html': '<p>two</p>',
+         'html_version': RENDERER_VERSION},
+    ])
+    asgi = ASGIApp(main({}, **settings))
+    assert isinstance(asgi.database, ExecutorDatabase)
+    yield asgi
+    asgi.executor.shutdown()
+    sqlengine.execute(Entry.__table__.delete())
+
+
+def test_scope_environ():
+    """Test that an ASGI scope becomes the equivalent WSGI environ."""
+    environ = scope_environ({
+        'type': 'http', 'method': 'GET', 'path': '/detail/1',
+        'query_string': b'a=1', 'server': ('example.com', 8080),
+        'headers': [(b'content-type', b'text/plain'), (b'x-a', b'1'),
+                    (b'x-a', b'2')],
+    }, b'body')
+    assert environ['PATH_INFO'] == '/detail/1'
+    assert environ['QUERY_STRING'] == 'a=1'
+    assert environ['SERVER_PORT'] == '8080'
+    assert environ['CONTENT_TYPE'] == 'text/plain'
+    assert environ['HTTP_X_A'] == '1,2'
+    assert environ['wsgi.input'].read() == b'body'
+
+
+def test_compile_statement_positional(sqlengine):
+    """Test that selects compile to SQL with positional parameters."""
+    sql, params = compile_statement(
+        select([Entry.id]).where(Entry.id == 3), sqlengine.dialect)
+    assert '?' in sql
+    assert params == [3]
+
+
+def test_asyncpg_dsn_keeps_query():
+    """Test that URL options such as sslmode reach asyncpg."""
+    url = make_url('postgresql+psycopg2://me:p%40ss@db:5433/journal'
+                   '?sslmode=require&host=/var/run/postgresql')
+    assert asyncpg_dsn(url) == (
+        'postgresql://me:p%40ss@db:5433/journal'
+        '?host=%2Fvar%2Frun%2Fpostgresql&sslmode=require')
+
+
+def test_asgi_list(asgi):
+    """Test that the list page renders on the async path."""
+    status, headers, body = run(asgi)
+    assert status == 200
+    assert b'first' in body and b'second' in body
+
+
+def test_asgi_detail(asgi):
+    """Test that the detail page shows the stored HTML."""
+    entry_id = asgi.registry.engine.execute(
+        select([Entry.id]).where(Entry.title == 'first')).scalar()
+    status, headers, body = run(asgi, path='/detail/{0}'.format(entry_id))
+    assert status == 200
+    assert b'<p>one</p>' in body
+
+
+def test_asgi_feed_not_modified(asgi):
+    """Test that the feed answers a matching If-None-Match with a 304."""
+    status, headers, body = run(asgi, path='/feed.atom')
+    assert status == 200
+    assert headers['content-type'].startswith('application/atom+xml')
+    status, _, body = run(asgi, path='/feed.atom', headers=[
+        (b'if-none-match', headers['etag'].encode('latin-1'))])
+    assert status == 304
+    assert body == b''
+
+
+def test_asgi_falls_back_to_wsgi(asgi):
+    """Test that routes without an async handler are served by WSGI."""
+    status, headers, body = run(asgi, path='/login')
+    assert status == 200
+    assert b'password' in body
+
+
+def test_asgi_missing_entry_falls_back(asgi):
+    """Test that a missing entry gets the WSGI view's 404."""
+    status, headers, body = run(asgi, path='/detail/999999')
+    assert status == 404
+
+
+def test_asgi_reads_replica(asgi):
+    """Test that reads use the replica unless the client just wrote."""
+    asgi.replica = replica = object()
+    request = asgi.make_request(scope_environ(
+        {'method': 'GET', 'path': '/', 'headers': []}, b''))
+    assert asgi.reader(request) is replica
+    assert request.reads_replica
+    sticky = asgi.make_request(scope_environ(
+        {'method': 'GET', 'path': '/',
+         'headers': [(b'cookie', b'journal_primary=1')]}, b''))
+    assert asgi.reader(sticky) is asgi.database
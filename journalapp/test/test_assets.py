@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Test building and negotiating fingerprinted static assets."""
+import gzip
+import io
+import pytest
+from pyramid.testing import DummyRequest
+from journalapp.assets import accepted_encodings, build_assets
+
+CSS = b'body { background: url(bg.png); }\n' * 40
+
+
+@pytest.fixture()
+def static_dir(tmpdir):
+    """Return a static directory holding one stylesheet and one image."""
+    tmpdir.join('site.css').write_binary(CSS)
+    tmpdir.join('bg.png').write_binary(b'\x89PNG fake')
+    return tmpdir
+
+
+def test_build_fingerprints(static_dir):
+    """Test that every asset gets a content-hashed dist name."""
+    manifest = build_assets(str(static_dir))
+    assert sorted(manifest) == ['bg.png', 'site.css']
+    assert manifest['site.css'].startswith('dist/site.')
+    assert static_dir.join(manifest['bg.png']).check()
+    assert static_dir.join('dist', 'manifest.json').check()
+
+
+def test_build_rewrites_css_urls(static_dir):
+    """Test that stylesheets reference the fingerprinted images."""
+    manifest = build_assets(str(static_dir))
+    css = static_dir.join(manifest['site.css']).read_binary()
+    assert manifest['bg.png'][len('dist/'):].encode() in css
+
+
+def test_build_precompresses_text(static_dir):
+    """Test that text assets get a gzip sibling with the same content."""
+    manifest = build_assets(str(static_dir))
+    css_path = static_dir.join(manifest['site.css'])
+    gz = static_dir.join(manifest['site.css'] + '.gz').read_binary()
+    with gzip.GzipFile(fileobj=io.BytesIO(gz)) as fh:
+        assert fh.read() == css_path.read_binary()
+    assert not static_dir.join(manifest['bg.png'] + '.gz').check()
+
+
+def test_build_is_stable(static_dir):
+    """Test that unchanged assets keep their names between builds."""
+    assert build_assets(str(static_dir)) == build_assets(str(static_dir))
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, []),
+    ('gzip, deflate', ['gzip']),
+    ('br;q=0.9, gzip', ['br', 'gzip']),
+    ('gzip;q=0, *', ['br']),
+    ('identity', []),
+])
+def test_accepted_encodings(header, expected):
+    """Test Accept-Encoding parsing, including q=0 and wildcards."""
+    headers = {'Accept-Encoding': header} if header is not None else {}
+    assert accepted_encodings(DummyRequest(headers=headers)) == expected
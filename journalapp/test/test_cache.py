@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""Test the rendered page cache."""
+import multiprocessing
+import pytest
+from pyramid import testing
+from pyramid.response import Response
+from journalapp.cache import LRUCache, cached_page, invalidate_pages
+
+
+@pytest.fixture()
+def page_cache():
+    """Return a small cache attached to a testing registry."""
+    config = testing.setUp()
+    config.registry.page_cache = LRUCache(2)
+    yield config.registry.page_cache
+    testing.tearDown()
+
+
+class FakeRoute(object):
+    """Stand-in for a matched route."""
+
+    def __init__(self, name):
+        """Set route name."""
+        self.name = name
+
+
+def page_request(route_name, **matchdict):
+    """Return a DummyRequest that looks like it matched route_name."""
+    request = testing.DummyRequest()
+    request.matched_route = FakeRoute(route_name)
+    request.matchdict = matchdict
+    request.query_string = ''
+    return request
+
+
+def test_lru_evicts_oldest():
+    """Test that the least recently used key is evicted when full."""
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None and cache.get('a') == 1
+    assert cache.stats()['evictions'] == 1
+
+
+def test_lru_counts_hits_and_misses():
+    """Test the hit and miss counters."""
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.get('a')
+    cache.get('missing')
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1
+
+
+def test_shared_generation_clears_other_caches():
+    """Test that an invalidation in one cache empties caches sharing it."""
+    generation = multiprocessing.Value('L', 0)
+    mine, theirs = LRUCache(4, generation), LRUCache(4, generation)
+    mine.set('a', 1)
+    theirs.set('a', 1)
+    theirs.discard_if(lambda key: key == 'b')
+    assert mine.get('a') is None
+    assert theirs.get('a') == 1
+
+
+def test_shared_generation_skips_stale_set():
+    """Test that a value rendered before an invalidation is not stored."""
+    generation = multiprocessing.Value('L', 0)
+    mine, theirs = LRUCache(4, generation), LRUCache(4, generation)
+    started = mine.generation()
+    theirs.clear()
+    mine.set('a', 1, started)
+    assert mine.get('a') is None
+
+
+def test_cached_page_hit(page_cache):
+    """Test that a second GET is served without calling the view."""
+    calls = []
+
+    def view(context, request):
+        calls.append(request)
+        return Response('page')
+
+    wrapped = cached_page(view)
+    first = wrapped(None, page_request('list'))
+    second = wrapped(None, page_request('list'))
+    assert first.body == second.body == b'page'
+    assert len(calls) == 1
+
+
+def test_cached_page_keyed_by_host(page_cache):
+    """Test that a page cached for one Host is not served for another."""
+    wrapped = cached_page(
+        lambda context, request: Response(request.application_url))
+    evil = page_request('list')
+    evil.application_url = 'http://evil.example'
+    wrapped(None, evil)
+    assert wrapped(None, page_request('list')).text == 'http://example.com'
+
+
+def test_cached_page_skips_post(page_cache):
+    """Test that POSTs bypass the cache."""
+    request = page_request('list')
+    request.method = 'POST'
+    cached_page(lambda context, request: Response('page'))(None, request)
+    assert len(page_cache) == 0
+
+
+def test_invalidate_entry(page_cache):
+    """Test that a write evicts list pages and the entry's detail page."""
+    page_cache.set(('list', (), '', None, False, False), 'list')
+    page_cache.set(('detail', (('entry_id', '1'),), '', None, False, False),
+                   'one')
+    invalidate_pages(testing.DummyRequest(), 1)
+    assert len(page_cache) == 0
+
+
+def test_invalidate_keeps_other_entries(page_cache):
+    """Test that a write leaves other entries' detail pages cached."""
+    page_cache.set(('detail', (('entry_id', '2'),), '', None, False, False),
+                   'two')
+    invalidate_pages(testing.DummyRequest(), 1)
+    assert len(page_cache) == 1
+
+
+def test_invalidate_non_canonical_id(page_cache):
+    """Test that a detail page cached under a padded id is evicted."""
+    for entry_id in ('01', '1 '):
+        request = page_request('detail', entry_id=entry_id)
+        cached_page(lambda context, request: Response('one'))(None, request)
+        assert len(page_cache) == 1
+        invalidate_pages(testing.DummyRequest(), 1)
+        assert len(page_cache) == 0
+
+
+def test_cached_page_skips_lagging_replica_read(page_cache):
+    """Test that a replica read just after a write is not cached."""
+    view = cached_page(lambda context, request: Response('page'))
+    page_cache.clear()
+    request = page_request('list')
+    request.reads_replica = True
+    view(None, request)
+    assert len(page_cache) == 0
+
+    page_cache.invalidated_at -= 60
+    view(None, request)
+    assert len(page_cache) == 1
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Test the response compression tween."""
+import gzip
+import zlib
+import pytest
+from pyramid.registry import Registry
+from pyramid.response import Response
+from pyramid.testing import DummyRequest
+from journalapp.compression import compression_tween_factory
+from journalapp.metrics import Metrics
+
+HTML = u'<p>' + u'journal entry ' * 200 + u'</p>'
+
+
+@pytest.fixture()
+def registry():
+    """Return a registry with a 100 byte threshold and metrics."""
+    registry = Registry()
+    registry.settings = {'journal.compression.min_size': '100'}
+    registry.metrics = Metrics()
+    return registry
+
+
+def respond(registry, response, **headers):
+    """Run response through the tween for a request with headers."""
+    tween = compression_tween_factory(lambda request: response, registry)
+    return tween(DummyRequest(headers=headers))
+
+
+def test_gzip(registry):
+    """Test that HTML is gzipped for clients accepting gzip."""
+    response = respond(registry, Response(HTML),
+                       **{'Accept-Encoding': 'gzip, deflate'})
+    assert response.content_encoding == 'gzip'
+    assert gzip.decompress(response.body) == HTML.encode('utf-8')
+    assert 'Accept-Encoding' in response.vary
+    saved = registry.metrics.bytes_saved['__not_found__']
+    assert saved == len(HTML) - len(response.body)
+
+
+def test_deflate(registry):
+    """Test that deflate is used when it is all the client accepts."""
+    response = respond(registry, Response(HTML),
+                       **{'Accept-Encoding': 'deflate'})
+    assert response.content_encoding == 'deflate'
+    assert zlib.decompress(response.body) == HTML.encode('utf-8')
+
+
+def test_not_accepted(registry):
+    """Test that the body is untouched without Accept-Encoding."""
+    response = respond(registry, Response(HTML))
+    assert response.content_encoding is None
+    assert response.vary == ('Accept-Encoding',)
+
+
+def test_tiny_body(registry):
+    """Test that bodies under the threshold are sent as they are."""
+    response = respond(registry, Response(u'<p>hi</p>'),
+                       **{'Accept-Encoding': 'gzip'})
+    assert response.content_encoding is None
+
+
+def test_already_encoded(registry):
+    """Test that precompressed responses are left alone."""
+    original = Response(HTML, content_encoding='br')
+    response = respond(registry, original, **{'Accept-Encoding': 'gzip'})
+    assert response.content_encoding == 'br'
+    assert response.body == HTML.encode('utf-8')
+
+
+def test_binary_type(registry):
+    """Test that images are not compressed."""
+    response = respond(registry, Response(b'\x89PNG' * 100,
+                                          content_type='image/png'),
+                       **{'Accept-Encoding': 'gzip'})
+    assert response.content_encoding is None
+    assert not response.vary
+
+
+def test_streamed_body(registry):
+    """Test that an app_iter is compressed as it is consumed."""
+    chunks = [HTML.encode('utf-8')] * 5
+    response = Response(app_iter=iter(chunks))
+    response = respond(registry, response, **{'Accept-Encoding': 'gzip'})
+    assert response.content_length is None
+    body = b''.join(response.app_iter)
+    assert gzip.decompress(body) == b''.join(chunks)
+    assert registry.metrics.compressed['__not_found__'] == 1
+
+
+def test_weakens_etag(registry):
+    """Test that a strong ETag becomes weak once the body is compressed."""
+    original = Response(HTML)
+    original.etag = 'abc'
+    response = respond(registry, original, **{'Accept-Encoding': 'gzip'})
+    assert response.headers['ETag'] == 'W/"abc"'
@@ -81,7 +81,8 @@ def test_one_entry_model(response_list, dbtransaction):
         entries_from_list, add_entries_to_db)
     new_entries = entries_from_list(response_list[:1])
     result = add_entries_to_db(new_entries, DBSession)
-    new_entry = new_entries[0]
+    new_entry = DBSession.query(Entry).filter_by(
+        title=new_entries[0].title).one()
     assert all([result == 1,
                 new_entry.id is not None,
                 new_entry.title is not None,
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Test the crisewing import against a local stand-in for the export API."""
+import json
+import threading
+import pytest
+from journalapp.models import DBSession, Entry
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+AUTHOR = {'username': 'WillWeatherford', 'display_name': 'Will Weatherford'}
+
+
+def export_entry(number, author=AUTHOR):
+    """Return an entry dict shaped like the export API's."""
+    return {
+        'id': number,
+        'title': u'Entry {} ☃'.format(number),
+        'text': u'Text of entry {}.'.format(number),
+        'created': '2016-03-01T12:00:{:02d}.000000'.format(number % 60),
+        'author': author,
+    }
+
+
+EXPORT = [export_entry(n) for n in range(1, 8)] + [
+    export_entry(99, author={'username': 'someone', 'display_name': 'Else'}),
+]
+
+
+@pytest.fixture(scope='module')
+def export_url():
+    """Serve EXPORT as JSON from a local HTTP server."""
+    body = json.dumps(EXPORT).encode('utf-8')
+
+    class ExportHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), ExportHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{}/api/export'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def test_iter_json_array_chunked():
+    """Test that elements split across tiny chunks are decoded."""
+    from journalapp.scripts.get_crisewing_api import iter_json_array
+    text = json.dumps(EXPORT, ensure_ascii=False).encode('utf-8')
+    chunks = [text[i:i + 3] for i in range(0, len(text), 3)]
+    assert list(iter_json_array(chunks)) == EXPORT
+
+
+def test_iter_json_array_empty():
+    """Test that an empty array yields nothing."""
+    from journalapp.scripts.get_crisewing_api import iter_json_array
+    assert list(iter_json_array([b' [ ] '])) == []
+
+
+def test_iter_json_array_truncated():
+    """Test that a truncated array raises ValueError."""
+    from journalapp.scripts.get_crisewing_api import iter_json_array
+    with pytest.raises(ValueError):
+        list(iter_json_array([b'[{"a": 1}, {"b"']))
+
+
+def test_import_from_stand_in(export_url, dbtransaction):
+    """Test streaming the export and bulk inserting my entries."""
+    from journalapp.scripts.get_crisewing_api import (
+        get_api_response, iter_json_array, iter_entries, add_entries_to_db)
+    response = get_api_response('key', url=export_url)
+    entries = iter_entries(iter_json_array(response.iter_content(16)))
+    progress = []
+    count = add_entries_to_db(entries, DBSession, batch_size=3,
+                              progress=lambda *args: progress.append(args))
+    assert count == 7
+    assert DBSession.query(Entry).count() == 7
+    assert [seen for seen, added, elapsed in progress] == [3, 6, 7]
+
+
+def test_import_skips_existing(export_url, dbtransaction):
+    """Test that a second import adds nothing."""
+    from journalapp.scripts.get_crisewing_api import (
+        entries_from_list, add_entries_to_db)
+    assert add_entries_to_db(entries_from_list(EXPORT), DBSession) == 7
+    assert add_entries_to_db(entries_from_list(EXPORT), DBSession) == 0
+
+
+def test_import_skips_duplicates_in_batch(dbtransaction):
+    """Test that a title repeated within one batch is inserted once."""
+    from journalapp.scripts.get_crisewing_api import (
+        entries_from_list, add_entries_to_db)
+    entries = entries_from_list([export_entry(1), export_entry(1)])
+    assert add_entries_to_db(entries, DBSession) == 1
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Test engine pool sizing, warmup, pool statistics and replica routing."""
+import pytest
+from sqlalchemy import create_engine, exc
+from pyramid import testing
+from pyramid.events import NewResponse
+from pyramid.registry import Registry
+from pyramid.response import Response
+from journalapp.db import (
+    STICKY_COOKIE,
+    TimedQueuePool,
+    engine_settings,
+    make_replica_engine,
+    pool_status,
+    ready_view,
+    stick_to_primary,
+    use_replica,
+    warm_pool,
+)
+from journalapp.models import Base, DBSession, Entry, RoutingSession
+
+PG_URL = 'postgresql://journal@localhost/journal'
+
+
+def test_engine_settings_sized_from_threads():
+    """Test that the pool holds one connection per server thread."""
+    settings = engine_settings({'sqlalchemy.url': PG_URL,
+                                'journal.threads': '8'})
+    assert settings['sqlalchemy.pool_size'] == '8'
+    assert settings['sqlalchemy.max_overflow'] == '4'
+    assert 'sqlalchemy.pool_recycle' in settings
+
+
+def test_engine_settings_explicit_wins():
+    """Test that explicit pool settings are left alone."""
+    settings = engine_settings({'sqlalchemy.url': PG_URL,
+                                'sqlalchemy.pool_size': '2'})
+    assert settings['sqlalchemy.pool_size'] == '2'
+
+
+def test_engine_settings_sqlite_untouched():
+    """Test that SQLite keeps SQLAlchemy's default pool."""
+    settings = engine_settings({'sqlalchemy.url': 'sqlite://'})
+    assert 'sqlalchemy.pool_size' not in settings
+
+
+@pytest.fixture()
+def timed_engine(tmpdir):
+    """Return a file SQLite engine on a one-connection timed pool."""
+    url = 'sqlite:///' + str(tmpdir.join('pool.sqlite'))
+    engine = create_engine(url, poolclass=TimedQueuePool, pool_size=1,
+                           max_overflow=0, pool_timeout=0.05)
+    yield engine
+    engine.dispose()
+
+
+def test_warm_pool_fills_pool(timed_engine):
+    """Test that warmup leaves an open connection checked in."""
+    assert warm_pool(timed_engine, 1) == 1
+    status = pool_status(timed_engine)
+    assert status['checked_in'] == 1
+    assert status['checked_out'] == 0
+
+
+def test_pool_status_counts_timeouts(timed_engine):
+    """Test that an exhausted pool records its wait and timeout."""
+    held = timed_engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        timed_engine.connect()
+    held.close()
+    status = pool_status(timed_engine)
+    assert status['timeouts'] == 1
+    assert status['waits'] >= 1
+    assert status['max_wait_seconds'] >= 0.05
+
+
+def test_ready_view(timed_engine, dummy_get_request):
+    """Test that the readiness check reports the pool when the DB answers."""
+    registry = Registry()
+    registry.engine = timed_engine
+    registry.settings = {}
+    dummy_get_request.registry = registry
+    result = ready_view(dummy_get_request)
+    assert result['status'] == 'ok'
+    assert result['pool']['class'] == 'TimedQueuePool'
+
+
+@pytest.fixture()
+def replica_engines(tmpdir):
+    """Return (primary, replica) SQLite engines holding different entries."""
+    engines = []
+    for name in ('primary', 'replica'):
+        engine = create_engine('sqlite:///' + str(tmpdir.join(name)))
+        Base.metadata.create_all(engine)
+        engine.execute(Entry.__table__.insert(), {'title': name})
+        engines.append(engine)
+    yield engines
+    for engine in engines:
+        engine.dispose()
+
+
+def test_make_replica_engine():
+    """Test that the replica engine exists only when configured."""
+    assert make_replica_engine({'sqlalchemy.url': 'sqlite://'}) is None
+    engine = make_replica_engine({'sqlalchemy.url': 'sqlite://',
+                                  'sqlalchemy_replica.url': 'sqlite://'})
+    assert engine.dialect.name == 'sqlite'
+
+
+def test_routing_session_reads_replica(replica_engines):
+    """Test that marked reads use the replica and writes the primary."""
+    primary, replica = replica_engines
+    session = RoutingSession(bind=primary, replica=replica)
+    assert session.query(Entry.title).scalar() == 'primary'
+    session.info['replica'] = True
+    assert session.query(Entry.title).scalar() == 'replica'
+    session.add(Entry(title='written'))
+    session.flush()
+    assert session.info['wrote']
+    session.commit()
+    assert primary.execute('select count(*) from entries').scalar() == 2
+    assert replica.execute('select count(*) from entries').scalar() == 1
+
+
+def test_use_replica(replica_engines, dummy_get_request):
+    """Test that reads use the replica unless the client just wrote."""
+    registry = Registry()
+    registry.replica_engine = replica_engines[1]
+    dummy_get_request.registry = registry
+    try:
+        assert use_replica(dummy_get_request)
+        assert DBSession().info['replica']
+        dummy_get_request._process_finished_callbacks()
+        assert 'replica' not in DBSession().info
+
+        dummy_get_request.cookies[STICKY_COOKIE] = '1'
+        assert not use_replica(dummy_get_request)
+    finally:
+        DBSession.remove()
+
+
+def test_use_replica_without_replica(dummy_get_request):
+    """Test that nothing changes when no replica is configured."""
+    dummy_get_request.registry = Registry()
+    assert not use_replica(dummy_get_request)
+
+
+def test_stick_to_primary_after_write(dummy_get_request):
+    """Test that a request that wrote gets the sticky cookie."""
+    dummy_get_request.registry = testing.setUp(settings={}).registry
+    response = Response()
+    try:
+        stick_to_primary(NewResponse(dummy_get_request, response))
+        assert STICKY_COOKIE not in response.headers.get('Set-Cookie', '')
+        DBSession().info['wrote'] = True
+        dummy_get_request.method = 'POST'
+        stick_to_primary(NewResponse(dummy_get_request, response))
+        assert STICKY_COOKIE in response.headers['Set-Cookie']
+        assert 'wrote' not in DBSession().info
+    finally:
+        DBSession.remove()
+        testing.tearDown()
+
+
+def test_get_that_flushed_not_sticky(dummy_get_request):
+    """Test that a GET storing re-rendered HTML is not pinned to primary."""
+    dummy_get_request.registry = testing.setUp(settings={}).registry
+    response = Response()
+    try:
+        DBSession().info['wrote'] = True
+        stick_to_primary(NewResponse(dummy_get_request, response))
+        assert 'Set-Cookie' not in response.headers
+        assert 'wrote' not in DBSession().info
+    finally:
+        DBSession.remove()
+        testing.tearDown()
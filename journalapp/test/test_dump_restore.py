@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Test the NDJSON dump and restore scripts."""
+import datetime
+import io
+import json
+import pytest
+from sqlalchemy import exc, select
+from journalapp.models import Entry
+from journalapp.scripts.dump_entries import dump_entries, open_stream
+from journalapp.scripts.restore_entries import restore_entries
+
+CREATED = datetime.datetime(2016, 3, 1, 12, 0, 0, 250)
+
+
+@pytest.fixture()
+def entries(sqlengine):
+    """Insert two entries, and empty the table afterwards."""
+    sqlengine.execute(Entry.__table__.insert(), [
+        {'id': 7, 'title': u'first ☃', 'text': u'line\nline', 'html': None,
+         'created': CREATED, 'updated': CREATED},
+        {'id': 9, 'title': u'second', 'text': u'two', 'html': u'<p>two</p>',
+         'html_version': 1, 'created': CREATED, 'updated': CREATED},
+    ])
+    yield sqlengine
+    sqlengine.execute(Entry.__table__.delete())
+
+
+def dump(engine):
+    """Return the dump of every entry, as bytes."""
+    stream = io.BytesIO()
+    dump_entries(engine, stream)
+    return stream.getvalue()
+
+
+def rows(engine):
+    """Return (id, title, text, created) for every entry, by title."""
+    table = Entry.__table__
+    return engine.execute(select([table.c.id, table.c.title, table.c.text,
+                                  table.c.created])
+                          .order_by(table.c.title)).fetchall()
+
+
+def test_dump_entries(entries):
+    """Test that each entry is one JSON line, in id order."""
+    lines = dump(entries).splitlines()
+    assert len(lines) == 2
+    first = json.loads(lines[0].decode('utf-8'))
+    assert first['id'] == 7
+    assert first['text'] == u'line\nline'
+    assert first['created'] == '2016-03-01T12:00:00.000250'
+
+
+def test_restore_round_trip(entries, tmpdir):
+    """Test that a gzipped dump restores into an empty table intact."""
+    path = str(tmpdir.join('entries.ndjson.gz'))
+    before = rows(entries)
+    with open_stream(path, 'wb') as stream:
+        dump_entries(entries, stream)
+    entries.execute(Entry.__table__.delete())
+    with open_stream(path, 'rb') as stream:
+        assert restore_entries(entries, stream, keep_ids=True) == (2, 2)
+    assert rows(entries) == before
+
+
+def test_restore_skip(entries):
+    """Test that entries with titles already present are skipped."""
+    data = dump(entries)
+    entries.execute(Entry.__table__.delete().where(Entry.id == 9))
+    assert restore_entries(entries, io.BytesIO(data)) == (2, 1)
+    assert [row.title for row in rows(entries)] == [u'first ☃', u'second']
+
+
+def test_restore_replace(entries):
+    """Test that replace overwrites the text of a matching title."""
+    data = dump(entries).replace(b'"two"', b'"new"')
+    assert restore_entries(entries, io.BytesIO(data), 'replace') == (2, 2)
+    table = Entry.__table__
+    row = entries.execute(select([table.c.id, table.c.text,
+                                  table.c.updated])
+                          .where(table.c.title == u'second')).first()
+    assert (row.id, row.text) == (9, u'new')
+    assert row.updated > CREATED
+
+
+def test_restore_error_restores_nothing(entries):
+    """Test that a conflict in error mode rolls the whole restore back."""
+    data = dump(entries)
+    entries.execute(Entry.__table__.delete().where(Entry.id == 9))
+    with pytest.raises(exc.IntegrityError):
+        restore_entries(entries, io.BytesIO(data), 'error')
+    assert len(rows(entries)) == 1
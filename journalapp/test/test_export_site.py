@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Test the incremental static-site export."""
+import os
+import pytest
+from pyramid.request import Request
+from pyramid.scripting import prepare
+from journalapp import make_config
+from journalapp.models import DBSession, Entry
+from journalapp.scripts.export_site import MANIFEST, export_site
+
+
+@pytest.fixture()
+def export_request():
+    """Return an anonymous request for exporting under example.com."""
+    config = make_config({'journal.page_size': '2'}, 'secret')
+    config.commit()
+    env = prepare(request=Request.blank('/', base_url='http://example.com'),
+                  registry=config.registry)
+    yield env['request']
+    env['closer']()
+
+
+def read(output_dir, path):
+    """Return the text of an exported file."""
+    with open(os.path.join(output_dir, *path.split('/'))) as fh:
+        return fh.read()
+
+
+def test_export_site(dbtransaction, new_entry, export_request, tmpdir):
+    """Test that the index, entry, feed and static files are written."""
+    output_dir = str(tmpdir)
+    written, removed = export_site(export_request, output_dir)
+    assert written and not removed
+    assert 'testblogpost' in read(output_dir, 'index.html')
+    detail = read(output_dir, 'detail/{0}/index.html'.format(new_entry.id))
+    assert '<p>aaa</p>' in detail
+    assert 'testblogpost' in read(output_dir, 'feed.atom')
+    assert os.path.exists(os.path.join(output_dir, MANIFEST))
+    assert os.path.exists(os.path.join(output_dir, 'static',
+                                       'stylesheet.css'))
+
+
+def test_export_site_incremental(dbtransaction, new_entry, export_request,
+                                 tmpdir):
+    """Test that only pages of a changed entry are written again."""
+    output_dir = str(tmpdir)
+    export_site(export_request, output_dir)
+    assert export_site(export_request, output_dir) == (0, 0)
+
+    DBSession.query(Entry).get(new_entry.id).title = 'edited'
+    DBSession.flush()
+    written, removed = export_site(export_request, output_dir)
+    assert written == 3  # its detail page, the index and the feed
+    assert 'edited' in read(output_dir, 'index.html')
+
+
+def test_export_site_removes_deleted(dbtransaction, new_entry,
+                                     export_request, tmpdir):
+    """Test that a deleted entry's page is removed."""
+    output_dir = str(tmpdir)
+    export_site(export_request, output_dir)
+    DBSession.query(Entry).filter_by(id=new_entry.id).delete()
+    written, removed = export_site(export_request, output_dir)
+    assert removed == 1
+    assert not os.path.exists(os.path.join(output_dir, 'detail'))
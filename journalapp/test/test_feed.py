@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Test the Atom feed and its conditional GET handling."""
+import datetime
+import pytest
+from pyramid import testing
+from pyramid.request import Request
+from journalapp.feed import entries_state, feed_etag, feed_view
+from journalapp.models import DBSession
+
+
+@pytest.fixture()
+def feed_request():
+    """Return a GET request with the routes and renderer the feed uses."""
+    config = testing.setUp()
+    config.include('pyramid_jinja2')
+    config.add_route('list', '/')
+    config.add_route('detail', '/detail/{entry_id}')
+    config.add_route('feed', '/feed.atom')
+    request = Request.blank('/feed.atom')
+    request.registry = config.registry
+    yield request
+    testing.tearDown()
+
+
+def test_feed_etag_changes():
+    """Test that the ETag follows the entry count and newest update."""
+    now = datetime.datetime(2016, 1, 1)
+    later = now + datetime.timedelta(seconds=1)
+    assert feed_etag(1, now, 20) == feed_etag(1, now, 20)
+    assert feed_etag(1, now, 20) != feed_etag(2, now, 20)
+    assert feed_etag(1, now, 20) != feed_etag(1, later, 20)
+
+
+def test_entries_state(dbtransaction, new_entry):
+    """Test that the state counts entries and finds the newest update."""
+    count, updated = entries_state(DBSession)
+    assert count == 1
+    assert updated == new_entry.updated
+
+
+def test_feed_view(dbtransaction, new_entry, feed_request):
+    """Test that the feed lists entries with their rendered HTML."""
+    response = feed_view(feed_request)
+    assert response.content_type == 'application/atom+xml'
+    assert '<title>testblogpost</title>' in response.text
+    assert '&lt;p&gt;aaa&lt;/p&gt;' in response.text
+    assert response.etag and response.last_modified
+
+
+def test_feed_not_modified(dbtransaction, new_entry, feed_request):
+    """Test that a matching If-None-Match gets a 304 without a body."""
+    etag = feed_view(feed_request).headers['ETag']
+    feed_request.headers['If-None-Match'] = etag
+    response = feed_view(feed_request)
+    assert response.status_int == 304
+    assert response.headers['ETag'] == etag
+
+
+def test_feed_modified_after_edit(dbtransaction, new_entry, feed_request):
+    """Test that editing an entry changes the feed's ETag."""
+    etag = feed_view(feed_request).headers['ETag']
+    new_entry.text = 'bbb'
+    new_entry.updated = new_entry.updated + datetime.timedelta(seconds=1)
+    DBSession.flush()
+    feed_request.headers['If-None-Match'] = etag
+    response = feed_view(feed_request)
+    assert response.status_int == 200
+    assert response.headers['ETag'] != etag
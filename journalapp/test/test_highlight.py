@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Test the cached code-block highlighter."""
+import subprocess
+import sys
+import markdown
+import pytest
+from markdown.extensions.codehilite import CodeHilite
+from journalapp import highlight
+from journalapp.highlight import HighlightCache, highlight_key
+from journalapp.models import render_markdown
+
+SOURCE = u"```python\nprint('<a>' & 1)\n```\n"
+RAW_HTML = u'<pre><code class="language-python">x = 1\n</code></pre>\n'
+
+
+@pytest.fixture()
+def cache(monkeypatch):
+    """Give rendering an empty highlight cache of its own."""
+    cache = HighlightCache(64)
+    monkeypatch.setattr(highlight, '_cache', cache)
+    return cache
+
+
+def codehilite(text):
+    """Return text rendered by stock codehilite and fenced_code."""
+    return markdown.markdown(
+        text, extensions=['codehilite', 'fenced_code'],
+        extension_configs={'codehilite': {'linenums': False,
+                                          'pygments_style': 'colorful'}})
+
+
+@pytest.mark.parametrize('text', [
+    SOURCE + u"\n    :::python\n    x = 1\n\n~~~\nplain\n~~~\n",
+    u"```{.python .wide}\nx = 1\n```\n",
+    u'```python hl_lines="2"\nx = 1\ny = 2\n```\n',
+    u"```{.python\nx = 1\n```\n",
+    u"    #!/bin/sh\n    echo hi\n",
+    RAW_HTML,
+])
+def test_render_matches_codehilite(cache, text):
+    """Test that rendering gives exactly codehilite's HTML, twice."""
+    expected = codehilite(text)
+    assert render_markdown(text) == expected
+    assert render_markdown(text) == expected
+
+
+def test_raw_html_left_alone(cache):
+    """Test that an author's own <pre><code> is not highlighted."""
+    assert render_markdown(RAW_HTML) == RAW_HTML.strip()
+    assert cache.stats()['misses'] == 0
+
+
+def test_attr_list_fence_highlighted(cache):
+    """Test that a fence with an attribute list is highlighted."""
+    html = render_markdown(u"```{.python .wide}\nx = 1\n```\n")
+    assert html.startswith('<div class="wide codehilite">')
+    assert '<span class="n">x</span>' in html
+
+
+def test_highlight_cache_hit_skips_pygments(cache, monkeypatch):
+    """Test that a cached block is not highlighted again."""
+    text = SOURCE + u"\n    :::python\n    x = 1\n"
+    html = render_markdown(text)
+    monkeypatch.setattr(CodeHilite, 'hilite', None)
+    assert render_markdown(text) == html
+    assert cache.stats()['hits'] == 2
+
+
+def test_highlight_cache_disk_tier(tmpdir):
+    """Test that a block written by one cache is read by another."""
+    key = highlight_key('fenced', SOURCE, {'linenums': False})
+    HighlightCache(8, str(tmpdir)).set(key, u'<div>x</div>')
+    cache = HighlightCache(8, str(tmpdir))
+    assert cache.get(key) == u'<div>x</div>'
+    assert cache.stats()['disk_hits'] == 1
+
+
+def test_highlight_key_covers_options():
+    """Test that kind, source and options each change the key."""
+    key = highlight_key('fenced', 'x', {'pygments_style': 'default'})
+    assert key != highlight_key('indented', 'x',
+                                {'pygments_style': 'default'})
+    assert key != highlight_key('fenced', 'y', {'pygments_style': 'default'})
+    assert key != highlight_key('fenced', 'x',
+                                {'pygments_style': 'colorful'})
+
+
+def test_include_skips_markdown():
+    """Test that setting up the cache imports neither Markdown nor Pygments."""
+    subprocess.check_call([sys.executable, '-c', (
+        "import sys\n"
+        "from pyramid.config import Configurator\n"
+        "Configurator().include('journalapp.highlight')\n"
+        "assert 'markdown' not in sys.modules\n"
+        "assert 'pygments' not in sys.modules\n")])
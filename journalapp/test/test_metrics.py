@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Test request and SQL metrics."""
+import pytest
+from pyramid import testing
+from pyramid.response import Response
+from sqlalchemy import create_engine, exc, text
+from journalapp.metrics import (
+    Histogram,
+    Metrics,
+    exposition,
+    install_sql_hooks,
+    metrics_tween_factory,
+)
+
+
+class FakeRoute(object):
+    """Stand-in for a matched route."""
+
+    name = 'list'
+
+
+def test_histogram_cumulative():
+    """Test that bucket samples are cumulative and end with +Inf."""
+    hist = Histogram((1, 5))
+    for value in (0.5, 2, 10):
+        hist.observe(value)
+    samples = list(hist.samples('h', ()))
+    assert [value for name, labels, value in samples] == [1, 2, 3, 12.5, 3]
+    assert samples[2][1] == (('le', '+Inf'),)
+
+
+def test_exposition_format():
+    """Test the text exposition of a labelled counter."""
+    text_out = exposition([
+        ('c_total', 'counter', 'Help.', [('c_total', (('route', 'a"b'),), 3)])
+    ])
+    assert text_out == ('# HELP c_total Help.\n# TYPE c_total counter\n'
+                        'c_total{route="a\\"b"} 3\n')
+
+
+def test_tween_records_request():
+    """Test that the tween records route, status and SQL statements."""
+    engine = create_engine('sqlite://')
+    install_sql_hooks(engine)
+    registry = testing.setUp().registry
+    registry.metrics = metrics = Metrics()
+
+    def handler(request):
+        engine.execute(text('SELECT 1'))
+        engine.execute(text('SELECT 2'))
+        return Response('ok', status=201)
+
+    request = testing.DummyRequest()
+    request.matched_route = FakeRoute()
+    metrics_tween_factory(handler, registry)(request)
+    testing.tearDown()
+
+    assert metrics.in_flight == 0
+    assert metrics.responses == {('list', 201): 1}
+    assert metrics.queries == {'list': 2}
+    assert metrics.latency['list'].count == 1
+
+
+def test_tween_records_errors():
+    """Test that an unhandled exception is recorded as a 500."""
+    registry = testing.setUp().registry
+    registry.metrics = metrics = Metrics()
+
+    def handler(request):
+        raise RuntimeError()
+
+    try:
+        metrics_tween_factory(handler, registry)(testing.DummyRequest())
+    except RuntimeError:
+        pass
+    testing.tearDown()
+    assert metrics.responses == {('__not_found__', 500): 1}
+
+
+def test_includeme_counts_replica_queries():
+    """Test that queries on the replica engine are counted too."""
+    config = testing.setUp(settings={'journal.metrics': 'true'})
+    config.registry.engine = create_engine('sqlite://')
+    config.registry.replica_engine = replica = create_engine('sqlite://')
+    config.include('journalapp.metrics')
+
+    def handler(request):
+        replica.execute(text('SELECT 1'))
+        return Response('ok')
+
+    request = testing.DummyRequest()
+    request.matched_route = FakeRoute()
+    metrics_tween_factory(handler, config.registry)(request)
+    testing.tearDown()
+    assert config.registry.metrics.queries == {'list': 1}
+
+
+def test_failed_statement_forgets_start():
+    """Test that a statement that raises leaves no start time behind."""
+    engine = create_engine('sqlite://')
+    install_sql_hooks(engine)
+    with engine.connect() as conn:
+        with pytest.raises(exc.OperationalError):
+            conn.execute(text('SELEC 1'))
+        assert conn.info['journal_query_start'] == []
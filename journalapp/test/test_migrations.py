@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Test the versioned schema migrations."""
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from journalapp.migrations import MIGRATIONS, applied_versions, upgrade
+
+
+@pytest.fixture()
+def empty_engine():
+    """Return an engine for an empty in-memory database."""
+    return create_engine('sqlite://')
+
+
+@pytest.fixture()
+def legacy_engine():
+    """Return an engine for a database made by the original create_all."""
+    engine = create_engine('sqlite://')
+    engine.execute(text(
+        'CREATE TABLE entries (id INTEGER PRIMARY KEY, '
+        'title VARCHAR(255) UNIQUE, text TEXT, created DATETIME)'))
+    engine.execute(text(
+        "INSERT INTO entries (title, text) VALUES ('old', 'legacy words')"))
+    return engine
+
+
+def test_upgrade_empty(empty_engine):
+    """Test that every migration applies to an empty database."""
+    applied = upgrade(empty_engine)
+    assert applied == [m.version for m in MIGRATIONS]
+    assert applied_versions(empty_engine) == set(applied)
+
+
+def test_upgrade_twice(empty_engine):
+    """Test that a second upgrade has nothing left to apply."""
+    upgrade(empty_engine)
+    assert upgrade(empty_engine) == []
+
+
+def test_upgrade_creates_index(empty_engine):
+    """Test that the list_view sort key is indexed."""
+    upgrade(empty_engine)
+    names = [ix['name'] for ix in inspect(empty_engine).get_indexes('entries')]
+    assert 'ix_entries_created_id' in names
+
+
+def test_upgrade_legacy(legacy_engine):
+    """Test that a create_all-era database gains the new columns."""
+    upgrade(legacy_engine)
+    columns = [c['name']
+               for c in inspect(legacy_engine).get_columns('entries')]
+    assert 'html' in columns and 'html_version' in columns
+
+
+def test_upgrade_legacy_search(legacy_engine):
+    """Test that existing entries are indexed for search."""
+    upgrade(legacy_engine)
+    found = legacy_engine.execute(text(
+        "SELECT rowid FROM entries_fts WHERE entries_fts MATCH 'legacy'"))
+    assert found.fetchall() == [(1,)]
@@ -20,3 +20,59 @@ def test_create_title(dbtransaction, new_entry):
 def test_create_created(dbtransaction, new_entry):
     """Test if model initialized with correct vals."""
     assert new_entry.created is not None
+
+
+def test_render_stores_html(dbtransaction, new_entry):
+    """Test that rendering stores HTML and the renderer version."""
+    from journalapp.models import RENDERER_VERSION
+    new_entry.render()
+    assert new_entry.html == '<p>aaa</p>'
+    assert new_entry.html_version == RENDERER_VERSION
+
+
+def test_markdown_renders_lazily(dbtransaction, new_entry):
+    """Test that reading markdown renders an entry with no stored HTML."""
+    assert new_entry.html is None
+    assert new_entry.markdown == '<p>aaa</p>'
+    assert new_entry.is_rendered
+
+
+def test_markdown_rerenders_stale(dbtransaction, new_entry):
+    """Test that HTML from an older renderer version is replaced on read."""
+    new_entry.html = '<p>old</p>'
+    new_entry.html_version = 0
+    assert new_entry.markdown == '<p>aaa</p>'
+
+
+def test_markdown_uses_stored_html(dbtransaction, new_entry):
+    """Test that current stored HTML is served without re-rendering."""
+    new_entry.render()
+    new_entry.html = '<p>stored</p>'
+    assert new_entry.markdown == '<p>stored</p>'
+
+
+def test_body_deferred(dbtransaction, new_entry):
+    """Test that querying an Entry leaves its body columns unloaded."""
+    from journalapp.models import DBSession, Entry
+    DBSession.expunge(new_entry)
+    entry = DBSession.query(Entry).get(new_entry.id)
+    assert 'text' not in entry.__dict__ and 'html' not in entry.__dict__
+    assert entry.text == 'aaa'
+
+
+def test_edit_bumps_updated(dbtransaction, new_entry):
+    """Test that changing the text moves updated forward."""
+    from journalapp.models import DBSession
+    before = new_entry.updated
+    new_entry.text = 'bbb'
+    DBSession.flush()
+    assert new_entry.updated > before
+
+
+def test_render_keeps_updated(dbtransaction, new_entry):
+    """Test that storing re-rendered HTML does not count as a change."""
+    from journalapp.models import DBSession
+    before = new_entry.updated
+    new_entry.render()
+    DBSession.flush()
+    assert new_entry.updated == before
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Test keyset pagination of the entry list."""
+import datetime
+import pytest
+from journalapp.models import DBSession, Entry
+from journalapp.pagination import (
+    decode_cursor,
+    encode_cursor,
+    keyset_page,
+    page_size_from_settings,
+)
+
+
+@pytest.fixture()
+def five_entries(dbtransaction):
+    """Add five entries, two of them sharing a created timestamp."""
+    base = datetime.datetime(2016, 3, 1, 12, 0, 0)
+    offsets = [0, 1, 2, 2, 3]
+    entries = [Entry(title='page{}'.format(i), text='text',
+                     created=base + datetime.timedelta(minutes=offset))
+               for i, offset in enumerate(offsets)]
+    DBSession.add_all(entries)
+    DBSession.flush()
+    return entries
+
+
+def titles(page):
+    """Return the titles of the rows in a page."""
+    return [row.title for row in page.items]
+
+
+def test_cursor_round_trip():
+    """Test that a cursor decodes back to the sort key it encodes."""
+    created = datetime.datetime(2016, 3, 1, 12, 30, 15, 123456)
+    assert decode_cursor(encode_cursor(created, 42)) == (created, 42)
+
+
+def test_decode_bad_cursor():
+    """Test that a malformed cursor raises ValueError."""
+    with pytest.raises(ValueError):
+        decode_cursor('not-a-cursor')
+
+
+def test_page_size_from_settings():
+    """Test that page size is read from settings with a sane fallback."""
+    assert page_size_from_settings({'journal.page_size': '5'}) == 5
+    assert page_size_from_settings({'journal.page_size': 'x'}) == 20
+    assert page_size_from_settings(None) == 20
+
+
+def test_first_page(five_entries):
+    """Test that the first page holds the newest entries."""
+    page = keyset_page(DBSession.query(Entry), page_size=2)
+    assert titles(page) == ['page4', 'page3']
+    assert page.next_cursor and page.prev_cursor is None
+
+
+def test_walk_forward(five_entries):
+    """Test that following next cursors visits every entry exactly once."""
+    seen = []
+    page = keyset_page(DBSession.query(Entry), page_size=2)
+    seen.extend(titles(page))
+    while page.next_cursor:
+        page = keyset_page(DBSession.query(Entry),
+                           after=page.next_cursor, page_size=2)
+        seen.extend(titles(page))
+    assert seen == ['page4', 'page3', 'page2', 'page1', 'page0']
+
+
+def test_walk_back(five_entries):
+    """Test that a prev cursor returns the preceding page."""
+    first = keyset_page(DBSession.query(Entry), page_size=2)
+    second = keyset_page(DBSession.query(Entry),
+                         after=first.next_cursor, page_size=2)
+    back = keyset_page(DBSession.query(Entry),
+                       before=second.prev_cursor, page_size=2)
+    assert titles(second) == ['page2', 'page1']
+    assert titles(back) == titles(first)
+    assert back.prev_cursor is None and back.next_cursor
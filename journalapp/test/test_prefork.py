@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Test the pre-fork server's helpers."""
+from journalapp.prefork import RequestLimit, bind_socket, worker_count
+
+
+def test_worker_count_from_environ():
+    """Test that WEB_CONCURRENCY sets the number of workers."""
+    assert worker_count({'WEB_CONCURRENCY': '3'}) == 3
+
+
+def test_worker_count_defaults_to_cpus():
+    """Test that there is at least one worker without WEB_CONCURRENCY."""
+    assert worker_count({}) >= 1
+
+
+def test_request_limit_stops_after_last():
+    """Test that stop is called once, as the last request starts."""
+    stops = []
+    app = RequestLimit(lambda environ, start_response: [b'ok'], 2,
+                       lambda: stops.append(True))
+    assert app({}, None) == [b'ok']
+    assert stops == []
+    app({}, None)
+    app({}, None)
+    assert stops == [True]
+
+
+def test_bind_socket_listens():
+    """Test that the shared socket is bound and listening."""
+    sock = bind_socket('127.0.0.1', 0)
+    try:
+        assert sock.getsockname()[1] > 0
+    finally:
+        sock.close()
+
+
+def test_in_flight_counts_until_closed():
+    """Test that a request counts until its response is closed."""
+    from journalapp.prefork import InFlight
+    app = InFlight(lambda environ, start_response: [b'ok'])
+    response = app({}, None)
+    assert app.count == 1
+    assert list(response) == [b'ok']
+    response.close()
+    response.close()
+    assert app.count == 0
+
+
+def test_worker_serves_shared_socket():
+    """Test that a worker is created on a pre-bound socket, idle."""
+    from journalapp.prefork import Worker
+    sock = bind_socket('127.0.0.1', 0)
+    try:
+        worker = Worker(lambda environ, start_response: [b'ok'], sock, 2)
+        assert worker._idle()
+        worker.server.close()
+    finally:
+        sock.close()
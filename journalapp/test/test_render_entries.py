@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""Test the render_entries backfill script."""
+import pytest
+from journalapp.models import DBSession, Entry, RENDERER_VERSION
+from journalapp.scripts.render_entries import (
+    main,
+    render_entries,
+    stale_entry_ids,
+)
+
+
+def test_stale_entry_ids(dbtransaction, new_entry):
+    """Test that an unrendered entry is reported as stale."""
+    assert stale_entry_ids(DBSession) == [new_entry.id]
+
+
+def test_rendered_entry_not_stale(dbtransaction, new_entry):
+    """Test that a freshly rendered entry is not reported as stale."""
+    new_entry.render()
+    DBSession.flush()
+    assert stale_entry_ids(DBSession) == []
+
+
+def test_render_entries(dbtransaction, new_entry):
+    """Test that render_entries stores HTML for the given entries."""
+    assert render_entries(DBSession, [new_entry.id]) == 1
+    entry = DBSession.query(Entry).get(new_entry.id)
+    assert entry.html == '<p>aaa</p>'
+    assert entry.html_version == RENDERER_VERSION
+
+
+def test_main_error():
+    """Test that main does not run without an .ini file."""
+    with pytest.raises(SystemExit):
+        main(['render_entries'])
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Test the delta-compressed revision history of entries."""
+import pytest
+from pyramid import testing
+from journalapp.models import DBSession, EntryRevision
+from journalapp.revisions import (
+    apply_delta,
+    get_revision,
+    line_delta,
+    record_revision,
+    restore_revision,
+    revision_chain,
+    revisions_view,
+)
+
+
+def edit(entry, text, title=None, snapshot_every=5):
+    """Change entry's text the way edit_entry does, recording a revision."""
+    previous = (entry.title, entry.text)
+    entry.text = text
+    if title is not None:
+        entry.title = title
+    revision = record_revision(DBSession, entry, previous, snapshot_every)
+    DBSession.flush()
+    return revision
+
+
+def version(number):
+    """Return the text of an entry's version number."""
+    lines = ['line {0}\n'.format(n) for n in range(40)]
+    lines[number % 40] = 'edited {0}\n'.format(number)
+    return ''.join(lines[:30 + number % 10])
+
+
+@pytest.fixture()
+def revision_request():
+    """Return a request with the journal's settings."""
+    config = testing.setUp(settings={'journal.revisions.snapshot_every': '5'})
+    request = testing.DummyRequest()
+    request.registry = config.registry
+    yield request
+    testing.tearDown()
+
+
+def test_line_delta_round_trip():
+    """Test that applying a delta to the old text gives the new."""
+    old = 'a\nb\nc\nd'
+    for new in ['a\nb\nc\nd', 'a\nX\nc\nd\ne\n', '', 'd', 'b\nc']:
+        assert apply_delta(old, line_delta(old, new)) == new
+    assert apply_delta(None, line_delta(None, 'new')) == 'new'
+
+
+def test_first_edit_stores_original(dbtransaction, new_entry):
+    """Test that the first edit stores the text before it as revision 1."""
+    revision = edit(new_entry, 'bbb')
+    assert revision.number == 2
+    assert get_revision(DBSession, new_entry.id, 1)[1] == 'aaa'
+    assert get_revision(DBSession, new_entry.id, 2)[1] == 'bbb'
+
+
+def test_unchanged_edit_stores_nothing(dbtransaction, new_entry):
+    """Test that saving an entry unchanged records no revision."""
+    assert edit(new_entry, 'aaa') is None
+    assert DBSession.query(EntryRevision).count() == 0
+
+
+def test_every_revision_reconstructs(dbtransaction, new_entry):
+    """Test that every revision rebuilds from a short chain."""
+    for number in range(1, 60):
+        edit(new_entry, version(number))
+    revisions = DBSession.query(EntryRevision).filter_by(
+        entry_id=new_entry.id).order_by(EntryRevision.number).all()
+    assert len(revisions) == 60
+    assert sum(1 for revision in revisions if revision.is_snapshot) >= 12
+    for number in range(1, 60):
+        assert len(revision_chain(DBSession, new_entry.id, number + 1)) <= 5
+        revision, text = get_revision(DBSession, new_entry.id, number + 1)
+        assert text == version(number)
+
+
+def test_get_revision_missing(dbtransaction, new_entry):
+    """Test that asking for a revision that does not exist gives None."""
+    edit(new_entry, 'bbb')
+    assert get_revision(DBSession, new_entry.id, 3) == (None, None)
+
+
+def test_restore_revision(dbtransaction, new_entry, revision_request):
+    """Test that restoring makes an old revision current, as a new one."""
+    edit(new_entry, 'bbb', title='renamed')
+    restored = restore_revision(revision_request, new_entry, 1)
+    assert restored.number == 3
+    assert (new_entry.title, new_entry.text) == ('testblogpost', 'aaa')
+    assert new_entry.html == '<p>aaa</p>'
+
+
+def test_revisions_view(dbtransaction, new_entry, revision_request):
+    """Test that the history lists revisions newest first."""
+    edit(new_entry, 'bbb')
+    revision_request.matchdict = {'entry_id': new_entry.id}
+    numbers = [revision.number
+               for revision in revisions_view(revision_request)['revisions']]
+    assert numbers == [2, 1]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Test full-text search over entries."""
+from journalapp.models import DBSession, Entry
+from journalapp.search import (
+    fts5_query,
+    markup_snippet,
+    rebuild_search_index,
+    search_entries,
+    search_view,
+)
+
+
+def test_fts5_query_quotes_words():
+    """Test that user input is reduced to quoted words."""
+    assert fts5_query(u'spam AND "eggs" -ham*') == u'"spam" "AND" "eggs" "ham"'
+
+
+def test_markup_snippet_escapes():
+    """Test that snippets are escaped before matches are marked."""
+    snippet = markup_snippet(u'<b>\x02spam\x03</b>')
+    assert snippet == u'&lt;b&gt;<mark>spam</mark>&lt;/b&gt;'
+
+
+def test_search_finds_entry(dbtransaction, new_entry):
+    """Test that an entry is found by a word in its text."""
+    results = search_entries(DBSession, u'aaa')
+    assert [result.id for result in results] == [new_entry.id]
+    assert u'<mark>aaa</mark>' in results[0].snippet
+    assert results[0].created == new_entry.created
+
+
+def test_search_ranks_title_first(dbtransaction):
+    """Test that a title match outranks a text match."""
+    DBSession.add_all([
+        Entry(title=u'notes', text=u'a little about pyramid'),
+        Entry(title=u'pyramid', text=u'tweens and views'),
+    ])
+    DBSession.flush()
+    results = search_entries(DBSession, u'pyramid')
+    assert [result.title for result in results] == [u'pyramid', u'notes']
+
+
+def test_search_follows_edits(dbtransaction, new_entry):
+    """Test that edited text is searchable and the old text is not."""
+    new_entry.text = u'bbb'
+    DBSession.flush()
+    assert not search_entries(DBSession, u'aaa')
+    assert search_entries(DBSession, u'bbb')
+
+
+def test_search_follows_deletes(dbtransaction, new_entry):
+    """Test that deleted entries drop out of the index."""
+    DBSession.query(Entry).filter_by(id=new_entry.id).delete()
+    assert not search_entries(DBSession, u'aaa')
+
+
+def test_search_blank(dbtransaction, new_entry):
+    """Test that blank or punctuation-only terms return nothing."""
+    assert search_entries(DBSession, u'  ') == []
+    assert search_entries(DBSession, u'*"') == []
+
+
+def test_rebuild_search_index(dbtransaction, new_entry):
+    """Test that the index can be rebuilt in place."""
+    rebuild_search_index(dbtransaction)
+    assert search_entries(DBSession, u'aaa')
+
+
+def test_search_view(dbtransaction, new_entry, dummy_get_request):
+    """Test that search_view returns results for the q parameter."""
+    dummy_get_request.params = {'q': 'aaa'}
+    response_dict = search_view(dummy_get_request)
+    assert response_dict['q'] == 'aaa'
+    assert response_dict['results'][0].id == new_entry.id
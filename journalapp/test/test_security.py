@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Test password checking on the bounded pool and login throttling."""
+import threading
+import time
+import pytest
+from pyramid import testing
+from pyramid.exceptions import ConfigurationError
+from journalapp.security import (
+    LoginThrottle,
+    PasswordCheckBusy,
+    PasswordChecker,
+    password_manager,
+)
+
+
+@pytest.fixture(scope='module')
+def hashed_pw():
+    """Return a bcrypt hash of 'secret'."""
+    return password_manager().encode('secret')
+
+
+def test_checker_accepts(hashed_pw):
+    """Test that the pool confirms a correct password."""
+    assert PasswordChecker(workers=1, queue_size=0).check(hashed_pw, 'secret')
+
+
+def test_checker_rejects(hashed_pw):
+    """Test that the pool refuses an incorrect password."""
+    checker = PasswordChecker(workers=1, queue_size=0)
+    assert not checker.check(hashed_pw, 'not secret')
+
+
+def test_checker_busy(hashed_pw):
+    """Test that a saturated pool fails fast instead of queueing."""
+    checker = PasswordChecker(workers=1, queue_size=0)
+    checker._slots.acquire()
+    with pytest.raises(PasswordCheckBusy):
+        checker.check(hashed_pw, 'secret')
+    assert checker.rejected == 1
+
+
+def test_checker_frees_slots(hashed_pw):
+    """Test that finished checks give their slot back."""
+    checker = PasswordChecker(workers=1, queue_size=0)
+    for _ in range(3):
+        checker.check(hashed_pw, 'secret')
+
+
+def test_throttle_limits_attempts():
+    """Test that attempts past the limit are refused."""
+    throttle = LoginThrottle(max_attempts=2, window=60)
+    key = ('admin', '127.0.0.1')
+    assert throttle.allow(key) and throttle.allow(key)
+    assert not throttle.allow(key)
+    assert throttle.allow(('admin', '10.0.0.1'))
+
+
+def test_throttle_reset():
+    """Test that reset clears a key's attempts."""
+    throttle = LoginThrottle(max_attempts=1, window=60)
+    throttle.allow('key')
+    throttle.reset('key')
+    assert throttle.allow('key')
+
+
+def test_throttle_window_expires():
+    """Test that attempts older than the window stop counting."""
+    throttle = LoginThrottle(max_attempts=1, window=0.05)
+    throttle.allow('key')
+    time.sleep(0.06)
+    assert throttle.allow('key')
+
+
+def test_throttle_sweeps_stale_keys():
+    """Test that stale keys are dropped once max_keys is reached."""
+    throttle = LoginThrottle(max_attempts=1, window=0.05, max_keys=2)
+    throttle.allow('a')
+    throttle.allow('b')
+    time.sleep(0.06)
+    throttle.allow('c')
+    assert set(throttle._attempts) == set(['c'])
+
+
+def test_checker_bounded_by_threads():
+    """Test that checks in flight stay below the server's thread count."""
+    assert PasswordChecker(workers=2, queue_size=8, threads=4).slots == 3
+    assert PasswordChecker(workers=2, queue_size=8, threads=16).slots == 10
+
+
+def test_includeme_needs_spare_thread():
+    """Test that a server too small to spare a thread fails at startup."""
+    config = testing.setUp(settings={'journal.threads': '1'})
+    try:
+        with pytest.raises(ConfigurationError):
+            config.include('journalapp.security')
+    finally:
+        testing.tearDown()
+
+
+def test_checker_timeout_is_busy(hashed_pw):
+    """Test that a check left waiting too long fails as busy."""
+    checker = PasswordChecker(workers=1, queue_size=0, timeout=0.05)
+    release = threading.Event()
+    checker._executor.submit(release.wait)
+    with pytest.raises(PasswordCheckBusy):
+        checker.check(hashed_pw, 'secret')
+    assert checker.timed_out == 1
+    release.set()
+    checker.timeout = 30
+    assert checker.check(hashed_pw, 'secret')
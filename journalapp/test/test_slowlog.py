@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Test the slow query log."""
+import json
+import logging
+import pytest
+from pyramid import testing
+from sqlalchemy import create_engine, exc, text
+from journalapp.slowlog import SlowQueryLogger, is_explainable
+
+
+@pytest.fixture()
+def engine():
+    """Return an in-memory engine with a small table."""
+    engine = create_engine('sqlite://')
+    engine.execute(text('CREATE TABLE t (id INTEGER PRIMARY KEY, x TEXT)'))
+    return engine
+
+
+def logged(caplog):
+    """Return the JSON records written to the slow query log."""
+    return [json.loads(record.getMessage()) for record in caplog.records
+            if record.name == 'journalapp.slowquery']
+
+
+def test_is_explainable():
+    """Test that only plain SELECTs are explained."""
+    assert is_explainable('  select 1')
+    assert not is_explainable('DELETE FROM t')
+    assert not is_explainable(
+        'WITH gone AS (DELETE FROM t RETURNING id) SELECT * FROM gone')
+
+
+def test_logs_slow_select_with_plan(engine, caplog):
+    """Test that a slow SELECT is logged with parameters and its plan."""
+    SlowQueryLogger(0).install(engine)
+    with caplog.at_level(logging.WARNING, logger='journalapp.slowquery'):
+        engine.execute(text('SELECT * FROM t WHERE x = :x'), x='spam')
+    record = logged(caplog)[-1]
+    assert record['statement'] == 'SELECT * FROM t WHERE x = ?'
+    assert record['parameters'] == ['spam']
+    assert any('t' in step for step in record['plan'])
+
+
+def test_skips_plan_for_writes(engine, caplog):
+    """Test that writes are logged without running EXPLAIN."""
+    SlowQueryLogger(0).install(engine)
+    with caplog.at_level(logging.WARNING, logger='journalapp.slowquery'):
+        engine.execute(text("INSERT INTO t (x) VALUES ('spam')"))
+    record = logged(caplog)[-1]
+    assert 'plan' not in record
+
+
+def test_ignores_fast_queries(engine, caplog):
+    """Test that statements under the threshold are not logged."""
+    SlowQueryLogger(60000).install(engine)
+    with caplog.at_level(logging.WARNING, logger='journalapp.slowquery'):
+        engine.execute(text('SELECT * FROM t'))
+    assert logged(caplog) == []
+
+
+def test_includeme_covers_replica(engine, caplog):
+    """Test that statements on the replica engine are logged too."""
+    config = testing.setUp(settings={'journal.slow_query_ms': '0.000001'})
+    config.registry.engine = create_engine('sqlite://')
+    config.registry.replica_engine = engine
+    config.include('journalapp.slowlog')
+    testing.tearDown()
+    with caplog.at_level(logging.WARNING, logger='journalapp.slowquery'):
+        engine.execute(text('SELECT * FROM t'))
+    assert logged(caplog)[-1]['statement'] == 'SELECT * FROM t'
+
+
+def test_failed_statement_forgets_start(engine):
+    """Test that a statement that raises leaves no start time behind."""
+    SlowQueryLogger(0).install(engine)
+    with engine.connect() as conn:
+        with pytest.raises(exc.OperationalError):
+            conn.execute(text('SELECT * FROM missing'))
+        assert conn.info['journal_slow_start'] == []
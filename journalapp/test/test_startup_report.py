@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""Test parsing of -X importtime output for the startup report."""
+from journalapp.scripts.startup_report import by_package, parse_importtime
+
+OUTPUT = '''import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   markdown.util
+import time:       300 |        420 | markdown
+import time:        50 |         50 |     sqlalchemy.sql
+import time:       900 |        950 | sqlalchemy
+Traceback lines are ignored
+'''
+
+
+def test_parse_importtime():
+    """Test that rows are read and the header is skipped."""
+    rows = parse_importtime(OUTPUT)
+    assert rows[0] == ('markdown.util', 120, 120)
+    assert len(rows) == 4
+
+
+def test_by_package():
+    """Test that self times add up per top-level package."""
+    totals = by_package(parse_importtime(OUTPUT))
+    assert totals == [('sqlalchemy', 950), ('markdown', 420)]
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Test the shared Jinja2 bytecode cache and template precompilation."""
+import os
+from jinja2 import DictLoader, Environment
+from pyramid import testing
+from journalapp.templating import (
+    AtomicBytecodeCache,
+    bytecode_cache_from_settings,
+    precompile,
+    template_names,
+)
+
+
+def test_bytecode_cache_off_by_default():
+    """Test that no cache is made unless the settings enable it."""
+    assert bytecode_cache_from_settings({}) is None
+
+
+def test_bytecode_cache_creates_directory(tmpdir):
+    """Test that the cache directory is created when missing."""
+    directory = str(tmpdir.join('cache'))
+    cache = bytecode_cache_from_settings({
+        'jinja2.bytecode_caching': 'true',
+        'jinja2.bytecode_caching_directory': directory,
+    })
+    assert isinstance(cache, AtomicBytecodeCache)
+    assert os.path.isdir(directory)
+
+
+def test_precompile_follows_extends(tmpdir):
+    """Test that a parent template is compiled for each child using it."""
+    cache = AtomicBytecodeCache(str(tmpdir))
+    environment = Environment(
+        loader=DictLoader({'base': '{% block body %}{% endblock %}',
+                           'a': '{% extends "base" %}',
+                           'b': '{% extends "base" %}'}),
+        bytecode_cache=cache)
+    assert precompile(environment, ['a', 'b']) == 3
+    assert len([name for name in os.listdir(str(tmpdir))
+                if not name.endswith('.tmp')]) == 3
+
+
+def test_stale_bytecode_not_used(tmpdir):
+    """Test that changed source is recompiled despite cached bytecode."""
+    cache = AtomicBytecodeCache(str(tmpdir))
+    templates = {'page': 'old'}
+    Environment(loader=DictLoader(templates),
+                bytecode_cache=cache).get_template('page')
+    templates['page'] = 'new'
+    environment = Environment(loader=DictLoader(templates),
+                              bytecode_cache=cache)
+    assert environment.get_template('page').render() == 'new'
+
+
+def test_precompile_app_templates(tmpdir):
+    """Test that every app template compiles into the configured cache."""
+    config = testing.setUp(settings={
+        'jinja2.bytecode_caching': 'true',
+        'jinja2.bytecode_caching_directory': str(tmpdir),
+    })
+    try:
+        config.include('journalapp.templating')
+        config.include('pyramid_jinja2')
+        config.commit()
+        count = precompile(config.get_jinja2_environment(), template_names())
+    finally:
+        testing.tearDown()
+    assert count > len(template_names())
+    assert len(os.listdir(str(tmpdir))) == count
@@ -12,10 +12,18 @@ from journalapp.forms import EditEntryForm, AddEntryForm
 
 
 def test_list_view(dbtransaction, new_entry, dummy_get_request):
-    """Test that list_view returns a Query of Entries."""
+    """Test that list_view returns rows for the listed Entries."""
     response_dict = list_view(dummy_get_request)
     entries = response_dict['entries']
-    assert entries[0] == new_entry
+    assert entries[0].id == new_entry.id
+    assert entries[0].title == new_entry.title
+
+
+def test_list_view_skips_body(dbtransaction, new_entry, dummy_get_request):
+    """Test that list_view rows carry only the listed columns."""
+    response_dict = list_view(dummy_get_request)
+    row = response_dict['entries'][0]
+    assert not hasattr(row, 'text') and not hasattr(row, 'html')
 
 
 def test_detail_view(dbtransaction, new_entry, dummy_get_request):
@@ -81,3 +89,15 @@ def test_edit_error(dbtransaction, dummy_get_request):
     dummy_get_request.matchdict = {'entry_id': 9999}
     response = edit_entry(dummy_get_request)
     assert response.status_code == 404
+
+
+def test_list_view_pages(dbtransaction, new_entry, dummy_get_request):
+    """Test that list_view links to older entries past the page size."""
+    from journalapp.models import DBSession, Entry
+    DBSession.add(Entry(title='older', text='bbb'))
+    DBSession.flush()
+    dummy_get_request.registry.settings['journal.page_size'] = '1'
+    response_dict = list_view(dummy_get_request)
+    assert len(response_dict['entries']) == 1
+    assert 'after=' in response_dict['next_url']
+    assert response_dict['prev_url'] is None
@@ -1,31 +1,69 @@
 # -*- coding: utf-8 -*-
-"""SQLAlchemy views to render learning journal."""
-from pyramid.httpexceptions import HTTPFound
+"""SQLAlchemy views to render learning journal.
+
+The forms module, and with it wtforms, is imported inside the views that
+use it so that workers serving only reads never load it.
+"""
+from pyramid.httpexceptions import HTTPBadRequest, HTTPFound
 from pyramid.response import Response
 from pyramid.security import remember, forget
-from pyramid.view import view_config
+from sqlalchemy.orm import undefer_group
 
-from .models import DBSession, Entry
-from .forms import EditEntryForm, AddEntryForm, LoginForm
-from .security import check_pw
+from .cache import cached_page, get_page_cache, invalidate_pages
+from .db import replica_reads
+from .models import DBSession, Entry, EntryRevision
+from .pagination import keyset_page, page_size_from_settings
+from .revisions import record_revision, snapshot_every_from_settings
+from .security import (
+    PasswordCheckBusy,
+    login_throttle_key,
+    verify_password,
+)
 
 
-@view_config(route_name='list',
-             renderer='templates/list.jinja2',
-             permission='view')
 def list_view(request):
-    """Return rendered list of entries for journal home page."""
-    entries = DBSession.query(Entry).order_by(Entry.created.desc())
-    return {'entries': entries}
+    """Return rendered page of entries for journal home page."""
+    page_size = page_size_from_settings(request.registry.settings)
+    try:
+        page = keyset_page(list_query(),
+                           after=request.params.get('after'),
+                           before=request.params.get('before'),
+                           page_size=page_size)
+    except ValueError:
+        raise HTTPBadRequest('Invalid page cursor.')
+    return list_values(request, page)
+
+
+def list_values(request, page):
+    """Return the list template's values for a Page of entries."""
+    next_url = prev_url = None
+    if page.next_cursor:
+        next_url = request.route_url('list',
+                                     _query={'after': page.next_cursor})
+    if page.prev_cursor:
+        prev_url = request.route_url('list',
+                                     _query={'before': page.prev_cursor})
+    return {'entries': page.items, 'next_url': next_url, 'prev_url': prev_url}
+
+
+def list_query():
+    """Return a query for the columns the entry list shows, without bodies.
+
+    Rows are plain named tuples rather than Entry instances, so listing
+    skips the identity map and never fetches the text or html columns.
+    """
+    return DBSession.query(Entry.id, Entry.title, Entry.created)
+
+
+def get_entry(entry_id):
+    """Return the Entry with the given id with its body loaded, or None."""
+    return DBSession.query(Entry).options(undefer_group('body')).get(entry_id)
 
 
-@view_config(route_name='detail',
-             renderer='templates/detail.jinja2',
-             permission='view')
 def detail_view(request):
     """Return rendered single entry for entry detail page."""
     entry_id = request.matchdict['entry_id']
-    entry = DBSession.query(Entry).get(entry_id)
+    entry = get_entry(entry_id)
     if not entry:
         return Response('Post {} does not exist.'.format(entry_id),
                         content_type='text/plain',
@@ -33,29 +71,27 @@ def detail_view(request):
     return {'entry': entry}
 
 
-@view_config(route_name='add',
-             renderer='templates/add-edit.jinja2',
-             permission='create')
 def add_entry(request):
     """Display a empty form, when submitted, return to the detail page."""
+    from .forms import AddEntryForm
     context = get_auth_tkt_from_request(request)
     form = AddEntryForm(request.POST, csrf_context=context)
     if request.method == "POST" and form.validate():
         new_entry = Entry(title=form.title.data, text=form.text.data)
+        new_entry.render()
         DBSession.add(new_entry)
         DBSession.flush()
+        invalidate_pages(request, new_entry.id)
         next_url = request.route_url('detail', entry_id=new_entry.id)
         return HTTPFound(location=next_url)
     return {'form': form}
 
 
-@view_config(route_name='edit',
-             renderer='templates/add-edit.jinja2',
-             permission='edit')
 def edit_entry(request):
     """Display editing page to edit entries, return to detail page."""
+    from .forms import EditEntryForm
     entry_id = request.matchdict['entry_id']
-    entry = DBSession.query(Entry).get(entry_id)
+    entry = get_entry(entry_id)
     if not entry:
         return Response('Post {} does not exist.'.format(entry_id),
                         content_type='text/plain',
@@ -63,19 +99,23 @@ def edit_entry(request):
     context = get_auth_tkt_from_request(request)
     form = EditEntryForm(request.POST, entry, csrf_context=context)
     if request.method == "POST" and form.validate():
+        previous = (entry.title, entry.text)
         form.populate_obj(entry)
+        settings = request.registry.settings
+        record_revision(DBSession, entry, previous,
+                        snapshot_every_from_settings(settings))
+        entry.render()
         DBSession.add(entry)
         DBSession.flush()
+        invalidate_pages(request, entry.id)
         next_url = request.route_url('detail', entry_id=entry.id)
         return HTTPFound(location=next_url)
     return {'form': form}
 
 
-@view_config(route_name='login',
-             renderer='templates/login.jinja2',
-             permission='view')
 def login(request):
     """Log user in."""
+    from .forms import LoginForm
     context = get_auth_tkt_from_request(request)
     form = LoginForm(request.POST, csrf_context=context)
     if request.method == 'POST' and form.validate():
@@ -87,8 +127,24 @@ def login(request):
         real_username = settings.get('auth.username', '')
         hashed_pw = settings.get('auth.password', '')
 
-        if username == real_username:
-            if check_pw(hashed_pw, password):
+        throttle = getattr(request.registry, 'login_throttle', None)
+        throttle_key = login_throttle_key(request, username)
+        if throttle is not None and not throttle.allow(throttle_key):
+            request.response.status_int = 429
+            form.password.errors.append(
+                'Too many login attempts. Try again later.')
+        elif username == real_username:
+            try:
+                valid = verify_password(request, hashed_pw, password)
+            except PasswordCheckBusy:
+                request.response.status_int = 503
+                request.response.headers['Retry-After'] = '5'
+                form.password.errors.append(
+                    'The server is busy. Try again in a moment.')
+                return {'form': form}
+            if valid:
+                if throttle is not None:
+                    throttle.reset(throttle_key)
                 headers = remember(request, username)
                 return HTTPFound(location=request.route_url('list'),
                                  headers=headers)
@@ -99,8 +155,6 @@ def login(request):
     return {'form': form}
 
 
-@view_config(route_name='logout',
-             permission='view')
 def logout(request):
     """Log user out."""
     headers = forget(request)
@@ -108,27 +162,35 @@ def logout(request):
                      headers=headers)
 
 
-@view_config(route_name='logged_out',
-             renderer='templates/logout.jinja2',
-             permission='view')
 def logged_out(request):
     """Simple text landing page after logout."""
     return {}
 
 
-@view_config(route_name='delete_all', permission='delete')
 def _delete_all(request):
+    DBSession.query(EntryRevision).delete()
     DBSession.query(Entry).delete()
+    invalidate_pages(request, everything=True)
     return HTTPFound(location=request.route_url('list'))
 
 
-@view_config(route_name='delete_one', permission='delete')
 def _delete_one(request):
     entry_id = request.matchdict['entry_id']
-    DBSession.query(Entry).get(entry_id).delete()
+    entry = DBSession.query(Entry).get(entry_id)
+    if entry:
+        DBSession.query(EntryRevision).filter(
+            EntryRevision.entry_id == entry.id).delete()
+        DBSession.delete(entry)
+        invalidate_pages(request, entry_id)
     return HTTPFound(location=request.route_url('list'))
 
 
+def page_cache_stats(request):
+    """Return the page cache counters as JSON."""
+    cache = get_page_cache(request)
+    return cache.stats() if cache is not None else {}
+
+
 def get_auth_tkt_from_request(request):
     """Get an auth_tkt from a request."""
     request_cookies = request.headers.items()
@@ -137,3 +199,51 @@ def get_auth_tkt_from_request(request):
     if not auth_tkts:
         return ''
     return auth_tkts[0]
+
+
+def includeme(config):
+    """Register this module's views.
+
+    Read-only pages read from the replica when one is configured; the
+    add, edit and delete views always use the primary.
+    """
+    config.add_view(list_view,
+                    route_name='list',
+                    renderer='templates/list.jinja2',
+                    permission='view',
+                    decorator=(cached_page, replica_reads))
+    config.add_view(detail_view,
+                    route_name='detail',
+                    renderer='templates/detail.jinja2',
+                    permission='view',
+                    decorator=(cached_page, replica_reads))
+    config.add_view(add_entry,
+                    route_name='add',
+                    renderer='templates/add-edit.jinja2',
+                    permission='create')
+    config.add_view(edit_entry,
+                    route_name='edit',
+                    renderer='templates/add-edit.jinja2',
+                    permission='edit')
+    config.add_view(login,
+                    route_name='login',
+                    renderer='templates/login.jinja2',
+                    permission='view')
+    config.add_view(logout,
+                    route_name='logout',
+                    permission='view')
+    config.add_view(logged_out,
+                    route_name='logged_out',
+                    renderer='templates/logout.jinja2',
+                    permission='view',
+                    decorator=replica_reads)
+    config.add_view(_delete_all,
+                    route_name='delete_all',
+                    permission='delete')
+    config.add_view(_delete_one,
+                    route_name='delete_one',
+                    permission='delete')
+    config.add_view(page_cache_stats,
+                    route_name='page_cache_stats',
+                    renderer='json',
+                    permission='delete')
@@ -1,11 +1,40 @@
-"""Run Learning Journal app on Heroku."""
+"""Run Learning Journal app on Heroku.
+
+With WEB_CONCURRENCY (default: the CPU count) above 1, a master process
+forks that many waitress workers sharing the listening socket; see
+journalapp.prefork. MAX_REQUESTS recycles each worker after that many
+requests, spread by up to MAX_REQUESTS_JITTER more. SIGHUP to the
+master reloads production.ini; new code needs a restart.
+"""
 import os
 
 from paste.deploy import loadapp
+from pyramid.paster import get_appsettings, setup_logging
 from waitress import serve
 
+from journalapp.db import server_threads
+from journalapp.prefork import Master, bind_socket, worker_count
+
+CONFIG = 'production.ini'
+
+
+def load_app():
+    """Load the WSGI app from the production config."""
+    return loadapp('config:' + CONFIG, relative_to='.')
+
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
-    app = loadapp('config:production.ini', relative_to='.')
+    setup_logging(CONFIG)
+    workers = worker_count()
 
-    serve(app, host='0.0.0.0', port=port)
+    if workers > 1 and hasattr(os, 'fork'):
+        threads = server_threads(get_appsettings(CONFIG))
+        Master(load_app, bind_socket('0.0.0.0', port), workers, threads,
+               max_requests=int(os.environ.get('MAX_REQUESTS', 0)),
+               max_requests_jitter=int(
+                   os.environ.get('MAX_REQUESTS_JITTER', 0))).run()
+    else:
+        app = load_app()
+        serve(app, host='0.0.0.0', port=port,
+              threads=server_threads(app.registry.settings))
@@ -17,17 +17,19 @@ requires = [
     'SQLAlchemy',
     'transaction',
     'zope.sqlalchemy',
-    'waitress',
+    'waitress>=1.2',
     'psycopg2',
     'wtforms',
     'markdown',
     'cryptacular',
     'requests',
+    'futures; python_version < "3"',
 ]
 
 test_require = ['pytest', 'pytest-watch', 'tox', 'webtest',
                 'pytest-cov', 'cryptacular']
 dev_requires = ['ipython', 'pyramid-ipython', 'pyramid_debugtoolbar']
+asgi_requires = ['uvicorn', 'aiosqlite', 'asyncpg']
 
 setup(name='journalapp',
       version='0.2',
@@ -51,12 +53,22 @@ setup(name='journalapp',
       extras_require={
           'test': test_require,
           'dev': dev_requires,
+          'asgi': asgi_requires,
       },
       entry_points="""\
       [paste.app_factory]
       main = journalapp:main
       [console_scripts]
       initialize_db = journalapp.scripts.initializedb:main
+      upgrade_db = journalapp.scripts.upgradedb:main
       migrate = journalapp.scripts.get_crisewing_api:main
+      render_entries = journalapp.scripts.render_entries:main
+      rebuild_search_index = journalapp.scripts.rebuild_search:main
+      startup_report = journalapp.scripts.startup_report:main
+      build_assets = journalapp.scripts.build_assets:main
+      export_site = journalapp.scripts.export_site:main
+      precompile_templates = journalapp.scripts.precompile_templates:main
+      dump_entries = journalapp.scripts.dump_entries:main
+      restore_entries = journalapp.scripts.restore_entries:main
       """,
       )